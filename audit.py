@@ -0,0 +1,156 @@
+"""Write-behind audit log of the vault access
+
+Recording an event only puts a tuple on an in-memory queue, a background thread
+writes the queued events with multi-row inserts. A batch is written once it holds
+AUDIT_BATCH_SIZE events or its oldest event waited AUDIT_FLUSH_INTERVAL seconds,
+so the interactive path never waits for the database.
+"""
+
+import getpass
+
+import logging
+
+import queue
+
+import socket
+
+import threading
+
+import time
+
+from datetime import datetime, timezone
+
+from config import AUDIT_ENABLED, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_QUEUE_SIZE
+
+logger = logging.getLogger('password_manager.audit')
+
+LOOKUP = 'lookup'
+LOOKUP_MISSING = 'lookup_missing'
+SAVE = 'save'
+UNLOCK = 'unlock'
+UNLOCK_FAILED = 'unlock_failed'
+
+
+def client_name(program) -> str:
+    """Returns 'user@host/program' identifying the client in the audit log"""
+
+    try:
+        user = getpass.getuser()
+    except (KeyError, OSError):
+        user = 'unknown'
+    return f'{user}@{socket.gethostname()}/{program}'
+
+
+class AuditLog:
+    """Queues audit events and writes them to the storage in the background.
+
+    Attributes:
+    - data_base: the VaultStorage receiving the events
+    - client: the name of the client stored with every event
+    - dropped: the number of events dropped because the queue was full
+
+    Methods:
+    - record(event_type, account): queues an event without blocking
+    - close(timeout): writes the queued events and stops the writer thread
+    """
+
+    def __init__(self, data_base, client, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL, queue_size=AUDIT_QUEUE_SIZE,
+                 enabled=AUDIT_ENABLED) -> None:
+        """Starts the writer thread.
+
+        Args:
+            data_base (VaultStorage): The storage receiving the events.
+            client (str): The name of the client, see client_name().
+            batch_size (int): Number of events written in one insert.
+            flush_interval (float): Seconds an event waits at most before it is written.
+            queue_size (int): Number of events held in memory at most.
+            enabled (bool): With auditing off record() does nothing.
+        """
+
+        self.data_base = data_base
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.enabled = enabled
+
+        self._events = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        if enabled:
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def record(self, event_type, account=None) -> None:
+        """Queues an event, it is dropped with a warning if the queue is full.
+
+        Args:
+            event_type (str): One of the event constants of this module.
+            account (str): The account the event is about.
+        """
+
+        if not self.enabled:
+            return
+        event = (event_type, account, self.client, datetime.now(timezone.utc).isoformat())
+        try:
+            self._events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning('audit queue full, %d events dropped', self.dropped)
+
+    def close(self, timeout=None) -> None:
+        """Writes the queued events and stops the writer thread.
+
+        Args:
+            timeout (float): Seconds to wait for the writer, forever if None.
+        """
+
+        if self._thread is None:
+            return
+        self._events.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _write(self, batch) -> bool:
+        """Inserts the batch, returns False if it has to be retried."""
+
+        try:
+            self.data_base.insert_audit_events(batch)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning('writing %d audit events failed: %s', len(batch),
+                           type(error).__name__)
+            return False
+        return True
+
+    def _run(self) -> None:
+        """Collects the events into batches and writes them on the writer thread."""
+
+        batch = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                event = self._events.get(timeout=timeout)
+            except queue.Empty:
+                event = False
+
+            if event is None:
+                stopping = True
+            elif event:
+                batch.append(event)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            full = len(batch) >= self.batch_size
+            due = deadline is not None and time.monotonic() >= deadline
+            if batch and (full or due or stopping):
+                if self._write(batch) or stopping:
+                    batch = []
+                    deadline = None
+                else:
+                    overflow = len(batch) - self._events.maxsize
+                    if overflow > 0:
+                        del batch[:overflow]
+                        self.dropped += overflow
+                    deadline = time.monotonic() + self.flush_interval
@@ -0,0 +1,233 @@
+"""Micro-benchmarks of the password manager hot paths
+
+Runs without a display and without a database server: the storage methods are
+measured against an in-memory SQLite database.
+
+Usage:
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --baseline results.json --threshold 0.2
+"""
+
+import argparse
+
+import json
+
+import platform
+
+import random
+
+import secrets
+
+import statistics
+
+import string
+
+import sys
+
+import timeit
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+import password_generator
+from encryption import EncryptedStorage, VaultCipher
+from password_generator import PassWord, SYMBOLS
+from password_manager import generate_message
+from password_policy import PasswordPolicy
+from sqlite_db import SQLitePasswordManagerDatabase
+
+LENGTHS = (4, 8, 16, 32, 64)
+MESSAGE_ROWS = (10, 100, 1000, 10000)
+VAULT_SIZE = 10000
+REPEAT = 5
+SEED = 1996
+
+
+def measure(function, number, repeat=REPEAT) -> dict:
+    """Times number calls of the function repeat times
+
+    Returns:
+        dict: The median and the best time of one call in nanoseconds.
+    """
+
+    timings = [timing / number * 1e9
+               for timing in timeit.repeat(function, number=number, repeat=repeat)]
+    return {'ns_per_op': statistics.median(timings), 'best_ns_per_op': min(timings)}
+
+
+def former_set_password(length) -> int:
+    """Draws a password like set_password did before generation was valid by construction
+
+    Returns:
+        int: The number of passwords thrown away because they missed a character class.
+    """
+
+    retries = 0
+    while not PassWord.is_password_valid(''.join(secrets.choice(SYMBOLS)
+                                                 for _ in range(length))):
+        retries += 1
+    return retries
+
+
+def breach_retries(length, samples=2000) -> float:
+    """Returns the mean number of passwords generate_password drew again after the
+    breach filter rejected them"""
+
+    checks = 0
+    is_breached = password_generator.is_breached
+
+    def counting_is_breached(password) -> bool:
+        nonlocal checks
+        checks += 1
+        return is_breached(password)
+
+    password_generator.is_breached = counting_is_breached
+    try:
+        for _ in range(samples):
+            PassWord.generate_password(length)
+    finally:
+        password_generator.is_breached = is_breached
+    return (checks - samples) / samples
+
+
+def bench_generator(results) -> None:
+    """Password generation across lengths"""
+
+    for length in LENGTHS:
+        results[f'generate_password[{length}]'] = measure(
+            lambda length=length: PassWord.generate_password(length), 2000)
+        results[f'set_password[{length}]'] = measure(lambda length=length: PassWord(length), 2000)
+        results[f'generate_many[{length}]'] = measure(
+            lambda length=length: PassWord.generate_many(1000, length), 5)
+        results[f'generate_many[{length}]']['ns_per_op'] /= 1000
+        results[f'generate_many[{length}]']['best_ns_per_op'] /= 1000
+        results[f'generate_password[{length}]']['retries'] = breach_retries(length)
+        results[f'former_set_password[{length}]'] = measure(
+            lambda length=length: former_set_password(length), 200)
+        results[f'former_set_password[{length}]']['retries'] = statistics.mean(
+            former_set_password(length) for _ in range(2000))
+
+
+def bench_validator(results) -> None:
+    """Validation throughput"""
+
+    passwords = PassWord.generate_many(1000, 16)
+    policy = PasswordPolicy()
+    results['is_password_valid'] = measure(
+        lambda: [PassWord.is_password_valid(password) for password in passwords], 20)
+    results['policy_evaluate'] = measure(
+        lambda: [policy.evaluate(password, 'account') for password in passwords], 20)
+    for name in ('is_password_valid', 'policy_evaluate'):
+        results[name]['ns_per_op'] /= len(passwords)
+        results[name]['best_ns_per_op'] /= len(passwords)
+
+
+def bench_message(results) -> None:
+    """Result formatting scaling with the number of rows"""
+
+    rng = random.Random(SEED)
+    for count in MESSAGE_ROWS:
+        rows = [(f'account{rng.randrange(count // 2 + 1)}', 'password') for _ in range(count)]
+        results[f'generate_message[{count}]'] = measure(lambda rows=rows: generate_message(rows),
+                                                        max(1, 10000 // count))
+
+
+def bench_storage(results) -> None:
+    """Storage methods against an in-memory SQLite database"""
+
+    rng = random.Random(SEED)
+    data_base = SQLitePasswordManagerDatabase(':memory:')
+    data_base.migrate()
+    data_base.insert_secret_word_and_hint('hash', 'hint')
+    accounts = [f'{"".join(rng.choices(string.ascii_lowercase, k=8))}{i}'
+                for i in range(VAULT_SIZE)]
+
+    results[f'import_accounts[{VAULT_SIZE}]'] = measure(
+        lambda: data_base.import_accounts(((account, 'password') for account in accounts)),
+        1, repeat=3)
+    results['insert_account_and_password'] = measure(
+        lambda: data_base.insert_account_and_password(rng.choice(accounts), 'password'), 500)
+    results['select_password_from_db'] = measure(
+        lambda: data_base.select_password_from_db(rng.choice(accounts)), 2000)
+    results['select_secret_word_from_db'] = measure(data_base.select_secret_word_from_db, 2000)
+    results['search_accounts'] = measure(
+        lambda: data_base.search_accounts(rng.choice(accounts)[:3]), 200)
+    results['select_accounts_page'] = measure(
+        lambda: data_base.select_accounts_page(rng.randrange(VAULT_SIZE)), 1000)
+    results[f'iter_accounts[{VAULT_SIZE}]'] = measure(
+        lambda: sum(1 for _ in data_base.iter_accounts()), 1, repeat=3)
+    data_base.close_db_connection()
+
+
+def bench_encryption(results) -> None:
+    """Per-password encryption cost and an encrypted lookup against in-memory SQLite"""
+
+    rng = random.Random(SEED)
+    cipher = VaultCipher(rng.randbytes(32))
+    password = PassWord.generate_password(16)
+    encrypted = cipher.encrypt('account', password)
+    results['cipher.encrypt'] = measure(lambda: cipher.encrypt('account', password), 5000)
+    results['cipher.decrypt'] = measure(lambda: cipher.decrypt('account', encrypted), 5000)
+
+    data_base = EncryptedStorage(SQLitePasswordManagerDatabase(':memory:'))
+    data_base.migrate()
+    data_base.unlock(cipher.key)
+    accounts = [f'account{i}' for i in range(VAULT_SIZE)]
+    data_base.import_accounts((account, password) for account in accounts)
+    results['encrypted.select_password_from_db'] = measure(
+        lambda: data_base.select_password_from_db(rng.choice(accounts)), 2000)
+    data_base.close_db_connection()
+
+
+BENCHMARKS = (bench_generator, bench_validator, bench_message, bench_storage, bench_encryption)
+
+
+def compare(results, baseline, threshold) -> list:
+    """Returns the benchmarks slower than the baseline by more than threshold"""
+
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name, {}).get('ns_per_op')
+        if before and 'ns_per_op' in result and result['ns_per_op'] > before * (1 + threshold):
+            regressions.append(f"{name}: {before:.0f} ns -> {result['ns_per_op']:.0f} ns")
+    return regressions
+
+
+def main(argv=None) -> int:
+    """Runs the benchmarks, writes the JSON report and checks for regressions"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown against the baseline, 0.2 is 20%%')
+    args = parser.parse_args(argv)
+
+    random.seed(SEED)
+    results = {}
+    for benchmark in BENCHMARKS:
+        benchmark(results)
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(),
+              'results': results}
+    for name, result in results.items():
+        timing = f"{result['ns_per_op']:>14.0f} ns/op" if 'ns_per_op' in result else ' ' * 20
+        retries = f"  retries {result['retries']:.2f}" if 'retries' in result else ''
+        print(f'{name:<36}{timing}{retries}')
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))['results']
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""Offline check of passwords against a breached password list
+
+A Bloom filter is built once from a local list of SHA-1 hashes, such as the
+Have I Been Pwned 'SHA1:count' download, and memory-mapped for the lookups.
+Neither the list nor the filter is read into memory: the operating system pages
+in the few bytes a lookup touches, so a multi-GB list is usable on a laptop and
+no password ever leaves the machine.
+
+A Bloom filter has no false negatives. With the default BREACH_ERROR_RATE, one
+password in a thousand is reported as breached although it is not.
+"""
+
+import hashlib
+
+import math
+
+import mmap
+
+import struct
+
+from config import BREACH_FILTER_PATH, BREACH_ERROR_RATE
+
+MAGIC = b'PMBLOOM1'
+HEADER = struct.Struct('<8sQIQ')
+SHA1_HEX_SIZE = 40
+
+_filters = {}
+
+
+def filter_parameters(count, error_rate) -> tuple:
+    """Returns the (number of bits, number of hash functions) of the optimal filter
+
+    Args:
+        count (int): Number of hashes the filter holds.
+        error_rate (float): Acceptable false positive rate.
+    """
+
+    bits = max(8, math.ceil(-count * math.log(error_rate) / math.log(2) ** 2))
+    hashes = max(1, round(bits / max(count, 1) * math.log(2)))
+    return bits, hashes
+
+
+def _positions(digest, bits, hashes):
+    """Yields the bit positions of the SHA-1 digest
+
+    The digest is uniformly distributed already, so two 64-bit halves of it drive
+    double hashing and nothing is hashed again.
+    """
+
+    first, second = struct.unpack_from('<QQ', digest)
+    second |= 1
+    for i in range(hashes):
+        yield (first + i * second) % bits
+
+
+def count_lines(path) -> int:
+    """Counts the lines of the file reading 1 MiB at a time"""
+
+    count = 0
+    with open(path, 'rb') as hash_list:
+        while chunk := hash_list.read(2 ** 20):
+            count += chunk.count(b'\n')
+    return count
+
+
+def build_filter(hash_list_path, filter_path, expected_count=None,
+                 error_rate=BREACH_ERROR_RATE) -> int:
+    """Builds the Bloom filter file from a list of SHA-1 hashes
+
+    Every line starts with 40 hex digits, anything after them (like the ':count'
+    of the Have I Been Pwned list) is ignored, and so are malformed lines. The list
+    is streamed and the filter is written through a memory map, so memory use does
+    not grow with the size of either file.
+
+    Args:
+        hash_list_path (str): The list of hashes, one per line.
+        filter_path (str): The filter file to write.
+        expected_count (int): Number of hashes, the lines are counted if not given.
+        error_rate (float): Acceptable false positive rate.
+
+    Returns:
+        int: The number of hashes added.
+    """
+
+    if expected_count is None:
+        expected_count = count_lines(hash_list_path)
+    bits, hashes = filter_parameters(expected_count, error_rate)
+
+    added = 0
+    with open(filter_path, 'w+b') as filter_file:
+        filter_file.truncate(HEADER.size + (bits + 7) // 8)
+        with mmap.mmap(filter_file.fileno(), 0) as bit_array, \
+                open(hash_list_path, 'rb') as hash_list:
+            for line in hash_list:
+                try:
+                    digest = bytes.fromhex(line[:SHA1_HEX_SIZE].decode('ascii'))
+                except ValueError:
+                    continue
+                if len(digest) != SHA1_HEX_SIZE // 2:
+                    continue
+                for position in _positions(digest, bits, hashes):
+                    bit_array[HEADER.size + (position >> 3)] |= 1 << (position & 7)
+                added += 1
+            HEADER.pack_into(bit_array, 0, MAGIC, bits, hashes, added)
+            bit_array.flush()
+    return added
+
+
+class BreachFilter:
+    """A memory-mapped Bloom filter of breached password hashes.
+
+    Attributes:
+    - path: the filter file
+    - bits: the size of the bit array
+    - hashes: the number of bits set per hash
+    - count: the number of hashes in the filter
+
+    Methods:
+    - contains_digest(digest) -> bool: checks a SHA-1 digest
+    - is_breached(password) -> bool: checks a password
+    - close(): unmaps the file
+    """
+
+    def __init__(self, path) -> None:
+        """Maps the filter file read-only.
+
+        Raises:
+            ValueError: The file is not a filter built by build_filter.
+        """
+
+        self.path = path
+        with open(path, 'rb') as filter_file:
+            self._map = mmap.mmap(filter_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER.size:
+            self._map.close()
+            raise ValueError(f'{path} is not a breach filter')
+        magic, self.bits, self.hashes, self.count = HEADER.unpack_from(self._map)
+        if magic != MAGIC or len(self._map) < HEADER.size + (self.bits + 7) // 8:
+            self._map.close()
+            raise ValueError(f'{path} is not a breach filter')
+
+    def contains_digest(self, digest) -> bool:
+        """Returns True if the SHA-1 digest is probably in the list."""
+
+        bit_array = self._map
+        return all(bit_array[HEADER.size + (position >> 3)] >> (position & 7) & 1
+                   for position in _positions(digest, self.bits, self.hashes))
+
+    def is_breached(self, password) -> bool:
+        """Returns True if the password is probably in the list."""
+
+        return self.contains_digest(hashlib.sha1(password.encode()).digest())
+
+    def __contains__(self, password) -> bool:
+        return self.is_breached(password)
+
+    def close(self) -> None:
+        """Unmaps the file."""
+
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def get_breach_filter(path=BREACH_FILTER_PATH):
+    """Returns the filter of the file, mapped once per process, or None if none is set up"""
+
+    if not path:
+        return None
+    breach_filter = _filters.get(path)
+    if breach_filter is None:
+        try:
+            breach_filter = _filters[path] = BreachFilter(path)
+        except FileNotFoundError:
+            return None
+    return breach_filter
+
+
+def is_breached(password, path=BREACH_FILTER_PATH) -> bool:
+    """Returns True if the password is probably breached, False without a filter"""
+
+    breach_filter = get_breach_filter(path)
+    return breach_filter is not None and breach_filter.is_breached(password)
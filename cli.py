@@ -0,0 +1,588 @@
+"""Command line interface of the password manager
+
+Every command imports only the modules it needs: 'generate' never loads the
+storage backends or Tkinter, so the interface starts fast enough to be called
+from scripts thousands of times.
+"""
+
+import time
+
+STARTED = time.perf_counter()
+
+# pylint: disable=wrong-import-position
+import argparse
+
+import os
+
+import sys
+
+from config import (BREACH_FILTER_PATH, BREACH_ERROR_RATE, DB_BACKEND, IMPORT_BATCH_SIZE,
+                    EXPORT_ITERSIZE, AUDIT_CHUNK_SIZE, POLICY_MIN_LENGTH, POLICY_MIN_ENTROPY,
+                    CLI_STARTUP_BUDGET_MS, SECRET_WORD_ENV, DAEMON_BACKEND, DAEMON_SOCKET_PATH,
+                    DAEMON_TOKEN_PATH, DAEMON_WORKERS, DAEMON_CACHE_SIZE, DAEMON_CACHE_TTL,
+                    HISTORY_RETENTION, HISTORY_COMPACT_BATCH, VAULT_USER)
+
+
+def open_database(args, **options):
+    """Connects to the selected storage backend and brings the schema up to date"""
+
+    from storage import create_storage
+
+    data_base = create_storage(args.backend, user=args.user, **options)
+    data_base.start_db_connection()
+    data_base.migrate()
+    return data_base
+
+
+def read_secret(prompt, env_var=None) -> str:
+    """Reads a secret from the environment, the terminal or the first line of stdin
+
+    The environment variable suits cron jobs, the terminal prompt suits SSH sessions.
+    """
+
+    if env_var and os.environ.get(env_var) is not None:
+        return os.environ[env_var]
+    if sys.stdin.isatty():
+        import getpass
+        return getpass.getpass(prompt)
+    return sys.stdin.readline().rstrip('\n')
+
+
+def unlock_database(args):
+    """Opens the database and unlocks it with the secret word, returns None if it is wrong"""
+
+    from security import unlock_vault
+
+    data_base = open_database(args)
+    if not data_base.check_if_secret_word_exists():
+        data_base.close_db_connection()
+        print(f"No secret word is set for the user {args.user}, run 'python main.py init' first",
+              file=sys.stderr)
+        return None
+    if not unlock_vault(data_base, read_secret('Secret word: ', SECRET_WORD_ENV)):
+        data_base.close_db_connection()
+        print('Incorrect secret word!', file=sys.stderr)
+        return None
+    return data_base
+
+
+def set_up_vault(data_base, hint=None) -> int:
+    """Saves the secret word and the hint of a vault without one and unlocks it
+
+    The secret word is asked twice on a terminal. The hint is read from the
+    terminal or the next line of stdin unless it is given.
+    """
+
+    from security import hash_secret_word, unlock_vault
+    from encryption import encrypt_plaintext_rows
+
+    secret_word = read_secret('New secret word: ', SECRET_WORD_ENV)
+    if (sys.stdin.isatty() and os.environ.get(SECRET_WORD_ENV) is None
+            and read_secret('Repeat the secret word: ') != secret_word):
+        print('The secret words do not match', file=sys.stderr)
+        return 2
+    if hint is None:
+        hint = input('Hint: ') if sys.stdin.isatty() else sys.stdin.readline().rstrip('\n')
+    if not secret_word or not hint:
+        print('The secret word and the hint must not be empty', file=sys.stderr)
+        return 2
+
+    data_base.insert_secret_word_and_hint(hash_secret_word(secret_word), hint)
+    unlock_vault(data_base, secret_word)
+    encrypt_plaintext_rows(data_base)
+    return 0
+
+
+def init_vault(args) -> int:
+    """Saves the secret word of a new vault, so the vault is usable without the GUI"""
+
+    data_base = open_database(args)
+    try:
+        if data_base.check_if_secret_word_exists():
+            print(f'The secret word of the user {args.user} is already set', file=sys.stderr)
+            return 1
+        status = set_up_vault(data_base, args.hint)
+    finally:
+        data_base.close_db_connection()
+
+    if status == 0:
+        print(f'Saved the secret word of the user {args.user}')
+    return status
+
+
+def get_password(args) -> int:
+    """Prints the password of the account"""
+
+    data_base = unlock_database(args)
+    if data_base is None:
+        return 2
+    try:
+        rows = data_base.select_password_from_db(args.account)
+    finally:
+        data_base.close_db_connection()
+
+    if not rows:
+        print('This account does not exists', file=sys.stderr)
+        return 1
+    for _, password in rows:
+        print(password)
+    return 0
+
+
+def add_account(args) -> int:
+    """Saves the account with the given, generated or prompted password"""
+
+    if args.generate:
+        from password_generator import PassWord
+        password = PassWord(args.generate).password
+    elif args.password_stdin:
+        password = sys.stdin.readline().rstrip('\n')
+    else:
+        password = read_secret('Password: ')
+    if not password:
+        print('The password is empty', file=sys.stderr)
+        return 2
+    if not args.generate:
+        from breach import is_breached
+        if is_breached(password):
+            print('Warning: this password appears in the breach list', file=sys.stderr)
+
+    data_base = unlock_database(args)
+    if data_base is None:
+        return 2
+    try:
+        data_base.insert_account_and_password(args.account, password)
+        reused = data_base.find_reuse(password, args.account)
+    finally:
+        data_base.close_db_connection()
+
+    if reused:
+        print(f"Warning: the same password is used by {', '.join(reused)}", file=sys.stderr)
+
+    if args.generate:
+        print(password)
+    return 0
+
+
+def show_history(args) -> int:
+    """Prints every saved version of the account's password, the current one first"""
+
+    data_base = unlock_database(args)
+    if data_base is None:
+        return 2
+    try:
+        versions = data_base.select_password_history(args.account)
+    finally:
+        data_base.close_db_connection()
+
+    if not versions:
+        print('This account does not exists', file=sys.stderr)
+        return 1
+    for version, password, replaced_at in versions:
+        if password is None:
+            password = '(cannot be decrypted)'
+        print(f"{version}\t{replaced_at or 'current'}\t{password}")
+    return 0
+
+
+def compact_vault(args) -> int:
+    """Deletes the old password versions past the retention limit"""
+
+    from storage import compact_history
+
+    data_base = open_database(args)
+    try:
+        count = compact_history(data_base, args.keep, args.batch_size)
+    finally:
+        data_base.close_db_connection()
+
+    print(f'Deleted {count} old password versions')
+    return 0
+
+
+def sync_vault(args) -> int:
+    """Pushes the saves queued in the local replica and pulls the changed accounts"""
+
+    data_base = open_database(args, synced=True)
+    try:
+        pushed, lost, pulled = data_base.sync()
+    except Exception as error:  # pylint: disable=broad-except
+        print(f'Sync failed, the saves stay queued: {type(error).__name__}', file=sys.stderr)
+        return 1
+    finally:
+        data_base.close_db_connection()
+
+    print(f'Pushed {pushed} saves, dropped {lost} conflicting with the database, '
+          f'pulled {pulled} accounts')
+    return 0
+
+
+def generate_passwords(args) -> int:
+    """Prints new passwords, no database is involved"""
+
+    from password_generator import PassWord
+
+    if args.count == 1:
+        print(PassWord.generate_password(args.length))
+    else:
+        print('\n'.join(PassWord.generate_many(args.count, args.length)))
+    return 0
+
+
+def import_vault(args) -> int:
+    """Loads the accounts of a CSV, JSON or JSON Lines file into the database"""
+
+    from vault_io import read_accounts
+
+    data_base = unlock_database(args)
+    if data_base is None:
+        return 2
+    # Names differing only in case are one account, and a name repeated in the file
+    # is saved again, so the number of accounts is counted apart from the rows saved
+    accounts = set()
+
+    def counted(rows):
+        for row in rows:
+            accounts.add(row[0].lower())
+            yield row
+
+    try:
+        start = time.perf_counter()
+        count = data_base.import_accounts(counted(read_accounts(args.path)), args.batch_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        data_base.close_db_connection()
+
+    print(f'Imported {len(accounts)} accounts in {elapsed:.2f} s '
+          f'({count / max(elapsed, 1e-9):.0f} rows/s)')
+    return 0
+
+
+def export_vault(args) -> int:
+    """Streams all the accounts from the database to a CSV, JSON or JSON Lines file"""
+
+    from vault_io import write_accounts
+
+    data_base = unlock_database(args)
+    if data_base is None:
+        return 2
+    try:
+        start = time.perf_counter()
+        count = write_accounts(args.path, data_base.iter_accounts(args.itersize))
+        elapsed = time.perf_counter() - start
+    finally:
+        data_base.close_db_connection()
+
+    print(f'Exported {count} accounts in {elapsed:.2f} s '
+          f'({count / max(elapsed, 1e-9):.0f} rows/s)')
+    return 0
+
+
+def audit_vault(args) -> int:
+    """Scores every stored password in parallel and prints the weak ones"""
+
+    from password_policy import PasswordPolicy, audit_passwords
+
+    policy = PasswordPolicy(min_length=args.min_length, min_entropy=args.min_entropy)
+    data_base = unlock_database(args)
+    if data_base is None:
+        return 2
+    weak = 0
+    try:
+        start = time.perf_counter()
+        rows = data_base.iter_accounts()
+        for account, entropy, failures in audit_passwords(rows, policy, args.processes,
+                                                          args.chunk_size):
+            weak += 1
+            print(f"{account}\t{entropy:.0f} bits\t{'; '.join(failures)}")
+        elapsed = time.perf_counter() - start
+    finally:
+        data_base.close_db_connection()
+
+    print(f'{weak} weak passwords found in {elapsed:.2f} s', file=sys.stderr)
+    return 1 if weak else 0
+
+
+def build_breach_filter(args) -> int:
+    """Builds the Bloom filter of a breached SHA-1 hash list"""
+
+    from breach import build_filter
+
+    start = time.perf_counter()
+    count = build_filter(args.hash_list, args.output, args.expected_count, args.error_rate)
+    print(f'Added {count} hashes to {args.output} in {time.perf_counter() - start:.1f} s')
+    return 0
+
+
+def scan_breaches(args) -> int:
+    """Prints the accounts whose password appears in the breach filter"""
+
+    from breach import get_breach_filter
+
+    breach_filter = get_breach_filter(args.filter)
+    if breach_filter is None:
+        print('No breach filter, build one with build-breach-filter', file=sys.stderr)
+        return 2
+
+    data_base = unlock_database(args)
+    if data_base is None:
+        return 2
+    breached = 0
+    try:
+        for account, password in data_base.iter_accounts():
+            if breach_filter.is_breached(password):
+                breached += 1
+                print(account)
+    finally:
+        data_base.close_db_connection()
+
+    print(f'{breached} breached passwords found', file=sys.stderr)
+    return 1 if breached else 0
+
+
+def report_reuse(args) -> int:
+    """Prints the groups of accounts sharing a password, one group per line"""
+
+    data_base = unlock_database(args)
+    if data_base is None:
+        return 2
+    try:
+        groups = data_base.reuse_report()
+    finally:
+        data_base.close_db_connection()
+
+    for accounts in groups:
+        print('\t'.join(accounts))
+    print(f'{len(groups)} reused passwords found', file=sys.stderr)
+    return 1 if groups else 0
+
+
+def encrypt_vault(args) -> int:
+    """Encrypts and fingerprints the passwords saved by older versions, chunk by chunk"""
+
+    from encryption import encrypt_plaintext_rows
+
+    data_base = unlock_database(args)
+    if data_base is None:
+        return 2
+    try:
+        count = encrypt_plaintext_rows(data_base, args.chunk_size)
+    finally:
+        data_base.close_db_connection()
+
+    print(f'Encrypted and fingerprinted {count} passwords')
+    return 0
+
+
+def manage_users(args) -> int:
+    """Lists, adds or drops the users and their vaults, a new user sets the secret word"""
+
+    from storage import create_storage
+
+    if args.backend == 'daemon':
+        print('Users are managed on the database, not through the daemon', file=sys.stderr)
+        return 2
+    if args.action != 'list' and not args.name:
+        print(f'user {args.action} needs the name of the user', file=sys.stderr)
+        return 2
+
+    data_base = create_storage(args.backend, encrypted=False, synced=False)
+    data_base.start_db_connection()
+    try:
+        data_base.migrate()
+        if args.action == 'list':
+            for name, accounts in data_base.select_users():
+                print(f'{name}\t{accounts}')
+            return 0
+        if args.action == 'add':
+            data_base.create_user(args.name)
+            vault = create_storage(args.backend, user=args.name, synced=False)
+            vault.start_db_connection()
+            try:
+                status = set_up_vault(vault, args.hint)
+            finally:
+                vault.close_db_connection()
+            if status != 0:
+                print(f"Added the user {args.name}, set the secret word with "
+                      f"'python main.py --user {args.name} init'", file=sys.stderr)
+                return status
+            print(f'Added the user {args.name} and saved the secret word')
+            return 0
+        if not data_base.drop_user(args.name):
+            print(f'There is no user {args.name}', file=sys.stderr)
+            return 1
+        print(f'Dropped the user {args.name} and the vault')
+        return 0
+    finally:
+        data_base.close_db_connection()
+
+
+def run_daemon(args) -> int:
+    """Serves the vault on a Unix socket until interrupted"""
+
+    import asyncio
+    import logging
+    from daemon import VaultDaemon
+    from storage import create_storage
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    daemon = VaultDaemon(create_storage(args.storage, encrypted=False, user=args.user,
+                                        synced=False),
+                         args.socket, args.token_file, args.workers, args.cache_size,
+                         args.cache_ttl)
+    asyncio.run(daemon.serve())
+    return 0
+
+
+def print_stats() -> None:
+    """Prints the call counts and latency percentiles to stderr"""
+
+    from metrics import METRICS
+
+    for name, stats in METRICS.snapshot().items():
+        print(f"{name:<36}{stats['count']:>8} calls  p50 {stats['p50'] * 1000:8.2f} ms  "
+              f"p95 {stats['p95'] * 1000:8.2f} ms  p99 {stats['p99'] * 1000:8.2f} ms",
+              file=sys.stderr)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Creates the parser of the command line arguments"""
+
+    parser = argparse.ArgumentParser(prog='password-manager',
+                                     description='Password manager command line interface')
+    parser.add_argument('--backend', choices=('postgresql', 'sqlite', 'daemon'),
+                        default=DB_BACKEND,
+                        help='storage backend, DB_BACKEND from config.py by default')
+    parser.add_argument('--user', default=VAULT_USER,
+                        help='the user whose vault is opened, VAULT_USER by default')
+    parser.add_argument('--stats', action='store_true',
+                        help='print call counts and latency percentiles when done')
+    parser.add_argument('--timing', action='store_true',
+                        help='print the startup and command time')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    init_parser = subparsers.add_parser('init', help='set the secret word of a new vault')
+    init_parser.add_argument('--hint', help='the hint for the secret word, asked if omitted')
+    init_parser.set_defaults(handler=init_vault)
+
+    get_parser = subparsers.add_parser('get', help='print the password of an account')
+    get_parser.add_argument('account')
+    get_parser.set_defaults(handler=get_password)
+
+    add_parser = subparsers.add_parser('add', help='save an account and its password')
+    add_parser.add_argument('account')
+    password_source = add_parser.add_mutually_exclusive_group()
+    password_source.add_argument('--generate', type=int, metavar='LENGTH',
+                                 help='generate a password of this length and print it')
+    password_source.add_argument('--password-stdin', action='store_true',
+                                 help='read the password from stdin')
+    add_parser.set_defaults(handler=add_account)
+
+    history_parser = subparsers.add_parser('history',
+                                           help='print every saved password of an account')
+    history_parser.add_argument('account')
+    history_parser.set_defaults(handler=show_history)
+
+    compact_parser = subparsers.add_parser('compact', help='delete old password versions')
+    compact_parser.add_argument('--keep', type=int, default=HISTORY_RETENTION,
+                                help='old versions kept per account')
+    compact_parser.add_argument('--batch-size', type=int, default=HISTORY_COMPACT_BATCH,
+                                help='versions deleted in one transaction')
+    compact_parser.set_defaults(handler=compact_vault)
+
+    sync_parser = subparsers.add_parser('sync',
+                                        help='synchronize the local replica with the database')
+    sync_parser.set_defaults(handler=sync_vault)
+
+    generate_parser = subparsers.add_parser('generate', help='print new strong passwords')
+    generate_parser.add_argument('--length', type=int, default=16)
+    generate_parser.add_argument('--count', type=int, default=1)
+    generate_parser.set_defaults(handler=generate_passwords)
+
+    import_parser = subparsers.add_parser('import', help='import accounts from a file')
+    import_parser.add_argument('path', help='.csv, .json or .jsonl file, optionally .gz')
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                               help='rows sent to the database in one statement')
+    import_parser.set_defaults(handler=import_vault)
+
+    export_parser = subparsers.add_parser('export', help='export all accounts to a file')
+    export_parser.add_argument('path', help='.csv, .json or .jsonl file, add .gz to compress')
+    export_parser.add_argument('--itersize', type=int, default=EXPORT_ITERSIZE,
+                               help='rows fetched from the database in one round trip')
+    export_parser.set_defaults(handler=export_vault)
+
+    audit_parser = subparsers.add_parser('audit', help='report weak stored passwords')
+    audit_parser.add_argument('--processes', type=int, default=None,
+                              help='number of worker processes, all cores by default')
+    audit_parser.add_argument('--chunk-size', type=int, default=AUDIT_CHUNK_SIZE,
+                              help='passwords sent to a worker process at once')
+    audit_parser.add_argument('--min-length', type=int, default=POLICY_MIN_LENGTH)
+    audit_parser.add_argument('--min-entropy', type=float, default=POLICY_MIN_ENTROPY)
+    audit_parser.set_defaults(handler=audit_vault)
+
+    build_filter_parser = subparsers.add_parser('build-breach-filter',
+                                                help='build the offline breach filter')
+    build_filter_parser.add_argument('hash_list', help='SHA-1 hashes, one per line')
+    build_filter_parser.add_argument('output', help='the filter file to write')
+    build_filter_parser.add_argument('--expected-count', type=int, default=None,
+                                     help='number of hashes, counted if not given')
+    build_filter_parser.add_argument('--error-rate', type=float, default=BREACH_ERROR_RATE,
+                                     help='acceptable false positive rate')
+    build_filter_parser.set_defaults(handler=build_breach_filter)
+
+    breach_scan_parser = subparsers.add_parser('breach-scan',
+                                               help='report stored passwords that were breached')
+    breach_scan_parser.add_argument('--filter', default=BREACH_FILTER_PATH,
+                                    help='the filter file, BREACH_FILTER_PATH by default')
+    breach_scan_parser.set_defaults(handler=scan_breaches)
+
+    reuse_parser = subparsers.add_parser('reuse', help='report accounts sharing a password')
+    reuse_parser.set_defaults(handler=report_reuse)
+
+    encrypt_parser = subparsers.add_parser('encrypt',
+                                           help='encrypt and fingerprint old passwords')
+    encrypt_parser.add_argument('--chunk-size', type=int, default=IMPORT_BATCH_SIZE,
+                                help='accounts read and updated at a time')
+    encrypt_parser.set_defaults(handler=encrypt_vault)
+
+    user_parser = subparsers.add_parser('user', help='list, add or drop users and their vaults')
+    user_parser.add_argument('action', choices=('list', 'add', 'drop'))
+    user_parser.add_argument('name', nargs='?')
+    user_parser.add_argument('--hint', help='the hint for the secret word of a new user')
+    user_parser.set_defaults(handler=manage_users)
+
+    serve_parser = subparsers.add_parser('serve', help='serve the vault to local clients')
+    serve_parser.add_argument('--storage', choices=('postgresql', 'sqlite'),
+                              default=DAEMON_BACKEND, help='storage backend of the daemon')
+    serve_parser.add_argument('--socket', default=DAEMON_SOCKET_PATH)
+    serve_parser.add_argument('--token-file', default=DAEMON_TOKEN_PATH)
+    serve_parser.add_argument('--workers', type=int, default=DAEMON_WORKERS,
+                              help='threads running storage calls')
+    serve_parser.add_argument('--cache-size', type=int, default=DAEMON_CACHE_SIZE,
+                              help='recent lookups kept in memory')
+    serve_parser.add_argument('--cache-ttl', type=float, default=DAEMON_CACHE_TTL,
+                              help='seconds a cached lookup is served')
+    serve_parser.set_defaults(handler=run_daemon)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    """Runs the command given on the command line"""
+
+    args = build_parser().parse_args(argv)
+    startup = (time.perf_counter() - STARTED) * 1000
+    try:
+        return args.handler(args)
+    finally:
+        if args.timing:
+            command = (time.perf_counter() - STARTED) * 1000 - startup
+            budget = 'within' if startup <= CLI_STARTUP_BUDGET_MS else 'OVER'
+            print(f'startup {startup:.1f} ms ({budget} the {CLI_STARTUP_BUDGET_MS} ms budget), '
+                  f'command {command:.1f} ms', file=sys.stderr)
+        if args.stats:
+            print_stats()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,76 @@
 """Configuration file for the database"""
 
+from pathlib import Path
+
+DB_BACKEND = 'postgresql'
+SQLITE_PATH = str(Path(__file__).with_name('vault.sqlite3'))
+VAULT_USER = 'default'
+
 DB_HOST = 'localhost'
 DB_PORT = 5432
 DB_NAME = 'mydatabase'
 DB_USER = 'myuser'
 DB_PASSWORD = 'mypassword'
+
+DB_POOL_ENABLED = True
+DB_POOL_MIN_SIZE = 1
+DB_POOL_MAX_SIZE = 5
+DB_HEALTH_CHECK_INTERVAL = 30
+DB_RECONNECT_ATTEMPTS = 3
+DB_RECONNECT_DELAY = 0.5
+DB_PREPARED_STATEMENTS = True
+
+IMPORT_BATCH_SIZE = 1000
+EXPORT_ITERSIZE = 2000
+
+WORKER_POLL_INTERVAL = 50
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SESSION_IDLE_TIMEOUT = 300
+SESSION_CHECK_INTERVAL = 5000
+
+POLICY_MIN_LENGTH = 12
+POLICY_MIN_ENTROPY = 60
+POLICY_MAX_REPEAT = 3
+POLICY_MAX_SEQUENCE = 4
+AUDIT_CHUNK_SIZE = 500
+
+SEARCH_DEBOUNCE_MS = 150
+SEARCH_MIN_CHARS = 2
+SEARCH_LIMIT = 10
+
+BROWSER_PAGE_SIZE = 25
+
+METRICS_ENABLED = True
+SLOW_CALL_THRESHOLD = 0.2
+METRICS_FILE = None
+
+BREACH_FILTER_PATH = None
+BREACH_ERROR_RATE = 0.001
+
+CLI_STARTUP_BUDGET_MS = 50
+SECRET_WORD_ENV = 'PASSWORD_MANAGER_SECRET_WORD'
+
+DAEMON_BACKEND = 'postgresql'
+DAEMON_SOCKET_PATH = str(Path.home() / '.password-manager.sock')
+DAEMON_TOKEN_PATH = str(Path.home() / '.password-manager.token')
+DAEMON_WORKERS = 8
+DAEMON_CACHE_SIZE = 1024
+DAEMON_CACHE_TTL = 5
+DAEMON_MAX_MESSAGE = 2 ** 20
+DAEMON_TIMEOUT = 10
+
+AUDIT_ENABLED = True
+AUDIT_BATCH_SIZE = 100
+AUDIT_FLUSH_INTERVAL = 2.0
+AUDIT_QUEUE_SIZE = 10000
+
+HISTORY_RETENTION = 10
+HISTORY_COMPACT_BATCH = 500
+
+SYNC_ENABLED = False
+SYNC_REPLICA_DIR = str(Path.home() / '.password-manager')
+SYNC_INTERVAL = 30000
+SYNC_BATCH_SIZE = 500
@@ -0,0 +1,427 @@
+"""Local daemon serving the vault to many clients over a Unix socket
+
+The daemon keeps one storage backend with its connection pool and answers
+JSON Lines requests. Every client authenticates with the token the daemon writes
+to a file only its user can read, then sends requests such as
+
+    {"id": 1, "op": "get", "params": {"account": "github"}}
+
+and receives {"id": 1, "ok": true, "result": [["GitHub", "..."]]} or
+{"id": 1, "ok": false, "error": "..."}. Requests of one connection are answered
+in order, different connections are served concurrently.
+"""
+
+import asyncio
+
+import hmac
+
+import json
+
+import logging
+
+import os
+
+import secrets
+
+import signal
+
+import stat
+
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (DAEMON_SOCKET_PATH, DAEMON_TOKEN_PATH, DAEMON_WORKERS, DAEMON_CACHE_SIZE,
+                    DAEMON_CACHE_TTL, DAEMON_MAX_MESSAGE, SEARCH_LIMIT, BROWSER_PAGE_SIZE,
+                    IMPORT_BATCH_SIZE)
+
+from metrics import timed
+
+from password_generator import PassWord
+
+logger = logging.getLogger('password_manager.daemon')
+
+
+def write_token(path) -> str:
+    """Writes a new random token to a file readable by the current user only
+
+    Args:
+        path (str): Path of the token file, an existing file is replaced.
+
+    Returns:
+        str: The token.
+    """
+
+    token = secrets.token_hex(32)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as token_file:
+        os.fchmod(token_file.fileno(), 0o600)
+        token_file.write(token)
+    return token
+
+
+def remove_stale_socket(path) -> None:
+    """Removes a socket file left behind by a daemon that did not shut down cleanly"""
+
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class LRUCache:
+    """A bounded cache that drops the least recently used entries.
+
+    Lookups run on the worker threads while the cache is only touched from the
+    event loop. A value computed before an invalidation is not stored, so a lookup
+    racing with an 'add' never caches the old password. Writes that bypass the
+    daemon, such as other clients of the database or a sync from another machine,
+    cannot invalidate anything, so entries also expire ttl seconds after they
+    were stored.
+
+    Attributes:
+    - max_size: the maximum number of entries
+    - ttl: seconds an entry is served before it is looked up again
+    - generation: increases with every invalidation
+    - hits, misses: lookup counters
+    """
+
+    def __init__(self, max_size=DAEMON_CACHE_SIZE, ttl=DAEMON_CACHE_TTL) -> None:
+        """Constructs an empty cache."""
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        """Returns the cached value or None if it is missing or expired."""
+
+        item = self._items.get(key)
+        if item is None or item[1] <= time.monotonic():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, value, generation) -> None:
+        """Stores the value if nothing was invalidated since the lookup started."""
+
+        if generation != self.generation or self.max_size <= 0 or self.ttl <= 0:
+            return
+        self._items[key] = (value, time.monotonic() + self.ttl)
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key=None) -> None:
+        """Drops one entry, or every entry if no key is given."""
+
+        self.generation += 1
+        if key is None:
+            self._items.clear()
+        else:
+            self._items.pop(key, None)
+
+
+class VaultDaemon:
+    """Serves the storage backend to the clients connected to a Unix socket.
+
+    Storage calls block, so they run on a thread pool while the event loop keeps
+    accepting connections. All clients share the connection pool of the storage,
+    and recent password and secret word lookups are answered from an LRU cache.
+
+    Attributes:
+    - storage: the VaultStorage the requests are served from
+    - socket_path: path of the Unix socket
+    - token_path: path of the file holding the authentication token
+    - cache: the LRUCache of recent lookups
+
+    Methods:
+    - serve(): opens the storage and serves requests until SIGINT or SIGTERM
+    - start(): opens the storage and starts listening, returns the asyncio server
+    - stop(): closes the storage and removes the socket and token files
+    - handle_client(reader, writer): serves one client connection
+    - dispatch(request): runs one request and returns the response
+    """
+
+    def __init__(self, storage, socket_path=DAEMON_SOCKET_PATH, token_path=DAEMON_TOKEN_PATH,
+                 workers=DAEMON_WORKERS, cache_size=DAEMON_CACHE_SIZE,
+                 cache_ttl=DAEMON_CACHE_TTL) -> None:
+        """Constructs a daemon that is not listening yet."""
+
+        self.storage = storage
+        self.socket_path = socket_path
+        self.token_path = token_path
+        self.cache = LRUCache(cache_size, cache_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='daemon-worker')
+        self._token = None
+        self._handlers = {
+            'get': self.get,
+            'add': self.add,
+            'search': self.search,
+            'generate': self.generate,
+            'import': self.import_rows,
+            'page': self.page,
+            'hint': self.hint,
+            'secret_word': self.secret_word,
+            'secret_word_exists': self.secret_word_exists,
+            'set_secret_word': self.set_secret_word,
+            'update_secret_word': self.update_secret_word,
+            'update_key_salt': self.update_key_salt,
+            'mark_encrypted': self.mark_encrypted,
+            'replace_passwords': self.replace_passwords,
+            'by_fingerprint': self.by_fingerprint,
+            'reused': self.reused,
+            'unfingerprinted': self.unfingerprinted,
+            'audit': self.audit,
+            'history': self.history,
+            'prune_history': self.prune_history,
+            'plaintext_history': self.plaintext_history,
+            'replace_history': self.replace_history,
+            'changes': self.changes,
+            'sync_state': self.sync_state,
+        }
+
+    async def _call(self, function, *args):
+        """Runs a blocking storage call on the thread pool."""
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def _cached(self, key, function, *args):
+        """Returns the cached result of the lookup or runs it and caches the result."""
+
+        result = self.cache.get(key)
+        if result is None:
+            generation = self.cache.generation
+            result = await self._call(function, *args)
+            self.cache.put(key, result, generation)
+        return result
+
+    async def start(self) -> asyncio.AbstractServer:
+        """Opens the storage, writes the token and starts listening on the socket."""
+
+        await self._call(self.storage.start_db_connection)
+        await self._call(self.storage.migrate)
+
+        self._token = write_token(self.token_path)
+        remove_stale_socket(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path,
+                                                 limit=DAEMON_MAX_MESSAGE)
+        os.chmod(self.socket_path, 0o600)
+        logger.info('serving the vault on %s', self.socket_path)
+        return server
+
+    def stop(self) -> None:
+        """Closes the storage and removes the socket and token files."""
+
+        self._executor.shutdown(wait=True)
+        self.storage.close_db_connection()
+        for path in (self.socket_path, self.token_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    async def serve(self) -> None:
+        """Serves requests until SIGINT or SIGTERM."""
+
+        server = await self.start()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, server.close)
+        try:
+            async with server:
+                await server.wait_closed()
+        finally:
+            self.stop()
+
+    async def handle_client(self, reader, writer) -> None:
+        """Authenticates the client and answers its requests until it disconnects."""
+
+        authenticated = False
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    request_id = request.get('id')
+                except (ValueError, AttributeError):
+                    response = {'id': None, 'ok': False, 'error': 'malformed request'}
+                else:
+                    if authenticated:
+                        response = await self.dispatch(request)
+                    else:
+                        token = (request.get('params') or {}).get('token', '')
+                        authenticated = (request.get('op') == 'auth' and isinstance(token, str)
+                                         and hmac.compare_digest(token.encode(),
+                                                                 self._token.encode()))
+                        response = ({'id': request_id, 'ok': True, 'result': None}
+                                    if authenticated else
+                                    {'id': request_id, 'ok': False, 'error': 'not authenticated'})
+
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+                if not authenticated:
+                    break
+        except (ConnectionError, ValueError) as error:
+            logger.warning('dropping client: %s', error)
+        finally:
+            writer.close()
+
+    @timed('daemon.dispatch')
+    async def dispatch(self, request) -> dict:
+        """Runs one request and returns the response."""
+
+        request_id = request.get('id')
+        handler = self._handlers.get(request.get('op'))
+        if handler is None:
+            return {'id': request_id, 'ok': False, 'error': f"unknown op {request.get('op')!r}"}
+
+        try:
+            result = await handler(**(request.get('params') or {}))
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning('%s failed: %s', request.get('op'), type(error).__name__)
+            return {'id': request_id, 'ok': False, 'error': str(error)}
+        return {'id': request_id, 'ok': True, 'result': result}
+
+    async def get(self, account) -> list:
+        """Returns the (account, password) rows of the account."""
+
+        return await self._cached(('get', account.lower()),
+                                  self.storage.select_password_from_db, account)
+
+    async def add(self, account, password, fingerprint=None) -> None:
+        """Saves the account and drops its cached lookup."""
+
+        await self._call(self.storage.insert_account_and_password, account, password,
+                         fingerprint)
+        self.cache.invalidate(('get', account.lower()))
+
+    async def search(self, fragment, limit=SEARCH_LIMIT) -> list:
+        """Returns the names of the accounts matching the fragment."""
+
+        return await self._call(self.storage.search_accounts, fragment, limit)
+
+    async def generate(self, length=16, count=1) -> list:
+        """Returns count new passwords of the given length."""
+
+        return await self._call(PassWord.generate_many, count, length)
+
+    async def import_rows(self, rows, batch_size=IMPORT_BATCH_SIZE) -> int:
+        """Saves a batch of (account, password) rows and clears the cache."""
+
+        count = await self._call(self.storage.import_accounts,
+                                 [tuple(row) for row in rows], batch_size)
+        self.cache.invalidate()
+        return count
+
+    async def replace_passwords(self, rows) -> int:
+        """Replaces the (id, old, new, fingerprint) rows still holding old and clears the cache."""
+
+        count = await self._call(self.storage.replace_passwords, [tuple(row) for row in rows])
+        self.cache.invalidate()
+        return count
+
+    async def by_fingerprint(self, fingerprint) -> list:
+        """Returns the names of the accounts with the fingerprint."""
+
+        return await self._call(self.storage.select_accounts_by_fingerprint, fingerprint)
+
+    async def reused(self) -> list:
+        """Returns the (fingerprint, account) rows of the shared fingerprints."""
+
+        return await self._call(self.storage.select_reused_accounts)
+
+    async def unfingerprinted(self, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Returns the next (id, account, password) rows without a fingerprint."""
+
+        return await self._call(self.storage.select_unfingerprinted_page, after_id, limit)
+
+    async def audit(self, events) -> None:
+        """Appends the (event_type, account, client, created_at) rows to the audit log."""
+
+        await self._call(self.storage.insert_audit_events, [tuple(event) for event in events])
+
+    async def history(self, account) -> list:
+        """Returns the (version, password, replaced_at) rows of the account."""
+
+        return await self._call(self.storage.select_password_history, account)
+
+    async def prune_history(self, keep, limit) -> int:
+        """Deletes one batch of the versions past the retention limit."""
+
+        return await self._call(self.storage.prune_password_history, keep, limit)
+
+    async def plaintext_history(self, prefix, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Returns the next (id, account, password) old versions saved before encryption."""
+
+        return await self._call(self.storage.select_plaintext_history_page,
+                                prefix, after_id, limit)
+
+    async def replace_history(self, rows) -> int:
+        """Replaces the (id, old, new) old versions that were not changed since they were read."""
+
+        return await self._call(self.storage.replace_history_passwords,
+                                [tuple(row) for row in rows])
+
+    async def changes(self, after_seq, limit) -> list:
+        """Returns the rows changed after the sync watermark."""
+
+        return await self._call(self.storage.select_changes, after_seq, limit)
+
+    async def sync_state(self, accounts) -> list:
+        """Returns the (account, change_seq, updated_at) rows of the accounts."""
+
+        return await self._call(self.storage.select_sync_state, accounts)
+
+    async def page(self, after_id=0, before_id=None, limit=BROWSER_PAGE_SIZE) -> list:
+        """Returns one page of (id, account, password) rows."""
+
+        return await self._call(self.storage.select_accounts_page, after_id, before_id, limit)
+
+    async def hint(self) -> list:
+        """Returns the (hint,) rows."""
+
+        return await self._call(self.storage.select_hint_from_db)
+
+    async def secret_word(self) -> list:
+        """Returns the (word, key_salt, encrypted) rows holding the hash of the secret word."""
+
+        return await self._cached(('secret_word',), self.storage.select_secret_word_from_db)
+
+    async def secret_word_exists(self) -> bool:
+        """Returns True if a secret word was saved."""
+
+        return await self._call(self.storage.check_if_secret_word_exists)
+
+    async def set_secret_word(self, secret_word, user_hint) -> None:
+        """Saves the hash of the secret word and its hint."""
+
+        await self._call(self.storage.insert_secret_word_and_hint, secret_word, user_hint)
+        self.cache.invalidate(('secret_word',))
+
+    async def update_secret_word(self, secret_word) -> None:
+        """Replaces the hash of the secret word."""
+
+        await self._call(self.storage.update_secret_word, secret_word)
+        self.cache.invalidate(('secret_word',))
+
+    async def update_key_salt(self, key_salt) -> None:
+        """Saves the salt of the encryption key unless one was saved already."""
+
+        await self._call(self.storage.update_key_salt, key_salt)
+        self.cache.invalidate(('secret_word',))
+
+    async def mark_encrypted(self) -> None:
+        """Records that no password of the vault is stored in plaintext."""
+
+        await self._call(self.storage.mark_vault_encrypted)
+        self.cache.invalidate(('secret_word',))
@@ -0,0 +1,377 @@
+"""Client of the vault daemon and the storage backend talking to it
+
+Only the standard library is imported, so thin clients start fast and do not
+need psycopg2.
+"""
+
+import itertools
+
+import json
+
+import select
+
+import socket
+
+import threading
+
+from config import (DAEMON_SOCKET_PATH, DAEMON_TOKEN_PATH, DAEMON_TIMEOUT, SEARCH_LIMIT,
+                    BROWSER_PAGE_SIZE, IMPORT_BATCH_SIZE, EXPORT_ITERSIZE)
+
+from metrics import timed
+
+from storage import VaultStorage, batches
+
+# Requests that only read, so sending one again cannot apply anything twice
+IDEMPOTENT_OPS = frozenset({'get', 'search', 'generate', 'page', 'hint', 'secret_word',
+                            'secret_word_exists', 'by_fingerprint', 'reused',
+                            'unfingerprinted', 'history', 'plaintext_history', 'changes',
+                            'sync_state'})
+
+class DaemonError(Exception):
+    """The daemon refused or failed a request."""
+
+
+class DaemonClient:
+    """A connection to the vault daemon, safe to share between threads.
+
+    Attributes:
+    - socket_path: path of the Unix socket of the daemon
+    - token_path: path of the file holding the authentication token
+    - timeout: seconds to wait for a response
+
+    Methods:
+    - connect(): connects and authenticates
+    - close(): closes the connection
+    - call(op, **params): sends a request and returns its result
+    - generate(length, count): returns new passwords generated by the daemon
+    """
+
+    def __init__(self, socket_path=DAEMON_SOCKET_PATH, token_path=DAEMON_TOKEN_PATH,
+                 timeout=DAEMON_TIMEOUT) -> None:
+        """Constructs a client that connects on the first request."""
+
+        self.socket_path = socket_path
+        self.token_path = token_path
+        self.timeout = timeout
+        self._socket = None
+        self._stream = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def connect(self) -> None:
+        """Connects to the daemon and authenticates with the token file."""
+
+        with self._lock:
+            self._connect()
+
+    def _connect(self) -> None:
+        """Opens the socket and sends the token, the lock must be held."""
+
+        with open(self.token_path, encoding='utf-8') as token_file:
+            token = token_file.read().strip()
+
+        self._close()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(self.timeout)
+        try:
+            self._socket.connect(self.socket_path)
+            self._stream = self._socket.makefile('rwb')
+            self._request('auth', {'token': token})
+        except BaseException:
+            self._close()
+            raise
+
+    def close(self) -> None:
+        """Closes the connection to the daemon."""
+
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        """Closes the socket, the lock must be held."""
+
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _is_stale(self) -> bool:
+        """Returns True if the daemon closed the idle connection, the lock must be held."""
+
+        readable, _, _ = select.select([self._socket], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return not self._socket.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def _send(self, op, params) -> int:
+        """Writes one request and returns its id, the lock must be held."""
+
+        request_id = next(self._ids)
+        self._stream.write(json.dumps({'id': request_id, 'op': op, 'params': params}).encode()
+                           + b'\n')
+        self._stream.flush()
+        return request_id
+
+    def _receive(self, request_id):
+        """Reads the response to the request, the lock must be held."""
+
+        line = self._stream.readline()
+        if not line:
+            raise ConnectionError('the daemon closed the connection')
+        response = json.loads(line)
+        if response.get('id') != request_id:
+            raise DaemonError('response does not match the request')
+        if not response.get('ok'):
+            raise DaemonError(response.get('error'))
+        return response.get('result')
+
+    def _request(self, op, params):
+        """Sends one request and reads its response, the lock must be held."""
+
+        return self._receive(self._send(op, params))
+
+    def call(self, op, **params):
+        """Sends a request and returns its result.
+
+        If the connection was lost, for example because the daemon restarted,
+        the client reconnects and sends the request once more, but only when
+        the request cannot have been applied: it was never fully written, or it
+        is one of IDEMPOTENT_OPS. A write whose response was lost is not sent
+        again, since the daemon may have applied it before the connection broke.
+
+        Raises:
+            DaemonError: The daemon refused or failed the request.
+            OSError: The daemon is not running, or the connection was lost
+                while waiting for the response to a write.
+        """
+
+        with self._lock:
+            if self._stream is None or self._is_stale():
+                self._connect()
+            try:
+                request_id = self._send(op, params)
+            except OSError:
+                self._connect()
+                return self._request(op, params)
+            try:
+                return self._receive(request_id)
+            except OSError:
+                # The response of this request may still arrive, so the connection
+                # cannot be reused either way
+                self._close()
+                if op not in IDEMPOTENT_OPS:
+                    raise
+                self._connect()
+                return self._request(op, params)
+
+    def generate(self, length=16, count=1) -> list:
+        """Returns count new passwords of the given length."""
+
+        return self.call('generate', length=length, count=count)
+
+
+def _rows(rows) -> list:
+    """Turns the JSON arrays of a response back into tuples."""
+
+    return [tuple(row) for row in rows]
+
+
+class DaemonStorage(VaultStorage):
+    """A storage backend forwarding every call to the vault daemon.
+
+    The daemon migrates the schema and holds the database connections, so
+    clients using this backend open a single socket and nothing else.
+
+    Attributes:
+        client (DaemonClient): The connection to the daemon.
+    """
+
+    def __init__(self, client=None) -> None:
+        """Prepares the client, the socket is opened lazily
+
+        Args:
+            client (DaemonClient): The client to use, one with the config.py settings by default.
+        """
+
+        self.client = client if client is not None else DaemonClient()
+
+    @timed('db.start_db_connection')
+    def start_db_connection(self) -> None:
+        """Connects to the daemon"""
+
+        self.client.connect()
+
+    @timed('db.close_db_connection')
+    def close_db_connection(self) -> None:
+        """Closes the connection to the daemon"""
+
+        self.client.close()
+
+    def migrate(self) -> list:
+        """The daemon migrates the schema when it starts, nothing is left to apply"""
+
+        return []
+
+    @timed('db.insert_secret_word_and_hint')
+    def insert_secret_word_and_hint(self, secret_word, user_hint) -> None:
+        """Inserts the hash of the secret word and its hint"""
+
+        self.client.call('set_secret_word', secret_word=secret_word, user_hint=user_hint)
+
+    @timed('db.update_secret_word')
+    def update_secret_word(self, secret_word) -> None:
+        """Replaces the hash of the secret word"""
+
+        self.client.call('update_secret_word', secret_word=secret_word)
+
+    @timed('db.update_key_salt')
+    def update_key_salt(self, key_salt) -> None:
+        """Saves the salt of the encryption key unless one was saved already"""
+
+        self.client.call('update_key_salt', key_salt=key_salt)
+
+    @timed('db.mark_vault_encrypted')
+    def mark_vault_encrypted(self) -> None:
+        """Records that no password of the vault is stored in plaintext"""
+
+        self.client.call('mark_encrypted')
+
+    @timed('db.insert_account_and_password')
+    def insert_account_and_password(self, account, password, fingerprint=None) -> None:
+        """Inserts an account or replaces its password and fingerprint"""
+
+        self.client.call('add', account=account, password=password, fingerprint=fingerprint)
+
+    @timed('db.import_accounts')
+    def import_accounts(self, rows, batch_size=IMPORT_BATCH_SIZE) -> int:
+        """Sends the rows to the daemon batch by batch
+
+        Unlike the database backends every batch is its own transaction,
+        a failed import keeps the batches sent before the failure.
+        """
+
+        count = 0
+        for batch in batches(rows, batch_size):
+            count += self.client.call('import', rows=batch, batch_size=batch_size)
+        return count
+
+    @timed('db.replace_passwords')
+    def replace_passwords(self, rows) -> int:
+        """Updates the (id, old, new, fingerprint) rows still holding old, returns the count"""
+
+        return self.client.call('replace_passwords', rows=rows)
+
+    @timed('db.select_accounts_by_fingerprint')
+    def select_accounts_by_fingerprint(self, fingerprint) -> list:
+        """Returns the names of the accounts with the fingerprint"""
+
+        return self.client.call('by_fingerprint', fingerprint=fingerprint)
+
+    @timed('db.select_reused_accounts')
+    def select_reused_accounts(self) -> list:
+        """Returns (fingerprint, account) tuples of shared fingerprints, ordered by fingerprint"""
+
+        return _rows(self.client.call('reused'))
+
+    @timed('db.insert_audit_events')
+    def insert_audit_events(self, events) -> None:
+        """Appends (event_type, account, client, created_at) rows to the audit log"""
+
+        self.client.call('audit', events=events)
+
+    @timed('db.select_unfingerprinted_page')
+    def select_unfingerprinted_page(self, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Returns (id, account, password) tuples without a fingerprint ordered by id"""
+
+        return _rows(self.client.call('unfingerprinted', after_id=after_id, limit=limit))
+
+    @timed('db.iter_accounts')
+    def iter_accounts(self, itersize=EXPORT_ITERSIZE):
+        """Yields every (account, password) tuple, fetching itersize rows per request"""
+
+        after_id = 0
+        while rows := self.client.call('page', after_id=after_id, limit=itersize):
+            for _, account, password in rows:
+                yield account, password
+            after_id = rows[-1][0]
+
+    @timed('db.search_accounts')
+    def search_accounts(self, fragment, limit=SEARCH_LIMIT) -> list:
+        """Returns the names of the accounts matching the fragment"""
+
+        return self.client.call('search', fragment=fragment, limit=limit)
+
+    @timed('db.select_accounts_page')
+    def select_accounts_page(self, after_id=0, before_id=None,
+                             limit=BROWSER_PAGE_SIZE) -> list:
+        """Returns one page of (id, account, password) tuples ordered by id"""
+
+        return _rows(self.client.call('page', after_id=after_id, before_id=before_id,
+                                      limit=limit))
+
+    @timed('db.select_password_from_db')
+    def select_password_from_db(self, account) -> list:
+        """Returns the (account, password) tuples of the account"""
+
+        return _rows(self.client.call('get', account=account))
+
+    @timed('db.select_password_history')
+    def select_password_history(self, account) -> list:
+        """Returns the (version, password, replaced_at) tuples of the account"""
+
+        return _rows(self.client.call('history', account=account))
+
+    @timed('db.prune_password_history')
+    def prune_password_history(self, keep, limit) -> int:
+        """Deletes at most limit versions past the retention limit"""
+
+        return self.client.call('prune_history', keep=keep, limit=limit)
+
+    @timed('db.select_plaintext_history_page')
+    def select_plaintext_history_page(self, prefix, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Returns (id, account, password) tuples of old versions saved before encryption"""
+
+        return _rows(self.client.call('plaintext_history', prefix=prefix, after_id=after_id,
+                                      limit=limit))
+
+    @timed('db.replace_history_passwords')
+    def replace_history_passwords(self, rows) -> int:
+        """Replaces the old versions that were not changed since they were read"""
+
+        return self.client.call('replace_history', rows=rows)
+
+    @timed('db.select_changes')
+    def select_changes(self, after_seq, limit) -> list:
+        """Returns the (change_seq, account, password, fingerprint, updated_at) tuples
+        changed after after_seq"""
+
+        return _rows(self.client.call('changes', after_seq=after_seq, limit=limit))
+
+    @timed('db.select_sync_state')
+    def select_sync_state(self, accounts) -> list:
+        """Returns the (account, change_seq, updated_at) tuples of the saved accounts"""
+
+        return _rows(self.client.call('sync_state', accounts=list(accounts)))
+
+    @timed('db.select_hint_from_db')
+    def select_hint_from_db(self) -> list:
+        """Returns the (hint,) tuples"""
+
+        return _rows(self.client.call('hint'))
+
+    @timed('db.select_secret_word_from_db')
+    def select_secret_word_from_db(self) -> list:
+        """Returns the (word, key_salt, encrypted) tuples"""
+
+        return _rows(self.client.call('secret_word'))
+
+    @timed('db.check_if_secret_word_exists')
+    def check_if_secret_word_exists(self) -> bool:
+        """Returns True if a secret word was saved"""
+
+        return self.client.call('secret_word_exists')
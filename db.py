@@ -1,79 +1,410 @@
 """PostgreSQL database"""
 
+import time
+
+import threading
+
 import psycopg2
-from psycopg2 import sql
+from psycopg2 import errors, extensions, extras, pool, sql
+
+from config import (DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER,
+                    DB_POOL_ENABLED, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+                    DB_HEALTH_CHECK_INTERVAL, DB_RECONNECT_ATTEMPTS, DB_RECONNECT_DELAY,
+                    DB_PREPARED_STATEMENTS, VAULT_USER,
+                    IMPORT_BATCH_SIZE, EXPORT_ITERSIZE, SEARCH_LIMIT, BROWSER_PAGE_SIZE)
+
+from migrations import apply_migrations, partition_name, NEXT_VERSION
+
+from metrics import timed
+
+from storage import VaultStorage, UnknownUser, batches, unique_accounts, with_fingerprints
+
+UPSERT_ACCOUNT = f'''INSERT INTO Passwords (user_id, account, password, fingerprint)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (user_id, lower(account))
+                    DO UPDATE SET account = EXCLUDED.account,
+                                  password = EXCLUDED.password,
+                                  fingerprint = EXCLUDED.fingerprint,
+                                  version = {NEXT_VERSION}'''
+SELECT_PASSWORD = '''SELECT account, password
+                     FROM Passwords
+                     WHERE user_id = %s AND lower(account) = lower(%s)'''
+SELECT_SECRET_WORD = '''SELECT word, key_salt, encrypted FROM SecretWord WHERE user_id = %s'''
+
+PREPARED_STATEMENTS = {
+    'upsert_account': UPSERT_ACCOUNT,
+    'select_password': SELECT_PASSWORD,
+    'select_secret_word': SELECT_SECRET_WORD,
+}
+
+
+class PreparingConnection(extensions.connection):
+    """A connection that remembers which statements were prepared in its session.
+
+    Prepared statements live as long as the server session, so a new connection
+    starts with an empty set and prepares them again on first use.
+
+    Attributes:
+        prepared (set): Names of the statements prepared on this connection.
+    """
 
-from config import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
 
 
-class PasswordManagerDatabase():
+def numbered_placeholders(query) -> str:
+    """Replaces the %s placeholders of the query with the $1, $2, ... of PREPARE"""
+
+    parts = query.split('%s')
+    numbered = [parts[0]]
+    for number, part in enumerate(parts[1:], start=1):
+        numbered.append(f'${number}{part}')
+    return ''.join(numbered)
+
+
+class PasswordManagerDatabase(VaultStorage):
     """A class that manages the connection to a PostgreSQL database and provides
     methods for creating and interacting with tables to store user passwords and
     a secret word with a hint.
 
+    Every method checks out a connection, runs in its own transaction and hands
+    the connection back. Connections that were dropped by the server are replaced
+    and the transaction is retried. The hot lookups and the account upsert are
+    prepared once per connection, so the server does not parse and plan them on
+    every call.
+
+    Passwords is partitioned by user: every query filters on the user's id, so it
+    reads only the partition and the indexes of that user's vault.
+
     Attributes:
-        connect_to_db (psycopg2.extensions.connection): The database connection object.
-        db_cursor (psycopg2.extensions.cursor): The database cursor object.
+        user (str): The name of the user whose vault is opened.
+        user_id (int): The id of the user, looked up on first use.
+        pooled (bool): True if connections are taken from a connection pool.
+        prepared (bool): True if the statements of PREPARED_STATEMENTS are prepared.
+        connection_pool (psycopg2.pool.ThreadedConnectionPool): The pool in pooled mode.
+        connect_to_db (psycopg2.extensions.connection): The single connection otherwise.
 
     Methods:
+        start_db_connection(): Opens the connection pool or the single connection.
         close_db_connection(): Closes the connection to the database.
-        create_main_table(): Creates a table for storing user passwords.
-        create_secret_word_table(): Creates a table for storing a secret word with a hint.
+        migrate(): Applies the pending schema migrations.
         insert_secret_word_and_hint(): Inserts a secret word and hint into the SecretWord table.
-        insert_account_and_password(): Inserts an account and password into the Passwords table.
+        update_secret_word(): Replaces the hash of the secret word.
+        update_key_salt(): Saves the salt of the encryption key unless one was saved already.
+        mark_vault_encrypted(): Records that no password of the vault is stored in plaintext.
+        insert_account_and_password(): Inserts or updates an account, keeping the old version.
+        import_accounts(): Inserts or updates many accounts in one transaction.
+        replace_passwords(): Replaces passwords that were not changed since they were read.
+        select_accounts_by_fingerprint(): Finds the accounts sharing a password fingerprint.
+        select_reused_accounts(): Lists the accounts whose fingerprint is shared.
+        select_unfingerprinted_page(): Retrieves the accounts saved without a fingerprint.
+        insert_audit_events(): Appends a batch of events to the audit log.
+        iter_accounts(): Streams all the accounts with a server-side cursor.
+        search_accounts(): Finds accounts by prefix, substring or similarity.
+        select_accounts_page(): Retrieves one page of accounts with keyset pagination.
         select_password_from_db(): Retrieves the password associated with a specified account.
+        select_password_history(): Retrieves every saved version of an account's password.
+        select_plaintext_history_page(): Retrieves old versions saved before encryption.
+        replace_history_passwords(): Replaces old versions not changed since they were read.
+        prune_password_history(): Deletes a batch of versions past the retention limit.
+        select_changes(): Retrieves the accounts changed after a change sequence number.
+        select_sync_state(): Retrieves the change sequence numbers of some accounts.
         select_hint_from_db(): Retrieves the hint associated with the secret word.
-        select_secret_word_from_db(): Retrieves the secret word from the SecretWord table.
-        check_if_secret_table_exists(): Returns True if the table exists, otherwise False.
+        select_secret_word_from_db(): Retrieves the secret word, the key salt and
+            whether the vault is encrypted.
+        check_if_secret_word_exists(): Returns True if a secret word was saved, otherwise False.
+        select_users(): Lists the users and the number of accounts in their vaults.
+        create_user(): Adds a user with an empty vault partition.
+        drop_user(): Drops a user's vault partition and secret word.
     """
 
-    def __init__(self) -> None:
-        """Connects to the postgresql database"""
+    def __init__(self, pooled=DB_POOL_ENABLED, prepared=DB_PREPARED_STATEMENTS,
+                 user=VAULT_USER) -> None:
+        """Prepares the connection settings, the connection is opened lazily
+
+        Args:
+            pooled (bool): Use a pool of connections instead of a single one.
+            prepared (bool): Run the hot statements as server-side prepared statements.
+            user (str): The name of the user whose vault is opened.
+        """
+
+        self.user = user
+
+        self.user_id = None
+
+        self.pooled = pooled
+
+        self.prepared = prepared
+
+        self.connection_pool = None
 
         self.connect_to_db = None
 
-        self.db_cursor = None
+        self.trigram_search = None
 
-    def start_db_connection(self):
-        self.connect_to_db = psycopg2.connect(host=DB_HOST,
+        self._slots = threading.BoundedSemaphore(DB_POOL_MAX_SIZE if pooled else 1)
+        self._last_used = {}
+
+    @staticmethod
+    def _connect():
+        """Opens a new connection to the database"""
+
+        return psycopg2.connect(host=DB_HOST,
                                 dbname=DB_NAME,
                                 user=DB_USER,
                                 password=DB_PASSWORD,
-                                port=DB_PORT)
-
-        self.db_cursor = self.connect_to_db.cursor()
-
+                                port=DB_PORT,
+                                connection_factory=PreparingConnection)
+
+    @timed('db.start_db_connection')
+    def start_db_connection(self) -> None:
+        """Opens the connection pool or the single connection to the database"""
+
+        if self.pooled:
+            if self.connection_pool is None:
+                self.connection_pool = pool.ThreadedConnectionPool(
+                    DB_POOL_MIN_SIZE,
+                    DB_POOL_MAX_SIZE,
+                    host=DB_HOST,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    port=DB_PORT,
+                    connection_factory=PreparingConnection)
+        elif self.connect_to_db is None or self.connect_to_db.closed:
+            self.connect_to_db = self._connect()
+
+    @timed('db.close_db_connection')
     def close_db_connection(self) -> None:
         """Closes connection to the database"""
 
-        if self.db_cursor is not None:
-            self.db_cursor.close()
-            self.db_cursor = None
+        if self.connection_pool is not None:
+            self.connection_pool.closeall()
+            self.connection_pool = None
 
         if self.connect_to_db is not None:
             self.connect_to_db.close()
             self.connect_to_db = None
 
-    def create_main_table(self) -> None:
-        """Creates a table for the user's passwords"""
+        self._last_used.clear()
+
+    def _is_healthy(self, connection) -> bool:
+        """Returns True if the connection can be used for a new transaction
+
+        Connections idle for longer than DB_HEALTH_CHECK_INTERVAL seconds are pinged,
+        recently used ones are trusted so the hot path does not pay an extra round trip.
+        """
+
+        if connection is None or connection.closed:
+            return False
+
+        status = connection.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+
+        last_used = self._last_used.get(id(connection))
+        if last_used is not None and time.monotonic() - last_used < DB_HEALTH_CHECK_INTERVAL:
+            return True
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+        return True
+
+    def _acquire(self):
+        """Checks out a healthy connection, replacing broken ones"""
+
+        if self.pooled:
+            if self.connection_pool is None:
+                self.start_db_connection()
+            for _ in range(DB_POOL_MAX_SIZE):
+                connection = self.connection_pool.getconn()
+                if self._is_healthy(connection):
+                    return connection
+                self._last_used.pop(id(connection), None)
+                self.connection_pool.putconn(connection, close=True)
+            return self.connection_pool.getconn()
+
+        if not self._is_healthy(self.connect_to_db):
+            self._release(self.connect_to_db, broken=True)
+            self.connect_to_db = self._connect()
+        return self.connect_to_db
+
+    def _release(self, connection, broken=False) -> None:
+        """Hands the connection back, closing it if it is broken"""
+
+        if connection is None:
+            return
+
+        if broken:
+            self._last_used.pop(id(connection), None)
+        else:
+            self._last_used[id(connection)] = time.monotonic()
+
+        if self.pooled:
+            if self.connection_pool is not None:
+                self.connection_pool.putconn(connection, close=broken)
+        elif broken:
+            if not connection.closed:
+                connection.close()
+            if connection is self.connect_to_db:
+                self.connect_to_db = None
+
+    def _run_in_transaction(self, work, retry=True):
+        """Runs work(cursor) in its own transaction and returns its result
+
+        If the connection is lost the transaction is retried on a new connection,
+        errors raised by the statements themselves are rolled back and re-raised.
+
+        Args:
+            work (callable): Receives a cursor and performs the statements.
+            retry (bool): Retry on a new connection if the current one is lost.
+        """
+
+        attempts = DB_RECONNECT_ATTEMPTS if retry else 1
+
+        with self._slots:
+            for attempt in range(1, attempts + 1):
+                connection = None
+                try:
+                    connection = self._acquire()
+                    with connection.cursor() as cursor:
+                        result = work(cursor)
+                    connection.commit()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    if connection is not None and not connection.closed:
+                        connection.rollback()
+                        self._release(connection)
+                        raise
+                    self._release(connection, broken=True)
+                    if attempt == attempts:
+                        raise
+                    time.sleep(DB_RECONNECT_DELAY * attempt)
+                    continue
+                except Exception:
+                    if connection is not None:
+                        connection.rollback()
+                        self._release(connection)
+                    raise
+
+                self._release(connection)
+                return result
+
+        return None
+
+    def _run_outside_transaction(self, work):
+        """Runs work(cursor) in autocommit mode and returns its result
+
+        For the statements PostgreSQL refuses to run inside a transaction block,
+        such as DETACH PARTITION ... CONCURRENTLY. Nothing is retried: such a
+        statement may have committed part of its work before the connection was lost.
+        """
+
+        with self._slots:
+            connection = self._acquire()
+            try:
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    result = work(cursor)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self._release(connection, broken=connection.closed != 0)
+                raise
+            except Exception:
+                self._release(connection)
+                raise
+            finally:
+                if not connection.closed:
+                    connection.autocommit = False
+
+            self._release(connection)
+            return result
+
+    def _execute(self, query, params=None, fetch=False):
+        """Executes a single statement in its own transaction
+
+        Args:
+            query (str | psycopg2.sql.Composable): The statement to execute.
+            params (tuple): Parameters for the statement.
+            fetch (bool): Return all the selected rows.
+        """
+
+        def work(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall() if fetch else None
+
+        return self._run_in_transaction(work)
 
-        self.db_cursor.execute(sql.SQL('''CREATE TABLE IF NOT EXISTS Passwords
-                            (id serial PRIMARY KEY, account varchar(255), 
-                            password varchar(255))'''))
-        self.connect_to_db.commit()
+    def _execute_prepared(self, name, params=(), fetch=False):
+        """Executes one of PREPARED_STATEMENTS in its own transaction
 
+        The statement is prepared on the first use on each connection. If the
+        server forgot it (e.g. after DISCARD ALL by a connection pooler), it is
+        prepared again and the call is retried once. With prepared statements
+        turned off the plain query is executed instead.
 
-    def create_secret_word_table(self) -> None:
-        """Creates a table for the secret word"""
+        Args:
+            name (str): Key of the statement in PREPARED_STATEMENTS.
+            params (tuple): Parameters for the statement.
+            fetch (bool): Return all the selected rows.
+        """
+
+        if not self.prepared:
+            return self._execute(PREPARED_STATEMENTS[name], params, fetch)
+
+        def work(cursor):
+            prepared = cursor.connection.prepared
+            if name not in prepared:
+                cursor.execute(f'PREPARE {name} AS '
+                               f'{numbered_placeholders(PREPARED_STATEMENTS[name])}')
+                prepared.add(name)
+            placeholders = ', '.join(['%s'] * len(params))
+            try:
+                cursor.execute(f'EXECUTE {name} ({placeholders})' if params
+                               else f'EXECUTE {name}', params)
+            except errors.InvalidSqlStatementName:
+                prepared.discard(name)
+                raise
+            return cursor.fetchall() if fetch else None
+
+        try:
+            return self._run_in_transaction(work)
+        except errors.InvalidSqlStatementName:
+            return self._run_in_transaction(work)
+
+    def _user_id(self) -> int:
+        """Returns the id of the user, looking it up once
+
+        Must be called before a transaction is started, never from inside one.
 
-        self.db_cursor.execute('''CREATE TABLE IF NOT EXISTS SecretWord
-                                (id serial PRIMARY KEY,
-                                word varchar(255),
-                                hint varchar(255))''')
+        Raises:
+            UnknownUser: No vault was created for the user.
+        """
+
+        if self.user_id is None:
+            rows = self._execute('''SELECT id FROM Users WHERE lower(name) = lower(%s)''',
+                                 (self.user,), fetch=True)
+            if not rows:
+                raise UnknownUser(f'No vault for the user {self.user!r}')
+            self.user_id = rows[0][0]
+        return self.user_id
 
-        self.connect_to_db.commit()
+    @timed('db.migrate')
+    def migrate(self) -> list:
+        """Brings the schema up to date, called once at startup
 
+        Returns:
+            list: The versions of the applied migrations.
+        """
 
+        return self._run_in_transaction(apply_migrations)
+
+    @timed('db.insert_secret_word_and_hint')
     def insert_secret_word_and_hint(self, secret_word, user_hint) -> None:
         """Insert secret word and a hint into a table
 
@@ -82,24 +413,290 @@ class PasswordManagerDatabase():
             user_hint(str): Hint for the secret word.
         """
 
-        self.db_cursor.execute('''INSERT INTO SecretWord (word, hint)
-                                VALUES (%s, %s) ''',
-                                (secret_word, user_hint))
-        self.connect_to_db.commit()
+        self._execute('''INSERT INTO SecretWord (user_id, word, hint)
+                                VALUES (%s, %s, %s) ''',
+                                (self._user_id(), secret_word, user_hint))
+
+    @timed('db.update_secret_word')
+    def update_secret_word(self, secret_word) -> None:
+        """Replaces the hash of the secret word, the hint is kept
+
+        Args:
+            secret_word(str): New hash of the secret word.
+        """
+
+        self._execute('''UPDATE SecretWord SET word = %s WHERE user_id = %s''',
+                      (secret_word, self._user_id()))
+
+    @timed('db.update_key_salt')
+    def update_key_salt(self, key_salt) -> None:
+        """Saves the salt of the encryption key, a salt saved before is kept
+
+        Two clients unlocking an old vault at the same time therefore agree on the
+        salt that was saved first.
+
+        Args:
+            key_salt(str): The salt and the scrypt cost parameters, 'scrypt$n$r$p$salt'.
+        """
+
+        self._execute('''UPDATE SecretWord SET key_salt = %s
+                      WHERE user_id = %s AND key_salt IS NULL''',
+                      (key_salt, self._user_id()))
+
+    @timed('db.mark_vault_encrypted')
+    def mark_vault_encrypted(self) -> None:
+        """Records that no password of the vault is stored in plaintext
+
+        From then on values without the encryption prefix are rejected instead of
+        being read as passwords saved before encryption.
+        """
+
+        self._execute('''UPDATE SecretWord SET encrypted = true
+                         WHERE user_id = %s''',
+                      (self._user_id(),))
 
-    def insert_account_and_password(self, account, password) -> None:
-        """Insert account and a password into a table
+    @timed('db.insert_account_and_password')
+    def insert_account_and_password(self, account, password, fingerprint=None) -> None:
+        """Insert account and a password into a table,
+        the password of an already saved account is replaced and its old
+        version is kept in PasswordHistory by a trigger
 
         Args:
             account (str): The account to save.
             password(str): Password for the account.
+            fingerprint(str): Keyed fingerprint of the password for reuse detection.
+        """
+        self._execute_prepared('upsert_account', (self._user_id(), account, password, fingerprint))
+
+
+    @timed('db.import_accounts')
+    def import_accounts(self, rows, batch_size=IMPORT_BATCH_SIZE) -> int:
+        """Inserts or updates many accounts in one transaction with multi-row inserts
+
+        Args:
+            rows (iterable of tuple): (account, password[, fingerprint]) tuples, consumed lazily.
+            batch_size (int): Number of rows sent to the server in one statement.
+
+        Returns:
+            int: The number of rows saved, an account repeated within a batch counts once.
+        """
+
+        user_id = self._user_id()
+
+        def work(cursor):
+            count = 0
+            for batch in batches(with_fingerprints(rows), batch_size):
+                batch = unique_accounts(batch)
+                extras.execute_values(cursor,
+                                      f'''INSERT INTO Passwords
+                                      (user_id, account, password, fingerprint)
+                                      VALUES %s
+                                      ON CONFLICT (user_id, lower(account))
+                                      DO UPDATE SET account = EXCLUDED.account,
+                                                    password = EXCLUDED.password,
+                                                    fingerprint = EXCLUDED.fingerprint,
+                                                    version = {NEXT_VERSION}''',
+                                      [(user_id, *row) for row in batch],
+                                      page_size=batch_size)
+                count += len(batch)
+            return count
+
+        return self._run_in_transaction(work, retry=False)
+
+    @timed('db.replace_passwords')
+    def replace_passwords(self, rows) -> int:
+        """Replaces the stored passwords that were not changed since they were read
+
+        Args:
+            rows (list of tuple): (id, old password, new password, fingerprint) tuples.
+
+        Returns:
+            int: The number of replaced passwords.
+        """
+
+        query = sql.SQL('''UPDATE Passwords AS stored
+                           SET password = changed.new,
+                               fingerprint = changed.fingerprint
+                           FROM (VALUES %s) AS changed (id, old, new, fingerprint)
+                           WHERE stored.user_id = {user_id}
+                           AND stored.id = changed.id
+                           AND stored.password = changed.old''').format(
+                               user_id=sql.Literal(self._user_id()))
+
+        def work(cursor):
+            extras.execute_values(cursor, query, rows, page_size=max(len(rows), 1))
+            return cursor.rowcount
+
+        return self._run_in_transaction(work)
+
+    @timed('db.select_accounts_by_fingerprint')
+    def select_accounts_by_fingerprint(self, fingerprint) -> list:
+        """Selects the accounts whose password has the fingerprint, served by its index
+
+        Args:
+            fingerprint (str): Keyed fingerprint of a password.
+
+        Returns:
+            list: The account names.
+        """
+
+        rows = self._execute('''SELECT account FROM Passwords
+                             WHERE user_id = %s AND fingerprint = %s ORDER BY account''',
+                             (self._user_id(), fingerprint), fetch=True)
+        return [row[0] for row in rows]
+
+    @timed('db.select_reused_accounts')
+    def select_reused_accounts(self) -> list:
+        """Selects the accounts sharing their password with another account
+
+        Returns:
+            list: (fingerprint, account) tuples ordered by fingerprint.
         """
-        self.db_cursor.execute('''INSERT INTO Passwords (account, password)
-                            VALUES (%s, %s) ''',
-                            (account, password))
-        self.connect_to_db.commit()
 
+        return self._execute('''SELECT fingerprint, account FROM Passwords
+                             WHERE user_id = %(user_id)s
+                             AND fingerprint IN (SELECT fingerprint FROM Passwords
+                                                 WHERE user_id = %(user_id)s
+                                                 AND fingerprint IS NOT NULL
+                                                 GROUP BY fingerprint
+                                                 HAVING count(*) > 1)
+                             ORDER BY fingerprint, account''',
+                             {'user_id': self._user_id()}, fetch=True)
 
+    @timed('db.insert_audit_events')
+    def insert_audit_events(self, events) -> None:
+        """Appends a batch of events to the AuditLog table with one multi-row insert
+
+        Args:
+            events (list of tuple): (event_type, account, client, created_at) tuples,
+                created_at as an ISO 8601 string.
+        """
+
+        def work(cursor):
+            extras.execute_values(cursor,
+                                  '''INSERT INTO AuditLog
+                                  (event_type, account, client, created_at)
+                                  VALUES %s''',
+                                  events, page_size=max(len(events), 1))
+
+        self._run_in_transaction(work)
+
+    @timed('db.select_unfingerprinted_page')
+    def select_unfingerprinted_page(self, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Selects the next accounts saved without a fingerprint, served by a partial index
+
+        Args:
+            after_id (int): Select the accounts following this id.
+            limit (int): The maximum number of accounts.
+
+        Returns:
+            list: A list of tuples containing the 'id', 'account' and 'password' values.
+        """
+
+        return self._execute('''SELECT id, account, password FROM Passwords
+                             WHERE user_id = %s AND fingerprint IS NULL AND id > %s
+                             ORDER BY id LIMIT %s''', (self._user_id(), after_id, limit),
+                             fetch=True)
+
+    @timed('db.iter_accounts')
+    def iter_accounts(self, itersize=EXPORT_ITERSIZE):
+        """Yields every (account, password) tuple of the Passwords table
+
+        Rows are read through a named (server-side) cursor, so only itersize rows
+        are held in memory at a time however big the table is.
+
+        Args:
+            itersize (int): Number of rows fetched from the server in one round trip.
+        """
+
+        user_id = self._user_id()
+        with self._slots:
+            connection = self._acquire()
+            broken = False
+            try:
+                with connection.cursor(name='export_accounts') as cursor:
+                    cursor.itersize = itersize
+                    cursor.execute('''SELECT account, password FROM Passwords
+                                    WHERE user_id = %s ORDER BY id''', (user_id,))
+                    yield from cursor
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = bool(connection.closed)
+                raise
+            finally:
+                if not broken:
+                    connection.rollback()
+                self._release(connection, broken=broken)
+
+    @timed('db.search_accounts')
+    def search_accounts(self, fragment, limit=SEARCH_LIMIT) -> list:
+        """Finds accounts by prefix, substring or, if pg_trgm is installed, similarity
+
+        Prefix matches come first, then substring matches, then similar accounts.
+        The trigram index serves all three conditions.
+
+        Args:
+            fragment (str): Part of the account name typed by the user.
+            limit (int): The maximum number of accounts to return.
+
+        Returns:
+            list: The matching account names.
+        """
+
+        if self.trigram_search is None:
+            rows = self._execute('''SELECT EXISTS (SELECT 1 FROM pg_extension
+                                 WHERE extname = 'pg_trgm')''', fetch=True)
+            self.trigram_search = rows[0][0]
+
+        fragment = fragment.lower()
+        escaped = fragment.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params = {'user_id': self._user_id(), 'fragment': fragment, 'prefix': escaped + '%',
+                  'pattern': '%' + escaped + '%', 'limit': limit}
+        if self.trigram_search:
+            query = '''SELECT account FROM Passwords
+                       WHERE user_id = %(user_id)s
+                       AND (lower(account) LIKE %(pattern)s
+                            OR lower(account) %% %(fragment)s)
+                       ORDER BY lower(account) LIKE %(prefix)s DESC,
+                                lower(account) LIKE %(pattern)s DESC,
+                                similarity(lower(account), %(fragment)s) DESC,
+                                account
+                       LIMIT %(limit)s'''
+        else:
+            query = '''SELECT account FROM Passwords
+                       WHERE user_id = %(user_id)s AND lower(account) LIKE %(pattern)s
+                       ORDER BY lower(account) LIKE %(prefix)s DESC, account
+                       LIMIT %(limit)s'''
+
+        return [row[0] for row in self._execute(query, params, fetch=True)]
+
+    @timed('db.select_accounts_page')
+    def select_accounts_page(self, after_id=0, before_id=None,
+                             limit=BROWSER_PAGE_SIZE) -> list:
+        """Selects one page of accounts ordered by id with keyset pagination
+
+        Only the rows of the page are read, using the primary key index, however
+        deep into the table the page is.
+
+        Args:
+            after_id (int): Select the accounts following this id.
+            before_id (int): If given, select the accounts preceding this id instead.
+            limit (int): The maximum number of accounts on the page.
+
+        Returns:
+            list: A list of tuples containing the 'id', 'account' and 'password' values.
+        """
+
+        if before_id is not None:
+            rows = self._execute('''SELECT id, account, password FROM Passwords
+                                 WHERE user_id = %s AND id < %s ORDER BY id DESC LIMIT %s''',
+                                 (self._user_id(), before_id, limit), fetch=True)
+            return rows[::-1]
+
+        return self._execute('''SELECT id, account, password FROM Passwords
+                             WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s''',
+                             (self._user_id(), after_id, limit), fetch=True)
+
+    @timed('db.select_password_from_db')
     def select_password_from_db(self, account) -> list:
         """Selects a password for the particular account
 
@@ -110,13 +707,165 @@ class PasswordManagerDatabase():
             list: A list of tuples containing the 'account' and 'password' values.
         """
 
-        self.db_cursor.execute('''SELECT account,password
-                            FROM Passwords
-                            WHERE account=%s''', (account,))
-        rows = self.db_cursor.fetchall()
-        return rows
+        return self._execute_prepared('select_password', (self._user_id(), account), fetch=True)
+
+
+    @timed('db.select_password_history')
+    def select_password_history(self, account) -> list:
+        """Selects the current and the old versions of the account's password
+
+        Args:
+            account (str): The account for which to retrieve the versions.
+
+        Returns:
+            list: (version, password, replaced_at) tuples, newest first, replaced_at
+                as text and None for the current version.
+        """
+
+        return self._execute('''SELECT version, password, NULL FROM Passwords
+                             WHERE user_id = %(user_id)s AND lower(account) = lower(%(account)s)
+                             UNION ALL
+                             SELECT history.version, history.password,
+                                    history.replaced_at::text
+                             FROM PasswordHistory AS history
+                             JOIN Passwords AS current
+                             ON current.user_id = history.user_id
+                             AND current.id = history.password_id
+                             WHERE current.user_id = %(user_id)s
+                             AND history.user_id = %(user_id)s
+                             AND lower(current.account) = lower(%(account)s)
+                             ORDER BY 1 DESC''',
+                             {'user_id': self._user_id(), 'account': account}, fetch=True)
+
+    @timed('db.select_plaintext_history_page')
+    def select_plaintext_history_page(self, prefix, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Selects the next old versions whose password does not start with prefix
+
+        Those are the versions of passwords saved before encryption.
+
+        Args:
+            prefix (str): The prefix of encrypted passwords.
+            after_id (int): Select the versions following this id.
+            limit (int): The maximum number of versions.
+
+        Returns:
+            list: (id, account, password) tuples, the account of the current version.
+        """
+
+        return self._execute('''SELECT history.id, current.account, history.password
+                             FROM PasswordHistory AS history
+                             JOIN Passwords AS current
+                             ON current.user_id = history.user_id
+                             AND current.id = history.password_id
+                             WHERE history.user_id = %s AND history.id > %s
+                             AND substr(history.password, 1, length(%s::text)) <> %s
+                             ORDER BY history.id LIMIT %s''',
+                             (self._user_id(), after_id, prefix, prefix, limit), fetch=True)
+
+    @timed('db.replace_history_passwords')
+    def replace_history_passwords(self, rows) -> int:
+        """Replaces the old versions that were not changed since they were read
+
+        Args:
+            rows (list of tuple): (id, old password, new password) tuples.
+
+        Returns:
+            int: The number of replaced versions.
+        """
+
+        query = sql.SQL('''UPDATE PasswordHistory AS stored
+                           SET password = changed.new
+                           FROM (VALUES %s) AS changed (id, old, new)
+                           WHERE stored.user_id = {user_id}
+                           AND stored.id = changed.id
+                           AND stored.password = changed.old''').format(
+                               user_id=sql.Literal(self._user_id()))
 
+        def work(cursor):
+            extras.execute_values(cursor, query, rows, page_size=max(len(rows), 1))
+            return cursor.rowcount
 
+        return self._run_in_transaction(work)
+
+    @timed('db.prune_password_history')
+    def prune_password_history(self, keep, limit) -> int:
+        """Deletes one batch of the versions past the retention limit
+
+        Versions of an account are numbered without gaps, so the versions to delete
+        are found through the history index without ranking every row. Only the
+        history of this user's vault is compacted.
+
+        Args:
+            keep (int): Number of old versions kept per account.
+            limit (int): The maximum number of versions deleted.
+
+        Returns:
+            int: The number of deleted versions.
+        """
+
+        user_id = self._user_id()
+
+        def work(cursor):
+            cursor.execute('''DELETE FROM PasswordHistory
+                              WHERE id IN (SELECT history.id
+                                           FROM PasswordHistory AS history
+                                           JOIN Passwords AS current
+                                           ON current.user_id = history.user_id
+                                           AND current.id = history.password_id
+                                           WHERE current.user_id = %(user_id)s
+                                           AND history.user_id = %(user_id)s
+                                           AND history.version < current.version - %(keep)s
+                                           LIMIT %(limit)s)''',
+                           {'user_id': user_id, 'keep': keep, 'limit': limit})
+            return cursor.rowcount
+
+        return self._run_in_transaction(work)
+
+    @timed('db.select_changes')
+    def select_changes(self, after_seq, limit) -> list:
+        """Selects the accounts changed after the watermark of a sync client
+
+        A trigger numbers every insert and update from one sequence while holding a
+        per-user lock until commit, so the numbers of a vault become visible in
+        order and a client that saw after_seq never misses an older change.
+
+        Args:
+            after_seq (int): The highest change sequence number the client has.
+            limit (int): The maximum number of accounts.
+
+        Returns:
+            list: (change_seq, account, password, fingerprint, updated_at) tuples,
+                updated_at in seconds since the epoch.
+        """
+
+        return self._execute('''SELECT change_seq, account, password, fingerprint,
+                                    extract(epoch FROM updated_at)::float8
+                             FROM Passwords
+                             WHERE user_id = %s AND change_seq > %s
+                             ORDER BY change_seq LIMIT %s''',
+                             (self._user_id(), after_seq, limit), fetch=True)
+
+    @timed('db.select_sync_state')
+    def select_sync_state(self, accounts) -> list:
+        """Selects the change sequence numbers of the accounts a sync client changed
+
+        Args:
+            accounts (list): The account names.
+
+        Returns:
+            list: (account, change_seq, updated_at) tuples of the saved accounts.
+        """
+
+        if not accounts:
+            return []
+        return self._execute('''SELECT account, change_seq,
+                                    extract(epoch FROM updated_at)::float8
+                             FROM Passwords
+                             WHERE user_id = %s AND lower(account) = ANY(%s)''',
+                             (self._user_id(), [account.lower() for account in accounts]),
+                             fetch=True)
+
+    @timed('db.select_hint_from_db')
     def select_hint_from_db(self) -> list:
         """Selects a hint from the SecretWord table
 
@@ -124,26 +873,113 @@ class PasswordManagerDatabase():
             list: A list of tuples containing the 'hint' values.
         """
 
-        self.db_cursor.execute(sql.SQL('''SELECT hint FROM SecretWord'''))
-        rows = self.db_cursor.fetchall()
+        rows = self._execute(sql.SQL('''SELECT hint FROM SecretWord WHERE user_id = %s'''),
+                             (self._user_id(),), fetch=True)
         return rows
 
+    @timed('db.select_secret_word_from_db')
     def select_secret_word_from_db(self) -> list:
-        """Selects a secret word from the SecretWord table
+        """Selects a secret word and the salt of the encryption key from the SecretWord table
 
         Returns:
-            list: A list of tuples containing the 'word' values.
+            list: A list of tuples containing the 'word', 'key_salt' and 'encrypted' values.
         """
 
-        self.db_cursor.execute(sql.SQL('''SELECT word FROM SecretWord'''))
-        rows = self.db_cursor.fetchall()
-        return rows
+        return self._execute_prepared('select_secret_word', (self._user_id(),), fetch=True)
 
-    def check_if_secret_table_exists(self) -> bool:
-        """Returns True if secret_table exists otherwise False"""
+    @timed('db.check_if_secret_word_exists')
+    def check_if_secret_word_exists(self) -> bool:
+        """Returns True if a secret word was saved otherwise False"""
 
-        try:
-            self.select_hint_from_db()
-            return True
-        except psycopg2.errors.UndefinedTable:
+        rows = self._execute('''SELECT EXISTS (SELECT 1 FROM SecretWord WHERE user_id = %s)''',
+                             (self._user_id(),), fetch=True)
+        return rows[0][0]
+
+    @timed('db.select_users')
+    def select_users(self) -> list:
+        """Selects every user with the number of accounts in the vault
+
+        Returns:
+            list: (name, number of accounts) tuples ordered by name.
+        """
+
+        return self._execute('''SELECT users.name, count(passwords.id)
+                             FROM Users AS users
+                             LEFT JOIN Passwords AS passwords ON passwords.user_id = users.id
+                             GROUP BY users.id, users.name
+                             ORDER BY lower(users.name)''', fetch=True)
+
+    @timed('db.create_user')
+    def create_user(self, name) -> int:
+        """Adds a user and creates the partition of the user's vault
+
+        The vault is empty until the user saves a secret word.
+
+        Args:
+            name (str): The name of the new user.
+
+        Returns:
+            int: The id of the user.
+        """
+
+        def work(cursor):
+            cursor.execute('''INSERT INTO Users (name) VALUES (%s) RETURNING id''', (name,))
+            user_id = cursor.fetchone()[0]
+            cursor.execute(sql.SQL('CREATE TABLE {} PARTITION OF Passwords FOR VALUES IN ({})')
+                           .format(sql.Identifier(partition_name(user_id)),
+                                   sql.Literal(user_id)))
+            return user_id
+
+        return self._run_in_transaction(work)
+
+    @timed('db.drop_user')
+    def drop_user(self, name) -> bool:
+        """Drops the user with the partition of the vault, the history and the secret word
+
+        Dropping the partition removes every account of the user at once, however
+        many there are, without touching the other vaults. The partition is first
+        detached concurrently, which only waits for the queries already running:
+        dropping an attached partition would lock the whole Passwords table and
+        block every other user meanwhile. A detach interrupted earlier is finalized.
+        Detaching concurrently needs PostgreSQL 14 or newer.
+
+        Args:
+            name (str): The name of the user to drop.
+
+        Returns:
+            bool: False if there is no such user.
+        """
+
+        rows = self._execute('''SELECT id FROM Users WHERE lower(name) = lower(%s)''',
+                             (name,), fetch=True)
+        if not rows:
             return False
+        user_id = rows[0][0]
+        partition = sql.Identifier(partition_name(user_id))
+
+        def detach(cursor):
+            cursor.execute('''SELECT inhdetachpending FROM pg_inherits
+                              WHERE inhrelid = to_regclass(%s)''', (partition_name(user_id),))
+            row = cursor.fetchone()
+            if row is None:
+                return
+            mode = sql.SQL('FINALIZE' if row[0] else 'CONCURRENTLY')
+            cursor.execute(sql.SQL('ALTER TABLE Passwords DETACH PARTITION {} {}')
+                           .format(partition, mode))
+
+        self._run_outside_transaction(detach)
+
+        def work(cursor):
+            cursor.execute('''SELECT id FROM Users WHERE id = %s FOR UPDATE''', (user_id,))
+            if cursor.fetchone() is None:
+                return False
+            cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}').format(partition))
+            cursor.execute('''DELETE FROM PasswordHistory WHERE user_id = %s''', (user_id,))
+            cursor.execute('''DELETE FROM SecretWord WHERE user_id = %s''', (user_id,))
+            cursor.execute('''DELETE FROM Users WHERE id = %s''', (user_id,))
+            return True
+
+        dropped = self._run_in_transaction(work)
+        if dropped and name.lower() == self.user.lower():
+            self.user_id = None
+        return dropped
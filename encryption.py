@@ -0,0 +1,414 @@
+"""Client-side encryption of the stored passwords
+
+Passwords are encrypted with AES-GCM before they reach the storage backend, so
+neither the database nor the vault daemon ever sees them in plaintext. The key
+is derived from the secret word once per unlock (see security.unlock_vault) and
+only kept in memory while the vault is unlocked.
+"""
+
+import base64
+
+import hashlib
+
+import hmac
+
+import secrets
+
+from itertools import groupby
+
+from cryptography.exceptions import InvalidTag
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from config import IMPORT_BATCH_SIZE, EXPORT_ITERSIZE, SEARCH_LIMIT, BROWSER_PAGE_SIZE
+
+from metrics import timed
+
+from storage import VaultStorage
+
+PREFIX = 'enc1:'
+NONCE_SIZE = 12
+FINGERPRINT_CONTEXT = b'password-manager fingerprint v1'
+
+
+class VaultLocked(Exception):
+    """A password was read or written while the vault was locked."""
+
+
+class VaultCipher:
+    """Authenticated encryption of passwords with one AES-256-GCM key.
+
+    Every password gets a random nonce, and the lowercased account name is
+    authenticated with it, so a ciphertext copied to another account fails to
+    decrypt. Values without the 'enc1:' prefix were saved before encryption and
+    are returned unchanged, until the vault records that every password was
+    encrypted: from then on they are rejected like tampered ciphertext.
+
+    Equal passwords get equal fingerprints, an HMAC-SHA256 under a second key
+    derived from the vault key, so reuse is found by comparing fingerprints and
+    never plaintext. Without the secret word the fingerprints cannot be tested
+    against a list of guesses.
+
+    Attributes:
+    - key: the 32 byte key derived from the secret word
+    - accept_plaintext: read values without the prefix as passwords saved before encryption
+
+    Methods:
+    - encrypt(account, password) -> str: returns 'enc1:' and the nonce and ciphertext in base64
+    - decrypt(account, value) -> str: returns the password of an encrypted or plaintext value
+    - fingerprint(password) -> str: returns the keyed fingerprint of the password in hex
+    - is_encrypted(value) -> bool: returns True if the value was encrypted
+    """
+
+    def __init__(self, key, accept_plaintext=True) -> None:
+        """Constructs a cipher, the AES key schedule and the HMAC key are computed once here."""
+
+        self.key = key
+        self.accept_plaintext = accept_plaintext
+        self._aead = AESGCM(key)
+        self._fingerprint_key = hmac.new(key, FINGERPRINT_CONTEXT, hashlib.sha256).digest()
+
+    @staticmethod
+    def is_encrypted(value) -> bool:
+        """Returns True if the stored value was encrypted."""
+
+        return value.startswith(PREFIX)
+
+    def encrypt(self, account, password) -> str:
+        """Encrypts the password of the account."""
+
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        ciphertext = self._aead.encrypt(nonce, password.encode(), account.lower().encode())
+        return PREFIX + base64.b64encode(nonce + ciphertext).decode('ascii')
+
+    def decrypt(self, account, value) -> str:
+        """Decrypts the stored value of the account.
+
+        Raises:
+            cryptography.exceptions.InvalidTag: The value was tampered with or moved, or it
+                is not encrypted although every password of the vault was.
+        """
+
+        if not value.startswith(PREFIX):
+            if not self.accept_plaintext:
+                raise InvalidTag('unencrypted value in an encrypted vault')
+            return value
+        data = base64.b64decode(value[len(PREFIX):])
+        plaintext = self._aead.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:],
+                                       account.lower().encode())
+        return plaintext.decode()
+
+    def fingerprint(self, password) -> str:
+        """Returns the keyed fingerprint of the password in hex."""
+
+        return hmac.new(self._fingerprint_key, password.encode(), hashlib.sha256).hexdigest()
+
+
+class EncryptedStorage(VaultStorage):
+    """A storage backend wrapper encrypting the passwords on the way in and out.
+
+    The wrapped backend stores and returns ciphertext, everything else is
+    passed through unchanged. Password calls raise VaultLocked while no key is set.
+
+    Attributes:
+        storage (VaultStorage): The wrapped backend.
+        cipher (VaultCipher): The cipher of the unlocked vault, None while locked.
+    """
+
+    def __init__(self, storage) -> None:
+        """Wraps the backend, the vault starts locked
+
+        Args:
+            storage (VaultStorage): The backend storing the ciphertext.
+        """
+
+        self.storage = storage
+        self.cipher = None
+
+    def unlock(self, key, accept_plaintext=True) -> None:
+        """Sets the key derived from the secret word
+
+        Args:
+            key (bytes): The key derived from the secret word.
+            accept_plaintext (bool): False once the vault recorded that every password
+                is encrypted.
+        """
+
+        self.cipher = VaultCipher(key, accept_plaintext)
+
+    def lock(self) -> None:
+        """Forgets the key"""
+
+        self.cipher = None
+
+    def require_cipher(self) -> VaultCipher:
+        """Returns the cipher or raises VaultLocked"""
+
+        cipher = self.cipher
+        if cipher is None:
+            raise VaultLocked('the vault is locked')
+        return cipher
+
+    def start_db_connection(self) -> None:
+        """Opens the connection of the wrapped backend"""
+
+        self.storage.start_db_connection()
+
+    def close_db_connection(self) -> None:
+        """Closes the connection of the wrapped backend and forgets the key"""
+
+        self.lock()
+        self.storage.close_db_connection()
+
+    def migrate(self) -> list:
+        """Brings the schema of the wrapped backend up to date"""
+
+        return self.storage.migrate()
+
+    def insert_secret_word_and_hint(self, secret_word, user_hint) -> None:
+        """Inserts the hash of the secret word and its hint"""
+
+        self.storage.insert_secret_word_and_hint(secret_word, user_hint)
+
+    def update_secret_word(self, secret_word) -> None:
+        """Replaces the hash of the secret word"""
+
+        self.storage.update_secret_word(secret_word)
+
+    def update_key_salt(self, key_salt) -> None:
+        """Saves the salt of the encryption key unless one was saved already"""
+
+        self.storage.update_key_salt(key_salt)
+
+    def mark_vault_encrypted(self) -> None:
+        """Records that every password is encrypted and rejects plaintext values from now on"""
+
+        self.storage.mark_vault_encrypted()
+        if self.cipher is not None:
+            self.cipher.accept_plaintext = False
+
+    @timed('crypto.insert_account_and_password')
+    def insert_account_and_password(self, account, password, fingerprint=None) -> None:
+        """Encrypts and fingerprints the password and saves the account"""
+
+        cipher = self.require_cipher()
+        self.storage.insert_account_and_password(account, cipher.encrypt(account, password),
+                                                 cipher.fingerprint(password))
+
+    @timed('crypto.import_accounts')
+    def import_accounts(self, rows, batch_size=IMPORT_BATCH_SIZE) -> int:
+        """Encrypts and fingerprints the rows lazily as the backend consumes them"""
+
+        cipher = self.require_cipher()
+        encrypted = ((account, cipher.encrypt(account, password), cipher.fingerprint(password))
+                     for account, password, *_ in rows)
+        return self.storage.import_accounts(encrypted, batch_size)
+
+    def replace_passwords(self, rows) -> int:
+        """Replaces stored values that were not changed since they were read"""
+
+        return self.storage.replace_passwords(rows)
+
+    def select_accounts_by_fingerprint(self, fingerprint) -> list:
+        """Returns the names of the accounts with the fingerprint"""
+
+        return self.storage.select_accounts_by_fingerprint(fingerprint)
+
+    def select_reused_accounts(self) -> list:
+        """Returns (fingerprint, account) tuples of shared fingerprints, ordered by fingerprint"""
+
+        return self.storage.select_reused_accounts()
+
+    def insert_audit_events(self, events) -> None:
+        """Appends (event_type, account, client, created_at) rows to the audit log"""
+
+        self.storage.insert_audit_events(events)
+
+    def select_unfingerprinted_page(self, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Returns the raw (id, account, value) tuples without a fingerprint"""
+
+        return self.storage.select_unfingerprinted_page(after_id, limit)
+
+    @timed('crypto.find_reuse')
+    def find_reuse(self, password, account=None) -> list:
+        """Returns the accounts other than account that use the same password
+
+        The password is fingerprinted and looked up in the fingerprint index.
+        """
+
+        fingerprint = self.require_cipher().fingerprint(password)
+        skipped = account.lower() if account is not None else None
+        return [name for name in self.storage.select_accounts_by_fingerprint(fingerprint)
+                if name.lower() != skipped]
+
+    def reuse_report(self) -> list:
+        """Returns a list of account name lists, the accounts of a list share a password"""
+
+        return [[account for _, account in group]
+                for _, group in groupby(self.storage.select_reused_accounts(),
+                                        key=lambda row: row[0])]
+
+    @timed('crypto.iter_accounts')
+    def iter_accounts(self, itersize=EXPORT_ITERSIZE):
+        """Yields every (account, password) tuple with the password decrypted"""
+
+        cipher = self.require_cipher()
+        for account, value in self.storage.iter_accounts(itersize):
+            yield account, cipher.decrypt(account, value)
+
+    def search_accounts(self, fragment, limit=SEARCH_LIMIT) -> list:
+        """Returns the names of the accounts matching the fragment"""
+
+        return self.storage.search_accounts(fragment, limit)
+
+    @timed('crypto.select_accounts_page')
+    def select_accounts_page(self, after_id=0, before_id=None,
+                             limit=BROWSER_PAGE_SIZE) -> list:
+        """Returns one page of (id, account, password) tuples with the passwords decrypted"""
+
+        cipher = self.require_cipher()
+        return [(row_id, account, cipher.decrypt(account, value))
+                for row_id, account, value
+                in self.storage.select_accounts_page(after_id, before_id, limit)]
+
+    @timed('crypto.select_password_from_db')
+    def select_password_from_db(self, account) -> list:
+        """Returns the (account, password) tuples of the account with the password decrypted"""
+
+        cipher = self.require_cipher()
+        return [(name, cipher.decrypt(name, value))
+                for name, value in self.storage.select_password_from_db(account)]
+
+    def select_password_history(self, account) -> list:
+        """Returns the (version, password, replaced_at) tuples with the passwords decrypted
+
+        The password of a version that cannot be decrypted, for example one saved
+        under a name that differs in case, is None.
+        """
+
+        cipher = self.require_cipher()
+        versions = []
+        for version, value, replaced_at in self.storage.select_password_history(account):
+            try:
+                password = cipher.decrypt(account, value)
+            except InvalidTag:
+                password = None
+            versions.append((version, password, replaced_at))
+        return versions
+
+    def prune_password_history(self, keep, limit) -> int:
+        """Deletes at most limit versions past the retention limit"""
+
+        return self.storage.prune_password_history(keep, limit)
+
+    def select_plaintext_history_page(self, prefix, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Returns (id, account, password) tuples of old versions saved before encryption"""
+
+        return self.storage.select_plaintext_history_page(prefix, after_id, limit)
+
+    def replace_history_passwords(self, rows) -> int:
+        """Replaces old versions that were not changed since they were read"""
+
+        return self.storage.replace_history_passwords(rows)
+
+    def select_changes(self, after_seq, limit) -> list:
+        """Returns the changed accounts as stored, the passwords stay encrypted"""
+
+        return self.storage.select_changes(after_seq, limit)
+
+    def select_sync_state(self, accounts) -> list:
+        """Returns the (account, change_seq, updated_at) tuples of the saved accounts"""
+
+        return self.storage.select_sync_state(accounts)
+
+    def sync(self):
+        """Synchronizes the local replica of the wrapped backend, if it keeps one"""
+
+        return self.storage.sync()
+
+    def select_hint_from_db(self) -> list:
+        """Returns the (hint,) tuples"""
+
+        return self.storage.select_hint_from_db()
+
+    def select_secret_word_from_db(self) -> list:
+        """Returns the (word, key_salt) tuples"""
+
+        return self.storage.select_secret_word_from_db()
+
+    def check_if_secret_word_exists(self) -> bool:
+        """Returns True if a secret word was saved"""
+
+        return self.storage.check_if_secret_word_exists()
+
+
+def encrypt_plaintext_chunk(data_base, after_id=0, chunk_size=IMPORT_BATCH_SIZE):
+    """Encrypts and fingerprints the next chunk_size accounts saved without a fingerprint
+
+    Those are the rows saved before encryption or before fingerprints were added.
+    They are read with keyset pagination over a partial index and written back
+    only if they were not changed in the meantime, so a password saved by another
+    client during the migration is never overwritten. A scan from the first id
+    that finds no such row records that the vault is encrypted.
+
+    Args:
+        data_base (EncryptedStorage): The unlocked storage.
+        after_id (int): Continue with the accounts following this id.
+        chunk_size (int): Number of accounts read at a time.
+
+    Returns:
+        tuple: (next after_id or None when every row was checked, number of rows updated).
+    """
+
+    cipher = data_base.require_cipher()
+    rows = data_base.select_unfingerprinted_page(after_id, chunk_size)
+    if not rows:
+        if after_id == 0 and cipher.accept_plaintext:
+            encrypt_plaintext_history(data_base, chunk_size)
+            data_base.mark_vault_encrypted()
+        return None, 0
+
+    updates = []
+    for row_id, account, value in rows:
+        if cipher.is_encrypted(value):
+            updates.append((row_id, value, value,
+                            cipher.fingerprint(cipher.decrypt(account, value))))
+        else:
+            updates.append((row_id, value, cipher.encrypt(account, value),
+                            cipher.fingerprint(value)))
+    return rows[-1][0], data_base.replace_passwords(updates)
+
+
+@timed('crypto.encrypt_plaintext_history')
+def encrypt_plaintext_history(data_base, chunk_size=IMPORT_BATCH_SIZE) -> int:
+    """Encrypts the old versions saved before encryption, returns the number updated
+
+    A version is encrypted for the current name of its account, which is the name
+    the history is read with. Called before the vault is marked encrypted, since
+    from then on a plaintext version could no longer be read.
+    """
+
+    cipher = data_base.require_cipher()
+    after_id, total = 0, 0
+    while rows := data_base.select_plaintext_history_page(PREFIX, after_id, chunk_size):
+        total += data_base.replace_history_passwords(
+            [(row_id, value, cipher.encrypt(account, value))
+             for row_id, account, value in rows])
+        after_id = rows[-1][0]
+    return total
+
+
+@timed('crypto.encrypt_plaintext_rows')
+def encrypt_plaintext_rows(data_base, chunk_size=IMPORT_BATCH_SIZE) -> int:
+    """Encrypts and fingerprints every old row chunk by chunk, returns the number updated
+
+    A last scan from the first id records that the vault is encrypted if no row
+    was left behind, for example by a password changed during the migration.
+    """
+
+    after_id, total = 0, 0
+    while after_id is not None:
+        after_id, encrypted = encrypt_plaintext_chunk(data_base, after_id, chunk_size)
+        total += encrypted
+    encrypt_plaintext_chunk(data_base, 0, 1)
+    return total
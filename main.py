@@ -1,6 +1,15 @@
-"""Main file to launch an app"""
+"""Main file to launch an app
 
-from password_manager import PasswordManager
+Without arguments the GUI starts, with arguments the command line interface runs,
+for example `python main.py generate --length 20`.
+"""
+
+import sys
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        from cli import main
+        sys.exit(main())
+
+    from password_manager import PasswordManager
     pasword_manager = PasswordManager()
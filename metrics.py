@@ -0,0 +1,192 @@
+"""Call counts, latency histograms and the slow call log"""
+
+import functools
+
+import inspect
+
+import logging
+
+import threading
+
+import time
+
+from bisect import bisect_left
+
+from config import METRICS_ENABLED, SLOW_CALL_THRESHOLD
+
+BUCKETS = tuple(0.0001 * 2 ** exponent for exponent in range(18))
+PERCENTILES = (0.5, 0.95, 0.99)
+
+logger = logging.getLogger('password_manager.metrics')
+
+
+class Histogram:
+    """Latency histogram with fixed exponential buckets from 0.1 ms to about 13 s.
+
+    Attributes:
+    - counts: the number of observations in every bucket, the last one is unbounded
+    - count: the number of observations
+    - total: the sum of the observations in seconds
+    - maximum: the largest observation in seconds
+    """
+
+    def __init__(self) -> None:
+        """Constructs an empty histogram."""
+
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, seconds) -> None:
+        """Records one observation."""
+
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, fraction) -> float:
+        """Returns the upper bound of the bucket holding the given fraction of observations."""
+
+        rank = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+
+class Metrics:
+    """A thread-safe registry of call latency histograms.
+
+    Methods:
+    - observe(name, seconds): records the duration of a call
+    - snapshot(): returns the count, total and percentiles of every call
+    - to_prometheus(): returns the histograms in the Prometheus text format
+    - write_prometheus(path): writes the Prometheus text to a file
+    - reset(): forgets every observation
+    """
+
+    def __init__(self) -> None:
+        """Constructs an empty registry."""
+
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds) -> None:
+        """Records the duration of a call.
+
+        Parameters:
+        - name(str): the name of the call
+        - seconds(float): the duration of the call
+        """
+
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self) -> dict:
+        """Returns the count, total, maximum and p50/p95/p99 in seconds of every call."""
+
+        with self._lock:
+            return {name: {'count': histogram.count,
+                           'total': histogram.total,
+                           'max': histogram.maximum,
+                           **{f'p{round(fraction * 100)}': histogram.percentile(fraction)
+                              for fraction in PERCENTILES}}
+                    for name, histogram in sorted(self.histograms.items())}
+
+    def to_prometheus(self) -> str:
+        """Returns the histograms in the Prometheus text exposition format."""
+
+        lines = ['# TYPE password_manager_call_seconds histogram']
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'password_manager_call_seconds_bucket'
+                                 f'{{call="{name}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'password_manager_call_seconds_bucket'
+                             f'{{call="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'password_manager_call_seconds_sum{{call="{name}"}} '
+                             f'{histogram.total}')
+                lines.append(f'password_manager_call_seconds_count{{call="{name}"}} '
+                             f'{histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path) -> None:
+        """Writes the Prometheus text to a file, for the node exporter textfile collector."""
+
+        with open(path, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(self.to_prometheus())
+
+    def reset(self) -> None:
+        """Forgets every observation."""
+
+        with self._lock:
+            self.histograms.clear()
+
+
+METRICS = Metrics()
+
+
+def _record(name, start) -> None:
+    """Records a call that started at start and logs it if it was slow."""
+
+    elapsed = time.perf_counter() - start
+    METRICS.observe(name, elapsed)
+    if elapsed > SLOW_CALL_THRESHOLD:
+        logger.warning('slow call %s took %.1f ms', name, elapsed * 1000)
+
+
+def timed(name):
+    """Decorator recording the duration of every call of the function under name.
+
+    Only the name is logged, never the arguments, since they contain secrets.
+    A generator function is timed from the first call until it is exhausted,
+    a coroutine function until it returns.
+    With METRICS_ENABLED off the function is returned unchanged.
+
+    Parameters:
+    - name(str): the name of the call, like 'db.select_password_from_db'
+    """
+
+    def decorator(function):
+        if not METRICS_ENABLED:
+            return function
+
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    yield from function(*args, **kwargs)
+                finally:
+                    _record(name, start)
+            return generator_wrapper
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def coroutine_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    _record(name, start)
+            return coroutine_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _record(name, start)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,442 @@
+"""Versioned schema migrations of the PostgreSQL and SQLite databases"""
+
+ACCOUNT_INDEX = 'passwords_account_lower_key'
+TRIGRAM_INDEX = 'passwords_account_trgm_idx'
+FINGERPRINT_INDEX = 'passwords_fingerprint_idx'
+UNFINGERPRINTED_INDEX = 'passwords_unfingerprinted_idx'
+HISTORY_INDEX = 'passwordhistory_version_key'
+USER_NAME_INDEX = 'users_name_key'
+SECRET_WORD_USER_INDEX = 'secretword_user_idx'
+HISTORY_USER_INDEX = 'passwordhistory_user_idx'
+USER_ID_INDEX = 'passwords_user_id_idx'
+CHANGE_SEQ_INDEX = 'passwords_change_seq_idx'
+DEFAULT_USER = 'default'
+MIGRATION_LOCK_ID = 0x70617373
+SYNC_LOCK_ID = 0x73796e63
+EPOCH_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+NEXT_CHANGE_SEQ = '(SELECT coalesce(max(change_seq), 0) + 1 FROM Passwords)'
+# The version of an upserted account, bumped only when the password really changed:
+# ciphertexts differ on every save, so an unchanged password is told by its fingerprint
+NEXT_VERSION = '''(CASE WHEN Passwords.fingerprint = excluded.fingerprint
+                        OR Passwords.password = excluded.password
+                   THEN Passwords.version ELSE Passwords.version + 1 END)'''
+
+
+def partition_name(user_id) -> str:
+    """Returns the name of the Passwords partition holding the vault of the user"""
+
+    return f'passwords_user_{int(user_id)}'
+
+
+MIGRATIONS = (
+    (1, 'create Passwords table', (
+        '''CREATE TABLE IF NOT EXISTS Passwords
+           (id serial PRIMARY KEY, account varchar(255),
+           password varchar(255))''',
+    )),
+    (2, 'create SecretWord table', (
+        '''CREATE TABLE IF NOT EXISTS SecretWord
+           (id serial PRIMARY KEY,
+           word varchar(255),
+           hint varchar(255))''',
+    )),
+    (3, 'merge duplicate accounts and make accounts unique', (
+        'LOCK TABLE Passwords IN SHARE ROW EXCLUSIVE MODE',
+        '''DELETE FROM Passwords AS older
+           USING Passwords AS newer
+           WHERE lower(older.account) = lower(newer.account)
+           AND older.id < newer.id''',
+        f'''CREATE UNIQUE INDEX IF NOT EXISTS {ACCOUNT_INDEX}
+            ON Passwords (lower(account))''',
+    )),
+    (4, 'trigram index for account search', (
+        '''DO $$
+           BEGIN
+               IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                   CREATE EXTENSION IF NOT EXISTS pg_trgm;
+               ELSE
+                   RAISE NOTICE 'pg_trgm is not installed, account search is not fuzzy';
+               END IF;
+           EXCEPTION WHEN insufficient_privilege OR undefined_file OR feature_not_supported THEN
+               RAISE NOTICE 'pg_trgm is not available, account search is not fuzzy';
+           END
+           $$''',
+        f'''DO $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                    CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON Passwords
+                    USING gin (lower(account) gin_trgm_ops);
+                END IF;
+            END
+            $$''',
+    )),
+    (5, 'room for encrypted passwords and the key salt', (
+        'ALTER TABLE Passwords ALTER COLUMN password TYPE text',
+        'ALTER TABLE SecretWord ADD COLUMN IF NOT EXISTS key_salt varchar(64)',
+    )),
+    (6, 'password fingerprints for reuse detection', (
+        'ALTER TABLE Passwords ADD COLUMN IF NOT EXISTS fingerprint varchar(64)',
+        f'''CREATE INDEX IF NOT EXISTS {FINGERPRINT_INDEX}
+            ON Passwords (fingerprint)''',
+        f'''CREATE INDEX IF NOT EXISTS {UNFINGERPRINTED_INDEX}
+            ON Passwords (id) WHERE fingerprint IS NULL''',
+    )),
+    (7, 'append-only audit log', (
+        '''CREATE TABLE IF NOT EXISTS AuditLog
+           (id bigserial PRIMARY KEY,
+           event_type varchar(32) NOT NULL,
+           account varchar(255),
+           client varchar(255) NOT NULL,
+           created_at timestamptz NOT NULL)''',
+        'CREATE INDEX IF NOT EXISTS auditlog_created_at_idx ON AuditLog (created_at)',
+        '''CREATE OR REPLACE FUNCTION auditlog_append_only() RETURNS trigger AS $$
+           BEGIN
+               RAISE EXCEPTION 'AuditLog is append-only';
+           END
+           $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER auditlog_append_only
+           BEFORE UPDATE OR DELETE ON AuditLog
+           FOR EACH ROW EXECUTE FUNCTION auditlog_append_only()''',
+    )),
+    (8, 'password history', (
+        'ALTER TABLE Passwords ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1',
+        '''CREATE TABLE IF NOT EXISTS PasswordHistory
+           (id bigserial PRIMARY KEY,
+           password_id integer NOT NULL,
+           version integer NOT NULL,
+           password text,
+           replaced_at timestamptz NOT NULL DEFAULT now())''',
+        f'''CREATE UNIQUE INDEX IF NOT EXISTS {HISTORY_INDEX}
+            ON PasswordHistory (password_id, version)''',
+        '''CREATE OR REPLACE FUNCTION passwords_keep_version() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO PasswordHistory (password_id, version, password)
+               VALUES (OLD.id, OLD.version, OLD.password);
+               RETURN NEW;
+           END
+           $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER passwords_keep_version
+           AFTER UPDATE ON Passwords
+           FOR EACH ROW WHEN (NEW.version > OLD.version)
+           EXECUTE FUNCTION passwords_keep_version()''',
+    )),
+    (9, 'users and Passwords partitioned by user', (
+        '''CREATE TABLE IF NOT EXISTS Users
+           (id serial PRIMARY KEY,
+           name varchar(255) NOT NULL,
+           created_at timestamptz NOT NULL DEFAULT now())''',
+        f'CREATE UNIQUE INDEX IF NOT EXISTS {USER_NAME_INDEX} ON Users (lower(name))',
+        f"INSERT INTO Users (id, name) VALUES (1, '{DEFAULT_USER}')",
+        "SELECT setval('users_id_seq', 1)",
+        'ALTER TABLE SecretWord ADD COLUMN IF NOT EXISTS user_id integer NOT NULL DEFAULT 1',
+        'ALTER TABLE SecretWord ALTER COLUMN user_id DROP DEFAULT',
+        f'CREATE INDEX IF NOT EXISTS {SECRET_WORD_USER_INDEX} ON SecretWord (user_id)',
+        'ALTER TABLE PasswordHistory ADD COLUMN IF NOT EXISTS user_id integer NOT NULL DEFAULT 1',
+        'ALTER TABLE PasswordHistory ALTER COLUMN user_id DROP DEFAULT',
+        f'''CREATE INDEX IF NOT EXISTS {HISTORY_USER_INDEX}
+            ON PasswordHistory (user_id, password_id)''',
+        'LOCK TABLE Passwords IN ACCESS EXCLUSIVE MODE',
+        'ALTER TABLE Passwords RENAME TO passwords_unpartitioned',
+        'ALTER INDEX passwords_pkey RENAME TO passwords_unpartitioned_pkey',
+        'ALTER SEQUENCE passwords_id_seq OWNED BY NONE',
+        '''CREATE TABLE Passwords
+           (id integer NOT NULL DEFAULT nextval('passwords_id_seq'),
+           user_id integer NOT NULL,
+           account varchar(255),
+           password text,
+           fingerprint varchar(64),
+           version integer NOT NULL DEFAULT 1,
+           PRIMARY KEY (user_id, id))
+           PARTITION BY LIST (user_id)''',
+        f'CREATE TABLE {partition_name(1)} PARTITION OF Passwords FOR VALUES IN (1)',
+        '''INSERT INTO Passwords (id, user_id, account, password, fingerprint, version)
+           SELECT id, 1, account, password, fingerprint, version
+           FROM passwords_unpartitioned''',
+        'DROP TABLE passwords_unpartitioned',
+        'ALTER SEQUENCE passwords_id_seq OWNED BY Passwords.id',
+        f'''CREATE UNIQUE INDEX IF NOT EXISTS {ACCOUNT_INDEX}
+            ON Passwords (user_id, lower(account))''',
+        f'''CREATE INDEX IF NOT EXISTS {FINGERPRINT_INDEX}
+            ON Passwords (user_id, fingerprint)''',
+        f'''CREATE INDEX IF NOT EXISTS {UNFINGERPRINTED_INDEX}
+            ON Passwords (user_id, id) WHERE fingerprint IS NULL''',
+        f'''DO $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                    CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON Passwords
+                    USING gin (lower(account) gin_trgm_ops);
+                END IF;
+            END
+            $$''',
+        '''CREATE OR REPLACE FUNCTION passwords_keep_version() RETURNS trigger AS $$
+           BEGIN
+               INSERT INTO PasswordHistory (user_id, password_id, version, password)
+               VALUES (OLD.user_id, OLD.id, OLD.version, OLD.password);
+               RETURN NEW;
+           END
+           $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER passwords_keep_version
+           AFTER UPDATE ON Passwords
+           FOR EACH ROW WHEN (NEW.version > OLD.version)
+           EXECUTE FUNCTION passwords_keep_version()''',
+    )),
+    (10, 'change sequence for incremental sync', (
+        'CREATE SEQUENCE IF NOT EXISTS passwords_change_seq',
+        'ALTER TABLE Passwords ADD COLUMN IF NOT EXISTS change_seq bigint',
+        '''ALTER TABLE Passwords
+           ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now()''',
+        '''UPDATE Passwords SET change_seq = nextval('passwords_change_seq')''',
+        'ALTER TABLE Passwords ALTER COLUMN change_seq SET NOT NULL',
+        f'''CREATE INDEX IF NOT EXISTS {CHANGE_SEQ_INDEX}
+            ON Passwords (user_id, change_seq)''',
+        f'''CREATE OR REPLACE FUNCTION passwords_track_change() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_advisory_xact_lock({SYNC_LOCK_ID}, NEW.user_id);
+                NEW.change_seq := nextval('passwords_change_seq');
+                NEW.updated_at := now();
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql''',
+        '''CREATE TRIGGER passwords_track_change
+           BEFORE INSERT OR UPDATE ON Passwords
+           FOR EACH ROW EXECUTE FUNCTION passwords_track_change()''',
+    )),
+    (11, 'record vaults without plaintext passwords', (
+        '''ALTER TABLE SecretWord
+           ADD COLUMN IF NOT EXISTS encrypted boolean NOT NULL DEFAULT false''',
+    )),
+)
+
+SQLITE_MIGRATIONS = (
+    (1, 'create Passwords table', (
+        '''CREATE TABLE IF NOT EXISTS Passwords
+           (id INTEGER PRIMARY KEY AUTOINCREMENT, account TEXT,
+           password TEXT)''',
+    )),
+    (2, 'create SecretWord table', (
+        '''CREATE TABLE IF NOT EXISTS SecretWord
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           word TEXT,
+           hint TEXT)''',
+    )),
+    (3, 'make accounts unique', (
+        f'''CREATE UNIQUE INDEX IF NOT EXISTS {ACCOUNT_INDEX}
+            ON Passwords (lower(account))''',
+    )),
+    (4, 'key salt of the encrypted passwords', (
+        'ALTER TABLE SecretWord ADD COLUMN key_salt TEXT',
+    )),
+    (5, 'password fingerprints for reuse detection', (
+        'ALTER TABLE Passwords ADD COLUMN fingerprint TEXT',
+        f'''CREATE INDEX IF NOT EXISTS {FINGERPRINT_INDEX}
+            ON Passwords (fingerprint)''',
+        f'''CREATE INDEX IF NOT EXISTS {UNFINGERPRINTED_INDEX}
+            ON Passwords (id) WHERE fingerprint IS NULL''',
+    )),
+    (6, 'append-only audit log', (
+        '''CREATE TABLE IF NOT EXISTS AuditLog
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           event_type TEXT NOT NULL,
+           account TEXT,
+           client TEXT NOT NULL,
+           created_at TEXT NOT NULL)''',
+        'CREATE INDEX IF NOT EXISTS auditlog_created_at_idx ON AuditLog (created_at)',
+        '''CREATE TRIGGER IF NOT EXISTS auditlog_no_update BEFORE UPDATE ON AuditLog
+           BEGIN SELECT RAISE(ABORT, 'AuditLog is append-only'); END''',
+        '''CREATE TRIGGER IF NOT EXISTS auditlog_no_delete BEFORE DELETE ON AuditLog
+           BEGIN SELECT RAISE(ABORT, 'AuditLog is append-only'); END''',
+    )),
+    (7, 'password history', (
+        'ALTER TABLE Passwords ADD COLUMN version INTEGER NOT NULL DEFAULT 1',
+        '''CREATE TABLE IF NOT EXISTS PasswordHistory
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           password_id INTEGER NOT NULL,
+           version INTEGER NOT NULL,
+           password TEXT,
+           replaced_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)''',
+        f'''CREATE UNIQUE INDEX IF NOT EXISTS {HISTORY_INDEX}
+            ON PasswordHistory (password_id, version)''',
+        '''CREATE TRIGGER IF NOT EXISTS passwords_keep_version
+           AFTER UPDATE OF version ON Passwords
+           WHEN NEW.version > OLD.version
+           BEGIN
+               INSERT INTO PasswordHistory (password_id, version, password)
+               VALUES (OLD.id, OLD.version, OLD.password);
+           END''',
+    )),
+    (8, 'users and per-user vaults', (
+        '''CREATE TABLE IF NOT EXISTS Users
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           name TEXT NOT NULL,
+           created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)''',
+        f'CREATE UNIQUE INDEX IF NOT EXISTS {USER_NAME_INDEX} ON Users (lower(name))',
+        f"INSERT INTO Users (id, name) VALUES (1, '{DEFAULT_USER}')",
+        'ALTER TABLE SecretWord ADD COLUMN user_id INTEGER NOT NULL DEFAULT 1',
+        f'CREATE INDEX IF NOT EXISTS {SECRET_WORD_USER_INDEX} ON SecretWord (user_id)',
+        'ALTER TABLE PasswordHistory ADD COLUMN user_id INTEGER NOT NULL DEFAULT 1',
+        f'''CREATE INDEX IF NOT EXISTS {HISTORY_USER_INDEX}
+            ON PasswordHistory (user_id, password_id)''',
+        'ALTER TABLE Passwords ADD COLUMN user_id INTEGER NOT NULL DEFAULT 1',
+        f'CREATE INDEX IF NOT EXISTS {USER_ID_INDEX} ON Passwords (user_id, id)',
+        f'DROP INDEX IF EXISTS {ACCOUNT_INDEX}',
+        f'''CREATE UNIQUE INDEX {ACCOUNT_INDEX}
+            ON Passwords (user_id, lower(account))''',
+        f'DROP INDEX IF EXISTS {FINGERPRINT_INDEX}',
+        f'''CREATE INDEX {FINGERPRINT_INDEX}
+            ON Passwords (user_id, fingerprint)''',
+        f'DROP INDEX IF EXISTS {UNFINGERPRINTED_INDEX}',
+        f'''CREATE INDEX {UNFINGERPRINTED_INDEX}
+            ON Passwords (user_id, id) WHERE fingerprint IS NULL''',
+        'DROP TRIGGER IF EXISTS passwords_keep_version',
+        '''CREATE TRIGGER passwords_keep_version
+           AFTER UPDATE OF version ON Passwords
+           WHEN NEW.version > OLD.version
+           BEGIN
+               INSERT INTO PasswordHistory (user_id, password_id, version, password)
+               VALUES (OLD.user_id, OLD.id, OLD.version, OLD.password);
+           END''',
+    )),
+    (9, 'change sequence for incremental sync', (
+        'ALTER TABLE Passwords ADD COLUMN change_seq INTEGER',
+        'ALTER TABLE Passwords ADD COLUMN updated_at REAL',
+        f'UPDATE Passwords SET change_seq = id, updated_at = {EPOCH_NOW}',
+        f'CREATE INDEX IF NOT EXISTS {CHANGE_SEQ_INDEX} ON Passwords (change_seq)',
+    )),
+    (10, 'record vaults without plaintext passwords', (
+        'ALTER TABLE SecretWord ADD COLUMN encrypted INTEGER NOT NULL DEFAULT 0',
+    )),
+)
+
+REPLICA_MIGRATIONS = (
+    (1, 'create the replica tables', (
+        '''CREATE TABLE IF NOT EXISTS Accounts
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           account TEXT NOT NULL,
+           password TEXT,
+           fingerprint TEXT,
+           change_seq INTEGER,
+           updated_at REAL)''',
+        f'''CREATE UNIQUE INDEX IF NOT EXISTS {ACCOUNT_INDEX}
+            ON Accounts (lower(account))''',
+        f'''CREATE INDEX IF NOT EXISTS {FINGERPRINT_INDEX}
+            ON Accounts (fingerprint)''',
+        '''CREATE TABLE IF NOT EXISTS Outbox
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+           account TEXT NOT NULL,
+           password TEXT,
+           fingerprint TEXT,
+           base_seq INTEGER,
+           queued_at REAL NOT NULL)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS outbox_account_key
+           ON Outbox (lower(account))''',
+        '''CREATE TABLE IF NOT EXISTS SyncState
+           (id INTEGER PRIMARY KEY CHECK (id = 1),
+           watermark INTEGER NOT NULL DEFAULT 0,
+           word TEXT,
+           key_salt TEXT,
+           hint TEXT,
+           synced_at REAL)''',
+        'INSERT OR IGNORE INTO SyncState (id) VALUES (1)',
+    )),
+    (2, 'cache whether the vault holds plaintext passwords', (
+        'ALTER TABLE SyncState ADD COLUMN encrypted INTEGER NOT NULL DEFAULT 0',
+    )),
+)
+
+SCHEMA_VERSION_TABLE = '''CREATE TABLE IF NOT EXISTS schema_version
+                          (version integer PRIMARY KEY,
+                          description text NOT NULL,
+                          applied_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP)'''
+
+
+def _run_pending(cursor, migrations, version, placeholder) -> list:
+    """Runs the migrations newer than version and records them in schema_version"""
+
+    applied = []
+    for migration_version, description, statements in migrations:
+        if migration_version <= version:
+            continue
+        for statement in statements:
+            if callable(statement):
+                statement(cursor)
+            else:
+                cursor.execute(statement)
+        cursor.execute('INSERT INTO schema_version (version, description) '
+                       f'VALUES ({placeholder}, {placeholder})',
+                       (migration_version, description))
+        applied.append(migration_version)
+    return applied
+
+
+def current_version(cursor) -> int:
+    """Returns the version of the PostgreSQL schema, 0 if no migration was applied yet"""
+
+    cursor.execute("SELECT to_regclass('schema_version')")
+    if cursor.fetchone()[0] is None:
+        return 0
+    cursor.execute('SELECT COALESCE(max(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+
+def apply_migrations(cursor) -> list:
+    """Applies the PostgreSQL migrations newer than the schema version
+
+    Runs in the caller's transaction, so either every pending migration is applied
+    or none. An advisory lock keeps concurrent processes from migrating twice, it is
+    only taken if the schema is outdated.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor of the migrating transaction.
+
+    Returns:
+        list: The versions that were applied.
+    """
+
+    if current_version(cursor) >= MIGRATIONS[-1][0]:
+        return []
+
+    cursor.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+    cursor.execute(SCHEMA_VERSION_TABLE)
+    return _run_pending(cursor, MIGRATIONS, current_version(cursor), '%s')
+
+
+def current_sqlite_version(cursor) -> int:
+    """Returns the version of the SQLite schema, 0 if no migration was applied yet"""
+
+    cursor.execute('''SELECT count(*) FROM sqlite_master
+                      WHERE type = 'table' AND name = 'schema_version' ''')
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute('SELECT COALESCE(max(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+
+def apply_sqlite_migrations(cursor) -> list:
+    """Applies the SQLite migrations newer than the schema version
+
+    Runs in the caller's transaction, which must have been started with
+    BEGIN IMMEDIATE so concurrent processes do not migrate twice.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the migrating transaction.
+
+    Returns:
+        list: The versions that were applied.
+    """
+
+    cursor.execute(SCHEMA_VERSION_TABLE)
+    return _run_pending(cursor, SQLITE_MIGRATIONS, current_sqlite_version(cursor), '?')
+
+
+def apply_replica_migrations(cursor) -> list:
+    """Applies the migrations of the local replica newer than its schema version
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the migrating transaction.
+
+    Returns:
+        list: The versions that were applied.
+    """
+
+    cursor.execute(SCHEMA_VERSION_TABLE)
+    return _run_pending(cursor, REPLICA_MIGRATIONS, current_sqlite_version(cursor), '?')
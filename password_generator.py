@@ -6,7 +6,24 @@ import string
 
 import secrets
 
+from math import prod
+
+from breach import is_breached
+
 SYMBOLS = string.printable[:-5]
+CHARACTER_CLASSES = (string.digits, string.ascii_lowercase,
+                     string.ascii_uppercase, string.punctuation)
+MIN_LENGTH = len(CHARACTER_CLASSES)
+SECURITY_MARGIN_BITS = 64
+MAX_BREACH_RETRIES = 100
+
+
+def secure_shuffle(items) -> None:
+    """Shuffles the list in place with Fisher-Yates and a secure random generator."""
+
+    for i in range(len(items) - 1, 0, -1):
+        j = secrets.randbelow(i + 1)
+        items[i], items[j] = items[j], items[i]
 
 
 class PassWord:
@@ -18,6 +35,7 @@ class PassWord:
     Methods:
     - __init__(self, length): constructs a PassWord instance
     - generate_password(self, length): generates a password of the specified length
+    - generate_many(count, length): generates many passwords from one bulk random draw
     - is_password_valid(self, password): checks if the specified password meets the requirements
     - set_password(self, length): sets the password attribute to a generated password
     """
@@ -36,12 +54,63 @@ class PassWord:
     def generate_password(length) -> str:
         """Generates a password of the specified length using a secure random generator.
 
+        One character of every class is picked first and the rest from all the symbols,
+        then the characters are shuffled, so the password is valid by construction.
+        A password found in the breach filter is thrown away and drawn again.
+
         Parameters:
-        - length(int): represents the desired length of the password
+        - length(int): represents the desired length of the password, at least MIN_LENGTH
+        """
+
+        if length < MIN_LENGTH:
+            raise ValueError(f'Password length must be at least {MIN_LENGTH}')
+
+        for _ in range(MAX_BREACH_RETRIES):
+            passw_chars = [secrets.choice(char_class) for char_class in CHARACTER_CLASSES]
+            passw_chars += [secrets.choice(SYMBOLS) for _ in range(length - MIN_LENGTH)]
+            secure_shuffle(passw_chars)
+            password = "".join(passw_chars)
+            if not is_breached(password):
+                return password
+        raise RuntimeError('The breach filter rejects every generated password')
+
+    @staticmethod
+    def generate_many(count, length) -> list:
+        """Generates many passwords built like generate_password with one bulk random draw.
+
+        Every password consumes one big random integer from secrets.token_bytes that is
+        split into mixed-radix digits: the character picks and the Fisher-Yates swaps.
+        The integer carries SECURITY_MARGIN_BITS more bits than needed, so no draw is
+        ever rejected and the bias stays below 2**-64. Passwords found in the breach
+        filter are replaced by generate_password.
+
+        Parameters:
+        - count(int): represents the number of passwords
+        - length(int): represents the desired length of every password, at least MIN_LENGTH
         """
 
-        passw_chars = (secrets.choice(SYMBOLS) for _ in range(length))
-        return "".join(passw_chars)
+        if length < MIN_LENGTH:
+            raise ValueError(f'Password length must be at least {MIN_LENGTH}')
+
+        alphabets = CHARACTER_CLASSES + (SYMBOLS,) * (length - MIN_LENGTH)
+        radices = [len(alphabet) for alphabet in alphabets] + list(range(2, length + 1))
+        size = (prod(radices).bit_length() + SECURITY_MARGIN_BITS + 7) // 8
+        random_bytes = secrets.token_bytes(size * count)
+
+        passwords = []
+        for offset in range(0, size * count, size):
+            value = int.from_bytes(random_bytes[offset:offset + size], 'big')
+            passw_chars = []
+            for alphabet in alphabets:
+                value, index = divmod(value, len(alphabet))
+                passw_chars.append(alphabet[index])
+            for i in range(length - 1, 0, -1):
+                value, j = divmod(value, i + 1)
+                passw_chars[i], passw_chars[j] = passw_chars[j], passw_chars[i]
+            password = "".join(passw_chars)
+            passwords.append(password if not is_breached(password)
+                             else PassWord.generate_password(length))
+        return passwords
 
     @staticmethod
     def is_password_valid(password) -> bool:
@@ -61,7 +130,4 @@ class PassWord:
         - length(int): represents the desired length of the password
         """
 
-        while not self.password:
-            password = PassWord.generate_password(length)
-            if PassWord.is_password_valid(password):
-                self.password = password
+        self.password = PassWord.generate_password(length)
@@ -1,20 +1,42 @@
 """GUI Password Manager"""
 
-import hashlib
+import time
 
-from tkinter import Tk, Canvas, PhotoImage, Label, END
-from tkinter import messagebox
+STARTED = time.perf_counter()
+
+# pylint: disable=wrong-import-position
+import logging
 
-from psycopg2 import errors
+from tkinter import Tk, Canvas, Label, Button, END
+from tkinter import messagebox
 
-from db import PasswordManagerDatabase
+from storage import create_storage
 
 from password_generator import PassWord
 
-from widgets import MainWidgets, Buttons, SecretWordUi
+from security import UnlockSession, unlock_vault, hash_secret_word
+
+from encryption import encrypt_plaintext_chunk
+
+from breach import is_breached
+
+from audit import AuditLog, client_name, LOOKUP, LOOKUP_MISSING, SAVE, UNLOCK, UNLOCK_FAILED
+
+from widgets import (MainWidgets, Buttons, SecretWordUi, VaultBrowser,
+                     load_image, preload_images)
+
+from worker import BackgroundWorker
+
+from metrics import METRICS, timed
+
+from config import (SESSION_CHECK_INTERVAL, SEARCH_DEBOUNCE_MS, SEARCH_MIN_CHARS,
+                    METRICS_FILE, HISTORY_RETENTION, HISTORY_COMPACT_BATCH, SYNC_ENABLED,
+                    SYNC_INTERVAL)
 
 BG_COLOR = '#669170'
 
+logger = logging.getLogger('password_manager')
+
 def generate_message(account: list) -> str:
     """Creates a string message from the given account information.
 
@@ -25,7 +47,9 @@ def generate_message(account: list) -> str:
         str: The generated message with each account and its associated passwords.
     """
 
-    my_dct = {k: [v for kk, v in account if kk == k] for k, _ in account}
+    my_dct = {}
+    for k, v in account:
+        my_dct.setdefault(k, []).append(v)
     if len(my_dct) > 1:
         return '\n'.join([f"{k}: {', '.join(v)}" for k, v in my_dct.items()])
     return ' '.join([f"{k}: {', '.join(v)}" for k, v in my_dct.items()])
@@ -40,8 +64,14 @@ class PasswordManager():
         the main window of the application.
     main_widgets: MainWidgets
         a collection of UI widgets for the main screen.
-    data_base: PasswordManagerDatabase
-        a database that stores the account and password information.
+    data_base: EncryptedStorage
+        the storage backend selected in config.py, passwords are encrypted before they are saved.
+    worker: BackgroundWorker
+        runs the database calls off the Tk main thread.
+    session: UnlockSession
+        remembers that the secret word was verified until the vault locks.
+    audit: AuditLog
+        writes the lookups, saves and secret word checks to the audit log in the background.
     main_buttons: Buttons
         a collection of UI buttons for the main screen.
     secret_word_buttons: SecretWordUi
@@ -53,48 +83,125 @@ class PasswordManager():
         Creates the main widgets of the GUI for account and password input.
     pressed_add_secret_word():
         Saves the secret word and hint to the database and creates the main widgets.
+    secret_word_saved():
+        Replaces the secret word form with the main widgets once the word is saved.
     pressed_hint_button():
         Shows the hint associated with the secret word.
     pressed_add_button():
         Saves the account and password to the database if the secret word is correct.
+    save_account(secret_word, account, password) -> list:
+        Saves the account and password if the secret word matches, runs on the worker thread.
+    account_saved(reused):
+        Reports the result of save_account and warns about a reused password.
     pressed_password_button():
         Generates a random password and inserts it into the password entry.
     save_secrete_word_and_hint():
         Hashes and saves the secret word and hint to the database.
-    is_secret_word_match() -> bool:
-        Compares the hashed secret word entered by the user to the one in the database.
+    is_secret_word_match(secret_word) -> bool:
+        Unlocks the session if the secret word matches the one in the database.
+    check_session():
+        Locks the vault once the session has been idle for too long.
+    lock_vault():
+        Locks the vault and forgets the encryption key, the secret word is required again.
+    encrypt_plaintext():
+        Encrypts the next chunk of passwords saved before encryption in the background.
+    plaintext_encrypted(result):
+        Continues with the next chunk until every password is encrypted.
+    plaintext_not_encrypted(error):
+        Logs a failed chunk, it is retried on the next session check.
+    compact_history():
+        Deletes the next batch of old password versions past the retention limit in the background.
+    history_compacted(deleted):
+        Continues with the next batch until no old version is left to delete.
+    history_not_compacted(error):
+        Logs a failed batch, the history is compacted again on the next start.
+    sync_replica():
+        Synchronizes the local replica with the database in the background.
+    replica_synced(result):
+        Schedules the next sync.
+    replica_not_synced(error):
+        Logs a failed sync, the saves stay queued until the next one.
+    account_typed():
+        Schedules an account search once the user stops typing.
+    search_accounts():
+        Looks up the accounts matching the typed name in the background.
+    suggestion_selected():
+        Copies the selected suggestion into the account entry.
+    run_in_background(function, *args, on_success, busy):
+        Runs a database call on the worker thread and handles its result in the Tk loop.
+    set_busy(busy):
+        Shows or hides the busy state while database calls are running.
+    cancel_request():
+        Cancels the database calls the user is waiting for.
+    show_db_error(error):
+        Shows an error raised by a database call.
+    first_paint():
+        Logs the time from the start of the process until the window was painted.
     check_secret_table():
-        Checks if the secret word table exists in the database and displays the corresponding GUI.
+        Connects to the database in the background while the window shows a connecting state.
+    connect_database() -> bool:
+        Connects, migrates the database and checks if a secret word was saved.
+    database_ready(secret_word_exists):
+        Displays the secret word form or the main widgets once the database is ready.
+    database_unavailable(error):
+        Shows the connection error and a button to try again.
     show_password():
         Retrieves and shows the password for the selected account.
+    pressed_browse_button():
+        Opens the vault browser if the secret word is correct.
+    open_vault_browser(unlocked):
+        Opens the vault browser once the secret word was checked.
+    load_vault_page(after_id, before_id, on_loaded):
+        Loads a page of the vault browser in the background.
+    find_password(secret_word, account_name) -> list:
+        Selects the password of the account if the secret word matches, runs on the worker thread.
+    password_found(result):
+        Shows the result of find_password.
     config_main_buttons():
         Configures the command functions for the main buttons of the GUI.
     clear_entry():
         Clears the input fields of the main widgets.
     on_closing():
-        Closes the database connection and destroys the Tkinter window.
+        Writes the queued audit events, closes the database connection and destroys the window.
     """
 
     main_buttons = None
     secret_word_buttons = None
 
     def __init__(self) -> None:
-        """Initializes the Tkinter window and database connection."""
+        """Initializes the Tkinter window, the database connects in the background."""
         self.window = Tk()
         self.window.title('Password Manager')
         self.window.config(padx=10, pady=10, bg=BG_COLOR)
 
         canvas = Canvas(width=200, height=200, bg=BG_COLOR, highlightthickness=0)
-        logo_img = PhotoImage(file='img/logo.png')
-        canvas.create_image(100, 100, image=logo_img)
+        canvas.create_image(100, 100, image=load_image('logo.png'))
         canvas.grid(column=1, row=0)
 
+        self.status_label = Label(text='Connecting to the database...', bg=BG_COLOR,
+                                  font=('Arial', 12, 'italic'))
+        self.status_label.grid(column=0, row=1, columnspan=3)
+        self.retry_button = None
+        self.connect_job = None
+        self.window.bind('<Map>', self.first_paint)
+        self.window.after_idle(preload_images)
+
         self.main_widgets = None
 
-        self.data_base = PasswordManagerDatabase()
+        self.data_base = create_storage()
+        self.worker = BackgroundWorker(self.window, on_busy_change=self.set_busy)
+        self.session = UnlockSession()
+        self.audit = AuditLog(self.data_base, client_name('gui'))
+        self.search_job = None
+        self.search_after_id = None
+        self.encrypt_after_id = 0
+        self.encrypt_job = None
         self.check_secret_table()
 
         self.window.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.window.bind('<Escape>', lambda _event: self.cancel_request())
+        self.window.bind('<Control-l>', lambda _event: self.lock_vault())
+        self.window.after(SESSION_CHECK_INTERVAL, self.check_session)
 
         self.window.mainloop()
 
@@ -107,6 +214,8 @@ class PasswordManager():
         self.main_widgets = MainWidgets()
         self.main_widgets.create_spinner(root=self.window)
         self.main_widgets.grid_items()
+        self.main_widgets.account_entry.bind('<KeyRelease>', self.account_typed)
+        self.main_widgets.suggestions.bind('<<ListboxSelect>>', self.suggestion_selected)
 
         account_label = Label(text='Account:', bg=BG_COLOR, font=('Arial', 12, 'bold'))
         account_label.grid(column=0, row=2)
@@ -119,28 +228,39 @@ class PasswordManager():
         password_label.grid(column=0, row=3)
 
 
+    @timed('gui.pressed_add_secret_word')
     def pressed_add_secret_word(self) -> None:
         """Saves the secret word and hint to the database and creates the main widgets."""
 
-        if self.save_secrete_word_and_hint():
-            PasswordManager.secret_word_buttons.add_secret_word_button.destroy()
-            PasswordManager.secret_word_buttons.add_secret_word_entry.destroy()
-            PasswordManager.secret_word_buttons.add_hint_entry.destroy()
-            PasswordManager.secret_word_buttons.add_secret_word_label.destroy()
-            PasswordManager.secret_word_buttons.add_hint_label.destroy()
-
-            self.create_main_widgets()
-        else:
+        if not self.save_secrete_word_and_hint():
             messagebox.showerror(title='Error', message='Please fill in all fields.')
 
+    def secret_word_saved(self, _result=None) -> None:
+        """Replaces the secret word form with the main widgets once the word is saved."""
+
+        messagebox.showinfo(title='Success', message='Data has been saved successfully.')
+
+        PasswordManager.secret_word_buttons.add_secret_word_button.destroy()
+        PasswordManager.secret_word_buttons.add_secret_word_entry.destroy()
+        PasswordManager.secret_word_buttons.add_hint_entry.destroy()
+        PasswordManager.secret_word_buttons.add_secret_word_label.destroy()
+        PasswordManager.secret_word_buttons.add_hint_label.destroy()
+
+        self.create_main_widgets()
+
+    @timed('gui.pressed_hint_button')
     def pressed_hint_button(self) -> None:
         """Shows the hint associated with the secret word."""
 
-        hint = self.data_base.select_hint_from_db()
-        messagebox.showinfo(message=hint)
+        self.run_in_background(self.data_base.select_hint_from_db,
+                               on_success=lambda hint: messagebox.showinfo(message=hint))
 
+    @timed('gui.pressed_add_button')
     def pressed_add_button(self) -> bool:
-        """Saves the account and password to the database if the secret word is correct."""
+        """Saves the account and password to the database if the secret word is correct.
+
+        A password found in the offline breach filter is only saved if the user confirms.
+        """
         account = self.main_widgets.account_entry.get()
         password = self.main_widgets.password_entry.get()
 
@@ -148,16 +268,49 @@ class PasswordManager():
             messagebox.showerror(title='Error', message='Please fill in all fields.')
             return False
 
-        if self.is_secret_word_match():
-            self.data_base.create_main_table()
-            self.data_base.insert_account_and_password(account, password)
-            messagebox.showinfo(title='Success',
-                                message=('Data has been saved successfully.'))
+        if is_breached(password) and not messagebox.askyesno(
+                title='Breached password',
+                message='This password appears in a list of breached passwords.\n'
+                        'Save it anyway?'):
+            return False
+
+        secret_word = self.main_widgets.secret_word_entry.get()
+        self.run_in_background(self.save_account, secret_word, account, password,
+                               on_success=self.account_saved)
 
         self.clear_entry()
 
         return True
 
+    @timed('gui.save_account')
+    def save_account(self, secret_word, account, password):
+        """Saves the account and password if the secret word matches, runs on the worker thread.
+
+        Returns:
+            list: The other accounts using the same password, None if the secret word is incorrect.
+        """
+
+        if not self.is_secret_word_match(secret_word):
+            return None
+        self.data_base.insert_account_and_password(account, password)
+        self.audit.record(SAVE, account)
+        return self.data_base.find_reuse(password, account)
+
+    def account_saved(self, reused) -> None:
+        """Reports the result of save_account and warns about a reused password."""
+
+        if reused is None:
+            messagebox.showerror(title='Error', message=('Incorrect secret word!'))
+        elif reused:
+            messagebox.showwarning(title='Password reused',
+                                   message=('Data has been saved successfully.\n'
+                                            'The same password is used by: '
+                                            + ', '.join(reused)))
+        else:
+            messagebox.showinfo(title='Success',
+                                message=('Data has been saved successfully.'))
+
+    @timed('gui.pressed_password_button')
     def pressed_password_button(self) -> None:
         """Generates a random password and inserts it into the password entry."""
 
@@ -170,43 +323,278 @@ class PasswordManager():
     def save_secrete_word_and_hint(self) -> bool:
         """Hashes and saves the secret word and hint to the database."""
 
-        secret_word_entry = self.secret_word_buttons.add_secret_word_entry.get()
-        secret_word = hashlib.sha256(secret_word_entry.encode())
-        secret_word = secret_word.hexdigest()
+        secret_word = self.secret_word_buttons.add_secret_word_entry.get()
         hint = self.secret_word_buttons.add_hint_entry.get()
-        if len(secret_word_entry) < 1 or len(hint) < 1:
+        if len(secret_word) < 1 or len(hint) < 1:
             return False
 
-        try:
-            self.data_base.create_secret_word_table()
-        except errors.InFailedSqlTransaction:
-            self.data_base.connect_to_db.rollback()
-        finally:
-            self.data_base.create_secret_word_table()
+        def save():
+            self.data_base.insert_secret_word_and_hint(hash_secret_word(secret_word), hint)
+            unlock_vault(self.data_base, secret_word)
+            self.session.unlock()
 
-        self.data_base.insert_secret_word_and_hint(secret_word, hint)
-        messagebox.showinfo(title='Success', message='Data has been saved successfully.')
+        self.run_in_background(save, on_success=self.secret_word_saved)
 
         return True
 
-    def is_secret_word_match(self) -> bool:
-        """Compares the hashed secret word entered by the user to the one in the database."""
+    @timed('gui.is_secret_word_match')
+    def is_secret_word_match(self, secret_word) -> bool:
+        """Unlocks the session if the secret word matches the one in the database.
 
-        user_secret_word = hashlib.sha256(self.main_widgets.secret_word_entry.get().encode())
-        user_secret_word = user_secret_word.hexdigest()
-        result = user_secret_word == self.data_base.select_secret_word_from_db()[0][0]
-        if result:
+        While the session is unlocked no query is made and the typed word is ignored.
+        A hash saved by an older version is upgraded to scrypt on the first match,
+        and the encryption key is derived once per unlock.
+        Runs on the worker thread, so it must not touch the widgets.
+
+        Args:
+            secret_word (str): The secret word typed by the user.
+        """
+
+        if self.session.touch() and self.data_base.cipher is not None:
             return True
-        messagebox.showerror(title='Error', message=('Incorrect secret word!'))
-        return False
 
+        if not unlock_vault(self.data_base, secret_word):
+            self.audit.record(UNLOCK_FAILED)
+            return False
+
+        self.session.unlock()
+        self.audit.record(UNLOCK)
+        return True
+
+    def check_session(self) -> None:
+        """Locks the vault once the session has been idle for too long."""
+
+        if not self.session.is_unlocked():
+            self.lock_vault()
+        else:
+            self.window.title('Password Manager (unlocked)')
+            self.encrypt_plaintext()
+        self.window.after(SESSION_CHECK_INTERVAL, self.check_session)
+
+    def lock_vault(self) -> None:
+        """Locks the vault and forgets the encryption key, the secret word is required again."""
+
+        self.session.lock()
+        self.data_base.lock()
+        self.window.title('Password Manager')
+
+    def encrypt_plaintext(self) -> None:
+        """Encrypts the next chunk of passwords saved before encryption in the background.
+
+        Runs while the vault is unlocked, one chunk per job so lookups are not
+        held up behind the whole migration.
+        """
+
+        if self.encrypt_after_id is None:
+            return
+        if self.encrypt_job is not None and not self.encrypt_job.cancelled:
+            return
+
+        self.encrypt_job = self.worker.submit(encrypt_plaintext_chunk, self.data_base,
+                                              self.encrypt_after_id,
+                                              on_success=self.plaintext_encrypted,
+                                              on_error=self.plaintext_not_encrypted,
+                                              busy=False)
+
+    def plaintext_encrypted(self, result) -> None:
+        """Continues with the next chunk until every password is encrypted."""
+
+        self.encrypt_job = None
+        self.encrypt_after_id, encrypted = result
+        if encrypted:
+            logger.info('encrypted %d passwords saved in plaintext', encrypted)
+        if self.encrypt_after_id is not None and self.session.is_unlocked():
+            self.encrypt_plaintext()
+
+    def plaintext_not_encrypted(self, error) -> None:
+        """Logs a failed chunk, it is retried on the next session check."""
+
+        self.encrypt_job = None
+        logger.warning('encrypting saved passwords failed: %s', type(error).__name__)
+
+    def compact_history(self) -> None:
+        """Deletes the next batch of old password versions past the retention limit
+        in the background.
+
+        One short transaction per batch, so saves are never held up for long.
+        """
+
+        self.worker.submit(self.data_base.prune_password_history, HISTORY_RETENTION,
+                           HISTORY_COMPACT_BATCH, on_success=self.history_compacted,
+                           on_error=self.history_not_compacted, busy=False)
+
+    def history_compacted(self, deleted) -> None:
+        """Continues with the next batch until no old version is left to delete."""
+
+        if deleted:
+            logger.info('deleted %d old password versions', deleted)
+        if deleted >= HISTORY_COMPACT_BATCH:
+            self.compact_history()
+
+    @staticmethod
+    def history_not_compacted(error) -> None:
+        """Logs a failed batch, the history is compacted again on the next start."""
+
+        logger.warning('compacting the password history failed: %s', type(error).__name__)
+
+    def sync_replica(self) -> None:
+        """Synchronizes the local replica with the database in the background."""
+
+        self.worker.submit(self.data_base.sync, on_success=self.replica_synced,
+                           on_error=self.replica_not_synced, busy=False)
+
+    def replica_synced(self, result) -> None:
+        """Schedules the next sync in SYNC_INTERVAL milliseconds."""
+
+        if result is not None:
+            self.window.after(SYNC_INTERVAL, self.sync_replica)
+
+    def replica_not_synced(self, error) -> None:
+        """Logs a failed sync, the saves stay queued until the next one."""
+
+        logger.warning('sync failed, working offline: %s', type(error).__name__)
+        self.window.after(SYNC_INTERVAL, self.sync_replica)
+
+    def account_typed(self, event=None) -> None:
+        """Schedules an account search once the user stops typing for SEARCH_DEBOUNCE_MS."""
+
+        if event is not None and event.keysym in ('Return', 'Tab', 'Escape'):
+            return
+        if self.search_after_id is not None:
+            self.window.after_cancel(self.search_after_id)
+        self.search_after_id = self.window.after(SEARCH_DEBOUNCE_MS, self.search_accounts)
+
+    def search_accounts(self) -> None:
+        """Looks up the accounts matching the typed name in the background.
+
+        The previous search is cancelled, so a stale result never replaces a newer one.
+        Account names are only suggested while the vault is unlocked.
+        """
+
+        self.search_after_id = None
+        if self.search_job is not None:
+            self.search_job.cancel()
+            self.search_job = None
+
+        fragment = self.main_widgets.account_entry.get().strip()
+        if len(fragment) < SEARCH_MIN_CHARS or not self.session.is_unlocked():
+            self.main_widgets.show_suggestions([])
+            return
+
+        self.search_job = self.run_in_background(self.data_base.search_accounts, fragment,
+                                                 on_success=self.main_widgets.show_suggestions,
+                                                 busy=False)
+
+    def suggestion_selected(self, _event=None) -> None:
+        """Copies the selected suggestion into the account entry."""
+
+        selection = self.main_widgets.suggestions.curselection()
+        if not selection:
+            return
+        account = self.main_widgets.suggestions.get(selection[0])
+        self.main_widgets.account_entry.delete(0, END)
+        self.main_widgets.account_entry.insert(END, account)
+        self.main_widgets.show_suggestions([])
+
+    def run_in_background(self, function, *args, on_success=None, busy=True):
+        """Runs a database call on the worker thread and handles its result in the Tk loop.
+
+        Args:
+            function (callable): The blocking call.
+            on_success (callable): Receives the result of the call.
+            busy (bool): Show the busy state while the call is running.
+
+        Returns:
+            Job: The handle to cancel the call.
+        """
+
+        return self.worker.submit(function, *args, on_success=on_success,
+                                  on_error=self.show_db_error, busy=busy)
+
+    def set_busy(self, busy) -> None:
+        """Shows or hides the busy state while database calls are running.
+
+        Args:
+            busy (bool): True while a database call is in flight.
+        """
+
+        self.window.config(cursor='watch' if busy else '')
+        if PasswordManager.main_buttons is not None:
+            PasswordManager.main_buttons.set_state('disabled' if busy else 'normal')
+
+    def cancel_request(self) -> None:
+        """Cancels the database calls the user is waiting for, their results are discarded.
+
+        Background jobs such as the replica sync and the history compaction keep running.
+        """
+
+        self.worker.cancel_busy()
+        if self.connect_job is not None and self.connect_job.cancelled:
+            self.connect_job = None
+            self.database_unavailable('connection cancelled')
+
+    @staticmethod
+    def show_db_error(error) -> None:
+        """Shows an error raised by a database call.
+
+        Args:
+            error (Exception): The raised exception.
+        """
+
+        messagebox.showerror(title='Database error', message=str(error))
+
+
+    def first_paint(self, _event=None) -> None:
+        """Logs the time from the start of the process until the window was painted."""
+
+        self.window.unbind('<Map>')
+        elapsed = time.perf_counter() - STARTED
+        METRICS.observe('gui.first_paint', elapsed)
+        logger.info('window painted %.1f ms after start', elapsed * 1000)
 
     def check_secret_table(self) -> None:
-        """Checks if the secret word table exists in the database and displays the GUI."""
+        """Connects to the database in the background while the window shows a connecting state."""
+
+        if self.retry_button is not None:
+            self.retry_button.destroy()
+            self.retry_button = None
+        self.status_label.config(text='Connecting to the database...')
+        self.connect_job = self.worker.submit(self.connect_database,
+                                              on_success=self.database_ready,
+                                              on_error=self.database_unavailable)
+
+    @timed('gui.connect_database')
+    def connect_database(self) -> bool:
+        """Connects, migrates the database and checks if a secret word was saved,
+        runs on the worker thread.
+        """
 
         self.data_base.start_db_connection()
-
-        if not self.data_base.check_if_secret_table_exists():
+        self.data_base.migrate()
+        return self.data_base.check_if_secret_word_exists()
+
+    def database_unavailable(self, error) -> None:
+        """Shows the connection error and a button to try again."""
+
+        self.connect_job = None
+        logger.error('cannot connect to the database: %s', error)
+        self.status_label.config(text='Cannot connect to the database.')
+        if self.retry_button is not None:
+            self.retry_button.destroy()
+        self.retry_button = Button(text='Try again', command=self.check_secret_table)
+        self.retry_button.grid(column=1, row=2, pady=10)
+
+    def database_ready(self, secret_word_exists) -> None:
+        """Displays the secret word form or the main widgets once the database is ready."""
+
+        self.connect_job = None
+        self.status_label.destroy()
+        logger.info('database ready %.1f ms after start', (time.perf_counter() - STARTED) * 1000)
+        self.compact_history()
+        if SYNC_ENABLED:
+            self.sync_replica()
+
+        if not secret_word_exists:
             PasswordManager.secret_word_buttons = SecretWordUi(bg_color=BG_COLOR)
             PasswordManager.secret_word_buttons.secret_word_buttons()
             PasswordManager.secret_word_buttons.grid_items()
@@ -216,20 +604,73 @@ class PasswordManager():
             self.create_main_widgets()
 
 
+    @timed('gui.show_password')
     def show_password(self) -> None:
         """Retrieves and shows the password for the selected account."""
 
-        if self.is_secret_word_match():
-            account_name = self.main_widgets.account_entry.get()
-            result = self.data_base.select_password_from_db(account_name)
-            if result:
-                message = generate_message(result)
-                messagebox.showinfo(message=message)
-            else:
-                messagebox.showerror(message='This account does not exists')
+        secret_word = self.main_widgets.secret_word_entry.get()
+        account_name = self.main_widgets.account_entry.get()
+        self.run_in_background(self.find_password, secret_word, account_name,
+                               on_success=self.password_found)
 
         self.clear_entry()
 
+    @timed('gui.find_password')
+    def find_password(self, secret_word, account_name):
+        """Selects the password of the account if the secret word matches,
+        runs on the worker thread.
+
+        Returns:
+            list: The selected rows or None if the secret word is incorrect.
+        """
+
+        if not self.is_secret_word_match(secret_word):
+            return None
+        result = self.data_base.select_password_from_db(account_name)
+        self.audit.record(LOOKUP if result else LOOKUP_MISSING, account_name)
+        return result
+
+    def password_found(self, result) -> None:
+        """Shows the result of find_password."""
+
+        if result is None:
+            messagebox.showerror(title='Error', message=('Incorrect secret word!'))
+        elif result:
+            message = generate_message(result)
+            messagebox.showinfo(message=message)
+        else:
+            messagebox.showerror(message='This account does not exists')
+
+    @timed('gui.pressed_browse_button')
+    def pressed_browse_button(self) -> None:
+        """Opens the vault browser if the secret word is correct."""
+
+        secret_word = self.main_widgets.secret_word_entry.get()
+        self.run_in_background(self.is_secret_word_match, secret_word,
+                               on_success=self.open_vault_browser)
+        self.main_widgets.secret_word_entry.delete(0, END)
+
+    def open_vault_browser(self, unlocked) -> None:
+        """Opens the vault browser once the secret word was checked."""
+
+        if unlocked:
+            VaultBrowser(load_page=self.load_vault_page)
+        else:
+            messagebox.showerror(title='Error', message=('Incorrect secret word!'))
+
+    def load_vault_page(self, after_id, before_id, on_loaded) -> None:
+        """Loads a page of the vault browser in the background.
+
+        on_loaded receives None instead of the rows if the vault got locked.
+        """
+
+        def load():
+            if not self.session.touch():
+                return None
+            return self.data_base.select_accounts_page(after_id, before_id)
+
+        self.run_in_background(load, on_success=on_loaded)
+
     def config_main_buttons(self) -> None:
         """Configures the command functions for the main buttons of the GUI."""
 
@@ -239,6 +680,7 @@ class PasswordManager():
         generate_password_button = PasswordManager.main_buttons.generate_password_button
         generate_password_button.config(command=self.pressed_password_button)
         PasswordManager.main_buttons.add_button.config(command=self.pressed_add_button)
+        PasswordManager.main_buttons.browse_button.config(command=self.pressed_browse_button)
 
 
     def clear_entry(self) -> None:
@@ -247,12 +689,18 @@ class PasswordManager():
         self.main_widgets.account_entry.delete(0, END)
         self.main_widgets.password_entry.delete(0, END)
         self.main_widgets.secret_word_entry.delete(0, END)
+        self.main_widgets.show_suggestions([])
 
     def on_closing(self) -> None:
-        """Closes the database connection and destroys the Tkinter window
-        when the user closes the application.
+        """Writes the queued audit events, closes the database connection and
+        destroys the Tkinter window when the user closes the application.
         """
 
         if messagebox.askokcancel("Quit", "Do you want to quit?"):
+            self.session.lock()
+            self.worker.stop()
+            self.audit.close()
             self.data_base.close_db_connection()
+            if METRICS_FILE:
+                METRICS.write_prometheus(METRICS_FILE)
             self.window.destroy()
@@ -0,0 +1,183 @@
+"""Password strength policy and the vault audit"""
+
+import math
+
+import os
+
+import re
+
+import string
+
+from collections import deque
+
+from concurrent.futures import ProcessPoolExecutor
+
+from itertools import islice
+
+from config import (POLICY_MIN_LENGTH, POLICY_MIN_ENTROPY, POLICY_MAX_REPEAT,
+                    POLICY_MAX_SEQUENCE, AUDIT_CHUNK_SIZE)
+
+CHARACTER_CLASSES = {
+    'digit': string.digits,
+    'lowercase': string.ascii_lowercase,
+    'uppercase': string.ascii_uppercase,
+    'symbol': string.punctuation + ' ',
+}
+OTHER_CLASS_SIZE = 100
+MIN_ACCOUNT_TOKEN = 3
+
+
+class PasswordPolicy:
+    """A set of password strength rules checked in a single pass over the password.
+
+    The character class lookup table is built once when the policy is created.
+    Extra rules are callables rule(password, account) returning a failure message
+    or None. They must be module-level functions so the policy can be sent to the
+    processes of the audit pool.
+
+    Attributes:
+    - min_length: the minimum number of characters
+    - required_classes: names of CHARACTER_CLASSES that must all be present
+    - min_entropy: the minimum estimated entropy in bits
+    - max_repeat: the longest allowed run of the same character
+    - max_sequence: the longest allowed run of consecutive characters like 'abcd' or '4321'
+    - forbid_account: reject passwords containing a part of the account name
+    - rules: extra rules
+
+    Methods:
+    - entropy(password): estimates the entropy of the password in bits
+    - evaluate(password, account): returns the estimated entropy and the broken rules
+    """
+
+    def __init__(self, min_length=POLICY_MIN_LENGTH, required_classes=tuple(CHARACTER_CLASSES),
+                 min_entropy=POLICY_MIN_ENTROPY, max_repeat=POLICY_MAX_REPEAT,
+                 max_sequence=POLICY_MAX_SEQUENCE, forbid_account=True, rules=()) -> None:
+        """Constructs a policy and its class lookup table."""
+
+        self.min_length = min_length
+        self.required_classes = tuple(required_classes)
+        self.min_entropy = min_entropy
+        self.max_repeat = max_repeat
+        self.max_sequence = max_sequence
+        self.forbid_account = forbid_account
+        self.rules = tuple(rules)
+
+        self._class_of = {char: name
+                          for name, chars in CHARACTER_CLASSES.items() for char in chars}
+
+    def _scan(self, password) -> tuple:
+        """Walks the password once and returns its classes, longest repeat and sequence."""
+
+        classes = set()
+        longest_repeat = longest_sequence = repeat = sequence = 1 if password else 0
+        step = 0
+        previous = None
+        for char in password:
+            classes.add(self._class_of.get(char, 'other'))
+            if previous is not None:
+                difference = ord(char) - ord(previous)
+                repeat = repeat + 1 if difference == 0 else 1
+                if difference in (1, -1) and difference == step:
+                    sequence += 1
+                else:
+                    sequence = 2 if difference in (1, -1) else 1
+                step = difference
+                longest_repeat = max(longest_repeat, repeat)
+                longest_sequence = max(longest_sequence, sequence)
+            previous = char
+        return classes, longest_repeat, longest_sequence
+
+    @staticmethod
+    def _entropy(password, classes) -> float:
+        """Estimates the entropy as length * log2(size of the used character pool)."""
+
+        pool = sum(len(CHARACTER_CLASSES[name]) if name in CHARACTER_CLASSES
+                   else OTHER_CLASS_SIZE for name in classes)
+        return len(password) * math.log2(pool) if pool else 0.0
+
+    def entropy(self, password) -> float:
+        """Estimates the entropy of the password in bits.
+
+        Parameters:
+        - password(str): represents the password to be estimated
+        """
+
+        return self._entropy(password, self._scan(password)[0])
+
+    def evaluate(self, password, account=None) -> tuple:
+        """Checks the password against every rule of the policy.
+
+        Parameters:
+        - password(str): represents the password to be checked
+        - account(str): represents the account the password belongs to
+
+        Returns:
+        - tuple: (estimated entropy in bits, list of broken rules)
+        """
+
+        classes, longest_repeat, longest_sequence = self._scan(password)
+        entropy = self._entropy(password, classes)
+
+        failures = []
+        if len(password) < self.min_length:
+            failures.append(f'shorter than {self.min_length} characters')
+        missing = [name for name in self.required_classes if name not in classes]
+        if missing:
+            failures.append(f"no {', '.join(missing)} characters")
+        if entropy < self.min_entropy:
+            failures.append(f'entropy below {self.min_entropy} bits')
+        if longest_repeat > self.max_repeat:
+            failures.append(f'{longest_repeat} repeated characters in a row')
+        if longest_sequence > self.max_sequence:
+            failures.append(f'{longest_sequence} consecutive characters in a row')
+        if self.forbid_account and account:
+            lowered = password.lower()
+            tokens = re.split(r'[^0-9a-z]+', account.lower())
+            if any(len(token) >= MIN_ACCOUNT_TOKEN and token in lowered for token in tokens):
+                failures.append('contains the account name')
+        for rule in self.rules:
+            failure = rule(password, account)
+            if failure:
+                failures.append(failure)
+        return entropy, failures
+
+
+def _audit_chunk(rows, policy) -> list:
+    """Evaluates a chunk of (account, password) rows, runs in a pool process."""
+
+    weak = []
+    for account, password in rows:
+        entropy, failures = policy.evaluate(password, account)
+        if failures:
+            weak.append((account, entropy, failures))
+    return weak
+
+
+def audit_passwords(rows, policy=None, processes=None, chunk_size=AUDIT_CHUNK_SIZE):
+    """Scores the passwords in parallel and yields the weak ones.
+
+    Rows are read lazily in chunks and at most two chunks per process are in
+    flight, so the rows can stream from the database without being held in memory.
+
+    Args:
+        rows (iterable of tuple): (account, password) tuples.
+        policy (PasswordPolicy): The policy to check, the default one if None.
+        processes (int): Number of pool processes, the number of cores if None.
+        chunk_size (int): Number of rows sent to a process at once.
+
+    Yields:
+        tuple: (account, estimated entropy, list of broken rules) of every weak password.
+    """
+
+    policy = policy or PasswordPolicy()
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = 2 * processes
+    rows = iter(rows)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        in_flight = deque()
+        while True:
+            while len(in_flight) < max_in_flight and (chunk := list(islice(rows, chunk_size))):
+                in_flight.append(executor.submit(_audit_chunk, chunk, policy))
+            if not in_flight:
+                break
+            yield from in_flight.popleft().result()
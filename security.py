@@ -0,0 +1,226 @@
+"""Hashing of the secret word, the encryption key and the unlock session"""
+
+import hashlib
+
+import hmac
+
+import secrets
+
+import threading
+
+import time
+
+from config import SCRYPT_N, SCRYPT_R, SCRYPT_P, SESSION_IDLE_TIMEOUT
+
+from metrics import timed
+
+SCRYPT_PREFIX = 'scrypt'
+SALT_SIZE = 16
+KEY_SIZE = 32
+LEGACY_KEY_PARAMS = (2 ** 14, 8, 1)
+
+
+def _scrypt(secret_word, salt, n, r, p) -> bytes:
+    """Derives a key from the secret word with scrypt"""
+
+    return hashlib.scrypt(secret_word.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r, dklen=KEY_SIZE)
+
+
+@timed('security.hash_secret_word')
+def hash_secret_word(secret_word, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P) -> str:
+    """Hashes the secret word with scrypt and a random salt
+
+    Args:
+        secret_word (str): The secret word to hash.
+        n, r, p (int): scrypt cost parameters.
+
+    Returns:
+        str: 'scrypt$n$r$p$salt$hash', the salt and the hash in hex.
+    """
+
+    salt = secrets.token_bytes(SALT_SIZE)
+    digest = _scrypt(secret_word, salt, n, r, p)
+    return '$'.join((SCRYPT_PREFIX, str(n), str(r), str(p), salt.hex(), digest.hex()))
+
+
+@timed('security.verify_secret_word')
+def verify_secret_word(secret_word, stored_hash) -> tuple:
+    """Compares the secret word to the stored hash in constant time
+
+    Besides scrypt hashes, plain SHA-256 hex digests saved by older versions
+    are accepted, they must be upgraded once the secret word matches.
+
+    Args:
+        secret_word (str): The secret word typed by the user.
+        stored_hash (str): The hash saved in the SecretWord table.
+
+    Returns:
+        tuple: (matches, needs_upgrade) booleans.
+    """
+
+    if stored_hash.startswith(SCRYPT_PREFIX + '$'):
+        _, n, r, p, salt, digest = stored_hash.split('$')
+        candidate = _scrypt(secret_word, bytes.fromhex(salt), int(n), int(r), int(p))
+        matches = hmac.compare_digest(candidate, bytes.fromhex(digest))
+        outdated = (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return matches, matches and outdated
+
+    candidate = hashlib.sha256(secret_word.encode()).hexdigest()
+    matches = hmac.compare_digest(candidate.encode(), stored_hash.encode())
+    return matches, matches
+
+
+def _check_rows(data_base, rows, secret_word) -> bool:
+    """Verifies the secret word against the selected hash and upgrades an outdated hash"""
+
+    if not rows:
+        return False
+
+    matches, needs_upgrade = verify_secret_word(secret_word, rows[0][0])
+    if needs_upgrade:
+        data_base.update_secret_word(hash_secret_word(secret_word))
+    return matches
+
+
+def check_secret_word(data_base, secret_word) -> bool:
+    """Verifies the secret word against the stored hash and upgrades an outdated hash
+
+    Args:
+        data_base (VaultStorage): The storage holding the hash of the secret word.
+        secret_word (str): The secret word typed by the user.
+
+    Returns:
+        bool: True if the secret word matches.
+    """
+
+    return _check_rows(data_base, data_base.select_secret_word_from_db(), secret_word)
+
+
+def new_key_salt(n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P) -> str:
+    """Returns a random key salt together with the scrypt cost parameters of the key
+
+    Returns:
+        str: 'scrypt$n$r$p$salt', the salt in hex.
+    """
+
+    return '$'.join((SCRYPT_PREFIX, str(n), str(r), str(p), secrets.token_hex(SALT_SIZE)))
+
+
+@timed('security.derive_vault_key')
+def derive_vault_key(secret_word, key_salt) -> bytes:
+    """Derives the key encrypting the passwords from the secret word
+
+    The key salt differs from the salt of the stored hash, so the hash reveals
+    nothing about the key. The key is always derived with the cost parameters
+    saved with the salt, changing SCRYPT_N, SCRYPT_R or SCRYPT_P only affects
+    new vaults. A bare hex salt was saved before the parameters were kept and
+    uses the parameters of that time.
+
+    Args:
+        secret_word (str): The verified secret word.
+        key_salt (str): The key salt saved in the SecretWord table, 'scrypt$n$r$p$salt'
+            or a bare salt in hex.
+    """
+
+    if key_salt.startswith(SCRYPT_PREFIX + '$'):
+        _, n, r, p, salt = key_salt.split('$')
+        return _scrypt(secret_word, bytes.fromhex(salt), int(n), int(r), int(p))
+    return _scrypt(secret_word, bytes.fromhex(key_salt), *LEGACY_KEY_PARAMS)
+
+
+def unlock_vault(data_base, secret_word) -> bool:
+    """Verifies the secret word and unlocks the encrypted storage with the derived key
+
+    The key is derived once per unlock, every lookup afterwards only pays for
+    AES-GCM. A vault saved before encryption gets its key salt here, and values
+    without the encryption prefix are only accepted until the vault records that
+    every password was encrypted.
+
+    Args:
+        data_base (EncryptedStorage): The storage to unlock.
+        secret_word (str): The secret word typed by the user.
+
+    Returns:
+        bool: True if the secret word matches.
+    """
+
+    rows = data_base.select_secret_word_from_db()
+    if not _check_rows(data_base, rows, secret_word):
+        return False
+
+    key_salt = rows[0][1]
+    if key_salt is None:
+        data_base.update_key_salt(new_key_salt())
+        key_salt = data_base.select_secret_word_from_db()[0][1]
+
+    data_base.unlock(derive_vault_key(secret_word, key_salt), accept_plaintext=not rows[0][2])
+    return True
+
+
+class UnlockSession:
+    """Keeps the vault unlocked after the secret word was verified once.
+
+    The session locks itself when it was not used for idle_timeout seconds.
+    It is shared between the Tk main thread and the worker thread.
+
+    Attributes:
+    -----------
+    idle_timeout: float
+        seconds of inactivity after which the session locks.
+
+    Methods:
+    -----------
+    unlock():
+        Marks the secret word as verified.
+    lock():
+        Forgets the verified state.
+    touch() -> bool:
+        Records activity, returns True if the session is still unlocked.
+    is_unlocked() -> bool:
+        Returns True if the session is unlocked and not idle for too long.
+    """
+
+    def __init__(self, idle_timeout=SESSION_IDLE_TIMEOUT) -> None:
+        """Creates a locked session."""
+
+        self.idle_timeout = idle_timeout
+        self._last_activity = None
+        self._lock = threading.Lock()
+
+    def unlock(self) -> None:
+        """Marks the secret word as verified."""
+
+        with self._lock:
+            self._last_activity = time.monotonic()
+
+    def lock(self) -> None:
+        """Forgets the verified state."""
+
+        with self._lock:
+            self._last_activity = None
+
+    def _expired(self) -> bool:
+        """Returns True if the session is locked or idle for too long."""
+
+        return (self._last_activity is None
+                or time.monotonic() - self._last_activity > self.idle_timeout)
+
+    def touch(self) -> bool:
+        """Records activity, returns True if the session is still unlocked."""
+
+        with self._lock:
+            if self._expired():
+                self._last_activity = None
+                return False
+            self._last_activity = time.monotonic()
+            return True
+
+    def is_unlocked(self) -> bool:
+        """Returns True if the session is unlocked and not idle for too long."""
+
+        with self._lock:
+            if self._expired():
+                self._last_activity = None
+                return False
+            return True
@@ -0,0 +1,685 @@
+"""SQLite database"""
+
+import sqlite3
+
+import threading
+
+from config import (SQLITE_PATH, VAULT_USER, IMPORT_BATCH_SIZE, EXPORT_ITERSIZE, SEARCH_LIMIT,
+                    BROWSER_PAGE_SIZE)
+
+from migrations import apply_sqlite_migrations, EPOCH_NOW, NEXT_CHANGE_SEQ, NEXT_VERSION
+
+from metrics import timed
+
+from storage import VaultStorage, UnknownUser, batches, unique_accounts, with_fingerprints
+
+
+class SQLitePasswordManagerDatabase(VaultStorage):
+    """A class that stores user passwords and a secret word with a hint in a local
+    SQLite database, for single-user installs and for running without a server.
+
+    The database runs in WAL mode, so the export reads on its own connection while
+    the application keeps writing. The main connection is shared between threads
+    and guarded by a lock.
+
+    SQLite has no table partitioning, so the vaults of all users share the
+    Passwords table and every index leads with the user's id.
+
+    Attributes:
+        user (str): The name of the user whose vault is opened.
+        user_id (int): The id of the user, looked up on first use.
+        path (str): Path to the database file, ':memory:' for a temporary database.
+        connect_to_db (sqlite3.Connection): The database connection.
+
+    Methods:
+        start_db_connection(): Opens the database file.
+        close_db_connection(): Closes the connection to the database.
+        migrate(): Applies the pending schema migrations.
+        insert_secret_word_and_hint(): Inserts a secret word and hint into the SecretWord table.
+        update_secret_word(): Replaces the hash of the secret word.
+        update_key_salt(): Saves the salt of the encryption key unless one was saved already.
+        mark_vault_encrypted(): Records that no password of the vault is stored in plaintext.
+        insert_account_and_password(): Inserts or updates an account, keeping the old version.
+        import_accounts(): Inserts or updates many accounts in one transaction.
+        replace_passwords(): Replaces passwords that were not changed since they were read.
+        select_accounts_by_fingerprint(): Finds the accounts sharing a password fingerprint.
+        select_reused_accounts(): Lists the accounts whose fingerprint is shared.
+        select_unfingerprinted_page(): Retrieves the accounts saved without a fingerprint.
+        insert_audit_events(): Appends a batch of events to the audit log.
+        iter_accounts(): Streams all the accounts.
+        search_accounts(): Finds accounts by prefix or substring.
+        select_accounts_page(): Retrieves one page of accounts with keyset pagination.
+        select_password_from_db(): Retrieves the password associated with a specified account.
+        select_password_history(): Retrieves every saved version of an account's password.
+        select_plaintext_history_page(): Retrieves old versions saved before encryption.
+        replace_history_passwords(): Replaces old versions not changed since they were read.
+        prune_password_history(): Deletes a batch of versions past the retention limit.
+        select_changes(): Retrieves the accounts changed after a change sequence number.
+        select_sync_state(): Retrieves the change sequence numbers of some accounts.
+        select_hint_from_db(): Retrieves the hint associated with the secret word.
+        select_secret_word_from_db(): Retrieves the secret word, the key salt and
+            whether the vault is encrypted.
+        check_if_secret_word_exists(): Returns True if a secret word was saved, otherwise False.
+        select_users(): Lists the users and the number of accounts in their vaults.
+        create_user(): Adds a user with an empty vault.
+        drop_user(): Deletes a user's vault and secret word.
+    """
+
+    def __init__(self, path=SQLITE_PATH, user=VAULT_USER) -> None:
+        """Prepares the connection settings, the database is opened lazily
+
+        Args:
+            path (str): Path to the database file.
+            user (str): The name of the user whose vault is opened.
+        """
+
+        self.path = path
+
+        self.user = user
+
+        self.user_id = None
+
+        self.connect_to_db = None
+
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        """Opens a new connection to the database file"""
+
+        connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    @timed('db.start_db_connection')
+    def start_db_connection(self) -> None:
+        """Opens the database file"""
+
+        with self._lock:
+            if self.connect_to_db is None:
+                self.connect_to_db = self._connect()
+
+    @timed('db.close_db_connection')
+    def close_db_connection(self) -> None:
+        """Closes connection to the database"""
+
+        with self._lock:
+            if self.connect_to_db is not None:
+                self.connect_to_db.close()
+                self.connect_to_db = None
+
+    def _run_in_transaction(self, work, begin='BEGIN'):
+        """Runs work(cursor) in its own transaction and returns its result
+
+        Args:
+            work (callable): Receives a cursor and performs the statements.
+            begin (str): The statement starting the transaction.
+        """
+
+        with self._lock:
+            if self.connect_to_db is None:
+                self.connect_to_db = self._connect()
+            cursor = self.connect_to_db.cursor()
+            cursor.execute(begin)
+            try:
+                result = work(cursor)
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            finally:
+                cursor.close()
+            self.connect_to_db.execute('COMMIT')
+            return result
+
+    def _execute(self, query, params=(), fetch=False):
+        """Executes a single statement in its own transaction
+
+        Args:
+            query (str): The statement to execute.
+            params (tuple): Parameters for the statement.
+            fetch (bool): Return all the selected rows.
+        """
+
+        def work(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall() if fetch else None
+
+        return self._run_in_transaction(work)
+
+    def _user_id(self) -> int:
+        """Returns the id of the user, looking it up once
+
+        Must be called before a transaction is started, never from inside one.
+
+        Raises:
+            UnknownUser: No vault was created for the user.
+        """
+
+        if self.user_id is None:
+            rows = self._execute('''SELECT id FROM Users WHERE lower(name) = lower(?)''',
+                                 (self.user,), fetch=True)
+            if not rows:
+                raise UnknownUser(f'No vault for the user {self.user!r}')
+            self.user_id = rows[0][0]
+        return self.user_id
+
+    @timed('db.migrate')
+    def migrate(self) -> list:
+        """Brings the schema up to date, called once at startup
+
+        Returns:
+            list: The versions of the applied migrations.
+        """
+
+        return self._run_in_transaction(apply_sqlite_migrations, begin='BEGIN IMMEDIATE')
+
+    @timed('db.insert_secret_word_and_hint')
+    def insert_secret_word_and_hint(self, secret_word, user_hint) -> None:
+        """Insert secret word and a hint into a table
+
+        Args:
+            secret_word(str): Secret word to save.
+            user_hint(str): Hint for the secret word.
+        """
+
+        self._execute('''INSERT INTO SecretWord (user_id, word, hint) VALUES (?, ?, ?)''',
+                      (self._user_id(), secret_word, user_hint))
+
+    @timed('db.update_secret_word')
+    def update_secret_word(self, secret_word) -> None:
+        """Replaces the hash of the secret word, the hint is kept
+
+        Args:
+            secret_word(str): New hash of the secret word.
+        """
+
+        self._execute('''UPDATE SecretWord SET word = ? WHERE user_id = ?''',
+                      (secret_word, self._user_id()))
+
+    @timed('db.update_key_salt')
+    def update_key_salt(self, key_salt) -> None:
+        """Saves the salt of the encryption key, a salt saved before is kept
+
+        Args:
+            key_salt(str): The salt and the scrypt cost parameters, 'scrypt$n$r$p$salt'.
+        """
+
+        self._execute('''UPDATE SecretWord SET key_salt = ?
+                         WHERE user_id = ? AND key_salt IS NULL''',
+                      (key_salt, self._user_id()))
+
+    @timed('db.mark_vault_encrypted')
+    def mark_vault_encrypted(self) -> None:
+        """Records that no password of the vault is stored in plaintext
+
+        From then on values without the encryption prefix are rejected instead of
+        being read as passwords saved before encryption.
+        """
+
+        self._execute('''UPDATE SecretWord SET encrypted = 1
+                         WHERE user_id = ?''',
+                      (self._user_id(),))
+
+    @timed('db.insert_account_and_password')
+    def insert_account_and_password(self, account, password, fingerprint=None) -> None:
+        """Insert account and a password into a table,
+        the password of an already saved account is replaced and its old
+        version is kept in PasswordHistory by a trigger
+
+        Args:
+            account (str): The account to save.
+            password(str): Password for the account.
+            fingerprint(str): Keyed fingerprint of the password for reuse detection.
+        """
+
+        self._execute(f'''INSERT INTO Passwords
+                          (user_id, account, password, fingerprint, change_seq, updated_at)
+                          VALUES (?, ?, ?, ?, {NEXT_CHANGE_SEQ}, {EPOCH_NOW})
+                          ON CONFLICT (user_id, lower(account))
+                          DO UPDATE SET account = excluded.account,
+                                        password = excluded.password,
+                                        fingerprint = excluded.fingerprint,
+                                        version = {NEXT_VERSION},
+                                        change_seq = excluded.change_seq,
+                                        updated_at = excluded.updated_at''',
+                      (self._user_id(), account, password, fingerprint))
+
+    @timed('db.import_accounts')
+    def import_accounts(self, rows, batch_size=IMPORT_BATCH_SIZE) -> int:
+        """Inserts or updates many accounts in one transaction
+
+        Args:
+            rows (iterable of tuple): (account, password[, fingerprint]) tuples, consumed lazily.
+            batch_size (int): Number of rows inserted with one executemany call.
+
+        Returns:
+            int: The number of rows saved, an account repeated within a batch counts once.
+        """
+
+        user_id = self._user_id()
+
+        def work(cursor):
+            count = 0
+            for batch in batches(with_fingerprints(rows), batch_size):
+                batch = unique_accounts(batch)
+                cursor.executemany(f'''INSERT INTO Passwords
+                                       (user_id, account, password, fingerprint,
+                                       change_seq, updated_at)
+                                       VALUES (?, ?, ?, ?, {NEXT_CHANGE_SEQ}, {EPOCH_NOW})
+                                       ON CONFLICT (user_id, lower(account))
+                                       DO UPDATE SET account = excluded.account,
+                                                     password = excluded.password,
+                                                     fingerprint = excluded.fingerprint,
+                                                     version = {NEXT_VERSION},
+                                                     change_seq = excluded.change_seq,
+                                                     updated_at = excluded.updated_at''',
+                                   [(user_id, *row) for row in batch])
+                count += len(batch)
+            return count
+
+        return self._run_in_transaction(work)
+
+    @timed('db.replace_passwords')
+    def replace_passwords(self, rows) -> int:
+        """Replaces the stored passwords that were not changed since they were read
+
+        Args:
+            rows (list of tuple): (id, old password, new password, fingerprint) tuples.
+
+        Returns:
+            int: The number of replaced passwords.
+        """
+
+        user_id = self._user_id()
+
+        def work(cursor):
+            cursor.executemany(f'''UPDATE Passwords
+                                   SET password = ?, fingerprint = ?,
+                                       change_seq = {NEXT_CHANGE_SEQ}, updated_at = {EPOCH_NOW}
+                                   WHERE user_id = ? AND id = ? AND password = ?''',
+                               [(new, fingerprint, user_id, row_id, old)
+                                for row_id, old, new, fingerprint in rows])
+            return cursor.rowcount
+
+        return self._run_in_transaction(work)
+
+    @timed('db.select_accounts_by_fingerprint')
+    def select_accounts_by_fingerprint(self, fingerprint) -> list:
+        """Selects the accounts whose password has the fingerprint, served by its index
+
+        Args:
+            fingerprint (str): Keyed fingerprint of a password.
+
+        Returns:
+            list: The account names.
+        """
+
+        rows = self._execute('''SELECT account FROM Passwords
+                                WHERE user_id = ? AND fingerprint = ? ORDER BY account''',
+                             (self._user_id(), fingerprint), fetch=True)
+        return [row[0] for row in rows]
+
+    @timed('db.select_reused_accounts')
+    def select_reused_accounts(self) -> list:
+        """Selects the accounts sharing their password with another account
+
+        Returns:
+            list: (fingerprint, account) tuples ordered by fingerprint.
+        """
+
+        return self._execute('''SELECT fingerprint, account FROM Passwords
+                                WHERE user_id = :user_id
+                                AND fingerprint IN (SELECT fingerprint FROM Passwords
+                                                    WHERE user_id = :user_id
+                                                    AND fingerprint IS NOT NULL
+                                                    GROUP BY fingerprint
+                                                    HAVING count(*) > 1)
+                                ORDER BY fingerprint, account''',
+                             {'user_id': self._user_id()}, fetch=True)
+
+    @timed('db.insert_audit_events')
+    def insert_audit_events(self, events) -> None:
+        """Appends a batch of events to the AuditLog table with one multi-row insert
+
+        Args:
+            events (list of tuple): (event_type, account, client, created_at) tuples,
+                created_at as an ISO 8601 string.
+        """
+
+        def work(cursor):
+            cursor.executemany('''INSERT INTO AuditLog (event_type, account, client, created_at)
+                                  VALUES (?, ?, ?, ?)''', events)
+
+        self._run_in_transaction(work)
+
+    @timed('db.select_unfingerprinted_page')
+    def select_unfingerprinted_page(self, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Selects the next accounts saved without a fingerprint, served by a partial index
+
+        Args:
+            after_id (int): Select the accounts following this id.
+            limit (int): The maximum number of accounts.
+
+        Returns:
+            list: A list of tuples containing the 'id', 'account' and 'password' values.
+        """
+
+        return self._execute('''SELECT id, account, password FROM Passwords
+                                WHERE user_id = ? AND fingerprint IS NULL AND id > ?
+                                ORDER BY id LIMIT ?''', (self._user_id(), after_id, limit),
+                             fetch=True)
+
+    @timed('db.iter_accounts')
+    def iter_accounts(self, itersize=EXPORT_ITERSIZE):
+        """Yields every (account, password) tuple of the Passwords table
+
+        Rows are read on a separate connection in chunks of itersize rows, so the
+        export neither holds the whole table in memory nor blocks other calls.
+
+        Args:
+            itersize (int): Number of rows fetched at a time.
+        """
+
+        user_id = self._user_id()
+        if self.path == ':memory:':
+            connection = self.connect_to_db
+            lock = self._lock
+        else:
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            lock = threading.RLock()
+
+        try:
+            with lock:
+                cursor = connection.execute('''SELECT account, password FROM Passwords
+                                               WHERE user_id = ? ORDER BY id''', (user_id,))
+                while rows := cursor.fetchmany(itersize):
+                    yield from rows
+        finally:
+            if connection is not self.connect_to_db:
+                connection.close()
+
+    @timed('db.search_accounts')
+    def search_accounts(self, fragment, limit=SEARCH_LIMIT) -> list:
+        """Finds accounts by prefix or substring, prefix matches come first
+
+        Args:
+            fragment (str): Part of the account name typed by the user.
+            limit (int): The maximum number of accounts to return.
+
+        Returns:
+            list: The matching account names.
+        """
+
+        fragment = fragment.lower()
+        escaped = fragment.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        rows = self._execute('''SELECT account FROM Passwords
+                                WHERE user_id = ? AND lower(account) LIKE ? ESCAPE '\\'
+                                ORDER BY lower(account) LIKE ? ESCAPE '\\' DESC, account
+                                LIMIT ?''',
+                             (self._user_id(), '%' + escaped + '%', escaped + '%', limit),
+                             fetch=True)
+        return [row[0] for row in rows]
+
+    @timed('db.select_accounts_page')
+    def select_accounts_page(self, after_id=0, before_id=None,
+                             limit=BROWSER_PAGE_SIZE) -> list:
+        """Selects one page of accounts ordered by id with keyset pagination
+
+        Args:
+            after_id (int): Select the accounts following this id.
+            before_id (int): If given, select the accounts preceding this id instead.
+            limit (int): The maximum number of accounts on the page.
+
+        Returns:
+            list: A list of tuples containing the 'id', 'account' and 'password' values.
+        """
+
+        if before_id is not None:
+            rows = self._execute('''SELECT id, account, password FROM Passwords
+                                    WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?''',
+                                 (self._user_id(), before_id, limit), fetch=True)
+            return rows[::-1]
+
+        return self._execute('''SELECT id, account, password FROM Passwords
+                                WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?''',
+                             (self._user_id(), after_id, limit), fetch=True)
+
+    @timed('db.select_password_from_db')
+    def select_password_from_db(self, account) -> list:
+        """Selects a password for the particular account
+
+        Args:
+            account (str): The account for which to retrieve password information.
+
+        Returns:
+            list: A list of tuples containing the 'account' and 'password' values.
+        """
+
+        return self._execute('''SELECT account, password FROM Passwords
+                                WHERE user_id = ? AND lower(account) = lower(?)''',
+                             (self._user_id(), account), fetch=True)
+
+    @timed('db.select_password_history')
+    def select_password_history(self, account) -> list:
+        """Selects the current and the old versions of the account's password
+
+        Args:
+            account (str): The account for which to retrieve the versions.
+
+        Returns:
+            list: (version, password, replaced_at) tuples, newest first, replaced_at
+                as text and None for the current version.
+        """
+
+        return self._execute('''SELECT version, password, NULL FROM Passwords
+                                WHERE user_id = :user_id AND lower(account) = lower(:account)
+                                UNION ALL
+                                SELECT history.version, history.password, history.replaced_at
+                                FROM PasswordHistory AS history
+                                JOIN Passwords AS current ON current.id = history.password_id
+                                WHERE current.user_id = :user_id
+                                AND lower(current.account) = lower(:account)
+                                ORDER BY 1 DESC''',
+                             {'user_id': self._user_id(), 'account': account}, fetch=True)
+
+    @timed('db.select_plaintext_history_page')
+    def select_plaintext_history_page(self, prefix, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Selects the next old versions whose password does not start with prefix
+
+        Those are the versions of passwords saved before encryption.
+
+        Args:
+            prefix (str): The prefix of encrypted passwords.
+            after_id (int): Select the versions following this id.
+            limit (int): The maximum number of versions.
+
+        Returns:
+            list: (id, account, password) tuples, the account of the current version.
+        """
+
+        return self._execute('''SELECT history.id, current.account, history.password
+                                FROM PasswordHistory AS history
+                                JOIN Passwords AS current
+                                ON current.user_id = history.user_id
+                                AND current.id = history.password_id
+                                WHERE history.user_id = ? AND history.id > ?
+                                AND substr(history.password, 1, length(?)) <> ?
+                                ORDER BY history.id LIMIT ?''',
+                             (self._user_id(), after_id, prefix, prefix, limit), fetch=True)
+
+    @timed('db.replace_history_passwords')
+    def replace_history_passwords(self, rows) -> int:
+        """Replaces the old versions that were not changed since they were read
+
+        Args:
+            rows (list of tuple): (id, old password, new password) tuples.
+
+        Returns:
+            int: The number of replaced versions.
+        """
+
+        user_id = self._user_id()
+
+        def work(cursor):
+            cursor.executemany('''UPDATE PasswordHistory SET password = ?
+                                  WHERE user_id = ? AND id = ? AND password = ?''',
+                               [(new, user_id, history_id, old)
+                                for history_id, old, new in rows])
+            return cursor.rowcount
+
+        return self._run_in_transaction(work)
+
+    @timed('db.prune_password_history')
+    def prune_password_history(self, keep, limit) -> int:
+        """Deletes one batch of the versions past the retention limit
+
+        Args:
+            keep (int): Number of old versions kept per account.
+            limit (int): The maximum number of versions deleted.
+
+        Returns:
+            int: The number of deleted versions.
+        """
+
+        user_id = self._user_id()
+
+        def work(cursor):
+            cursor.execute('''DELETE FROM PasswordHistory
+                              WHERE id IN (SELECT history.id
+                                           FROM PasswordHistory AS history
+                                           JOIN Passwords AS current
+                                           ON current.id = history.password_id
+                                           WHERE history.user_id = ?
+                                           AND history.version < current.version - ?
+                                           LIMIT ?)''', (user_id, keep, limit))
+            return cursor.rowcount
+
+        return self._run_in_transaction(work)
+
+    @timed('db.select_changes')
+    def select_changes(self, after_seq, limit) -> list:
+        """Selects the accounts changed after the watermark of a sync client
+
+        Every save numbers the row with the next change sequence number, and SQLite
+        runs one write transaction at a time, so the numbers are committed in order.
+
+        Args:
+            after_seq (int): The highest change sequence number the client has.
+            limit (int): The maximum number of accounts.
+
+        Returns:
+            list: (change_seq, account, password, fingerprint, updated_at) tuples,
+                updated_at in seconds since the epoch.
+        """
+
+        return self._execute('''SELECT change_seq, account, password, fingerprint, updated_at
+                                FROM Passwords
+                                WHERE change_seq > ? AND user_id = ?
+                                ORDER BY change_seq LIMIT ?''',
+                             (after_seq, self._user_id(), limit), fetch=True)
+
+    @timed('db.select_sync_state')
+    def select_sync_state(self, accounts) -> list:
+        """Selects the change sequence numbers of the accounts a sync client changed
+
+        Args:
+            accounts (list): The account names.
+
+        Returns:
+            list: (account, change_seq, updated_at) tuples of the saved accounts.
+        """
+
+        if not accounts:
+            return []
+        placeholders = ', '.join(['lower(?)'] * len(accounts))
+        return self._execute(f'''SELECT account, change_seq, updated_at FROM Passwords
+                                 WHERE user_id = ? AND lower(account) IN ({placeholders})''',
+                             (self._user_id(), *accounts), fetch=True)
+
+    @timed('db.select_hint_from_db')
+    def select_hint_from_db(self) -> list:
+        """Selects a hint from the SecretWord table
+
+        Returns:
+            list: A list of tuples containing the 'hint' values.
+        """
+
+        return self._execute('''SELECT hint FROM SecretWord WHERE user_id = ?''',
+                             (self._user_id(),), fetch=True)
+
+    @timed('db.select_secret_word_from_db')
+    def select_secret_word_from_db(self) -> list:
+        """Selects a secret word and the salt of the encryption key from the SecretWord table
+
+        Returns:
+            list: A list of tuples containing the 'word', 'key_salt' and 'encrypted' values.
+        """
+
+        return self._execute('''SELECT word, key_salt, encrypted FROM SecretWord
+                                WHERE user_id = ?''',
+                             (self._user_id(),), fetch=True)
+
+    @timed('db.check_if_secret_word_exists')
+    def check_if_secret_word_exists(self) -> bool:
+        """Returns True if a secret word was saved otherwise False"""
+
+        rows = self._execute('''SELECT EXISTS (SELECT 1 FROM SecretWord WHERE user_id = ?)''',
+                             (self._user_id(),), fetch=True)
+        return bool(rows[0][0])
+
+    @timed('db.select_users')
+    def select_users(self) -> list:
+        """Selects every user with the number of accounts in the vault
+
+        Returns:
+            list: (name, number of accounts) tuples ordered by name.
+        """
+
+        return self._execute('''SELECT users.name, count(passwords.id)
+                                FROM Users AS users
+                                LEFT JOIN Passwords AS passwords ON passwords.user_id = users.id
+                                GROUP BY users.id, users.name
+                                ORDER BY lower(users.name)''', fetch=True)
+
+    @timed('db.create_user')
+    def create_user(self, name) -> int:
+        """Adds a user, the vault is empty until the user saves a secret word
+
+        Args:
+            name (str): The name of the new user.
+
+        Returns:
+            int: The id of the user.
+        """
+
+        def work(cursor):
+            cursor.execute('''INSERT INTO Users (name) VALUES (?)''', (name,))
+            return cursor.lastrowid
+
+        return self._run_in_transaction(work)
+
+    @timed('db.drop_user')
+    def drop_user(self, name) -> bool:
+        """Deletes the user with the accounts, the history and the secret word
+
+        Args:
+            name (str): The name of the user to drop.
+
+        Returns:
+            bool: False if there is no such user.
+        """
+
+        def work(cursor):
+            cursor.execute('''SELECT id FROM Users WHERE lower(name) = lower(?)''', (name,))
+            row = cursor.fetchone()
+            if row is None:
+                return False
+            for table in ('Passwords', 'PasswordHistory', 'SecretWord'):
+                cursor.execute(f'DELETE FROM {table} WHERE user_id = ?', row)
+            cursor.execute('''DELETE FROM Users WHERE id = ?''', row)
+            return True
+
+        dropped = self._run_in_transaction(work, begin='BEGIN IMMEDIATE')
+        if dropped and name.lower() == self.user.lower():
+            self.user_id = None
+        return dropped
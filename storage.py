@@ -0,0 +1,238 @@
+"""Storage backend interface of the password manager"""
+
+from abc import ABC, abstractmethod
+
+from itertools import islice
+
+from config import (DB_BACKEND, VAULT_USER, HISTORY_RETENTION, HISTORY_COMPACT_BATCH,
+                    SYNC_ENABLED)
+
+
+class UnknownUser(Exception):
+    """No vault was created for the user, see the 'user add' command."""
+
+
+def batches(rows, size):
+    """Yields lists of at most size items from the rows iterable"""
+
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def with_fingerprints(rows):
+    """Yields (account, password, fingerprint) tuples, None for rows without a fingerprint"""
+
+    for row in rows:
+        yield row if len(row) == 3 else (row[0], row[1], None)
+
+
+def unique_accounts(batch) -> list:
+    """Returns the rows of the batch with one row per account name in any case, the last"""
+
+    return list({row[0].lower(): row for row in batch}.values())
+
+
+def compact_history(data_base, keep=HISTORY_RETENTION, batch_size=HISTORY_COMPACT_BATCH) -> int:
+    """Prunes the old password versions batch by batch, returns the number deleted
+
+    Every batch is its own short transaction, so saves are never blocked for long.
+    """
+
+    total = 0
+    while (deleted := data_base.prune_password_history(keep, batch_size)) > 0:
+        total += deleted
+        if deleted < batch_size:
+            break
+    return total
+
+
+class VaultStorage(ABC):
+    """The interface every storage backend implements.
+
+    Methods:
+        start_db_connection(): Opens the connection to the storage.
+        close_db_connection(): Closes the connection to the storage.
+        migrate(): Applies the pending schema migrations.
+        insert_secret_word_and_hint(): Inserts a secret word and hint.
+        update_secret_word(): Replaces the hash of the secret word.
+        update_key_salt(): Saves the salt of the encryption key unless one was saved already.
+        mark_vault_encrypted(): Records that no password of the vault is stored in plaintext.
+        insert_account_and_password(): Inserts or updates an account, keeping the old version.
+        import_accounts(): Inserts or updates many accounts in one transaction.
+        replace_passwords(): Replaces stored passwords that were not changed since they were read.
+        select_accounts_by_fingerprint(): Finds the accounts sharing a password fingerprint.
+        select_reused_accounts(): Lists the accounts whose fingerprint is shared.
+        select_unfingerprinted_page(): Retrieves the accounts saved without a fingerprint.
+        insert_audit_events(): Appends a batch of events to the audit log.
+        iter_accounts(): Streams all the accounts.
+        search_accounts(): Finds accounts by part of their name.
+        select_accounts_page(): Retrieves one page of accounts with keyset pagination.
+        select_password_from_db(): Retrieves the password associated with a specified account.
+        select_password_history(): Retrieves every saved version of an account's password.
+        select_plaintext_history_page(): Retrieves old versions saved before encryption.
+        replace_history_passwords(): Replaces old versions not changed since they were read.
+        prune_password_history(): Deletes a batch of versions past the retention limit.
+        select_changes(): Retrieves the accounts changed after a change sequence number.
+        select_sync_state(): Retrieves the change sequence numbers of some accounts.
+        sync(): Synchronizes a local replica, if the backend keeps one.
+        select_hint_from_db(): Retrieves the hint associated with the secret word.
+        select_secret_word_from_db(): Retrieves the hash of the secret word, the key salt and
+            whether the vault is encrypted.
+        check_if_secret_word_exists(): Returns True if a secret word was saved, otherwise False.
+    """
+
+    @abstractmethod
+    def start_db_connection(self) -> None:
+        """Opens the connection to the storage"""
+
+    @abstractmethod
+    def close_db_connection(self) -> None:
+        """Closes the connection to the storage"""
+
+    @abstractmethod
+    def migrate(self) -> list:
+        """Brings the schema up to date and returns the applied versions"""
+
+    @abstractmethod
+    def insert_secret_word_and_hint(self, secret_word, user_hint) -> None:
+        """Inserts the hash of the secret word and its hint"""
+
+    @abstractmethod
+    def update_secret_word(self, secret_word) -> None:
+        """Replaces the hash of the secret word"""
+
+    @abstractmethod
+    def update_key_salt(self, key_salt) -> None:
+        """Saves the salt of the encryption key if none was saved yet"""
+
+    @abstractmethod
+    def mark_vault_encrypted(self) -> None:
+        """Records that every password is encrypted, plaintext values are rejected from then on"""
+
+    @abstractmethod
+    def insert_account_and_password(self, account, password, fingerprint=None) -> None:
+        """Inserts an account or replaces its password and fingerprint"""
+
+    @abstractmethod
+    def import_accounts(self, rows, batch_size) -> int:
+        """Inserts or updates (account, password[, fingerprint]) rows in one transaction,
+        returns the number of rows saved: an account repeated within a batch counts once"""
+
+    @abstractmethod
+    def replace_passwords(self, rows) -> int:
+        """Updates (id, old, new, fingerprint) rows still holding old, returns the count"""
+
+    @abstractmethod
+    def select_accounts_by_fingerprint(self, fingerprint) -> list:
+        """Returns the names of the accounts with the fingerprint"""
+
+    @abstractmethod
+    def select_reused_accounts(self) -> list:
+        """Returns (fingerprint, account) tuples of shared fingerprints, ordered by fingerprint"""
+
+    @abstractmethod
+    def insert_audit_events(self, events) -> None:
+        """Appends (event_type, account, client, created_at) rows to the audit log"""
+
+    @abstractmethod
+    def select_unfingerprinted_page(self, after_id=0, limit=None) -> list:
+        """Returns (id, account, password) tuples without a fingerprint ordered by id"""
+
+    @abstractmethod
+    def iter_accounts(self, itersize):
+        """Yields every (account, password) tuple with bounded memory"""
+
+    @abstractmethod
+    def search_accounts(self, fragment, limit) -> list:
+        """Returns the names of the accounts matching the fragment"""
+
+    @abstractmethod
+    def select_accounts_page(self, after_id=0, before_id=None, limit=None) -> list:
+        """Returns one page of (id, account, password) tuples ordered by id"""
+
+    @abstractmethod
+    def select_password_from_db(self, account) -> list:
+        """Returns the (account, password) tuples of the account"""
+
+    @abstractmethod
+    def select_password_history(self, account) -> list:
+        """Returns (version, password, replaced_at) tuples, the current version first"""
+
+    @abstractmethod
+    def select_plaintext_history_page(self, prefix, after_id=0, limit=None) -> list:
+        """Returns (id, account, password) tuples of old versions whose password does
+        not start with prefix, ordered by id"""
+
+    @abstractmethod
+    def replace_history_passwords(self, rows) -> int:
+        """Updates the (id, old, new) old versions still holding old, returns the count"""
+
+    @abstractmethod
+    def prune_password_history(self, keep, limit) -> int:
+        """Deletes at most limit versions older than the keep newest old ones per account"""
+
+    @abstractmethod
+    def select_changes(self, after_seq, limit) -> list:
+        """Returns (change_seq, account, password, fingerprint, updated_at) tuples
+        of the accounts changed after after_seq, ordered by change_seq"""
+
+    @abstractmethod
+    def select_sync_state(self, accounts) -> list:
+        """Returns (account, change_seq, updated_at) tuples of the saved accounts"""
+
+    def sync(self):
+        """Synchronizes the local replica, backends without one have nothing to do"""
+
+        return None
+
+    @abstractmethod
+    def select_hint_from_db(self) -> list:
+        """Returns the (hint,) tuples"""
+
+    @abstractmethod
+    def select_secret_word_from_db(self) -> list:
+        """Returns the (word, key_salt, encrypted) tuples"""
+
+    @abstractmethod
+    def check_if_secret_word_exists(self) -> bool:
+        """Returns True if a secret word was saved"""
+
+
+def create_storage(backend=DB_BACKEND, encrypted=True, user=VAULT_USER,
+                   synced=SYNC_ENABLED) -> VaultStorage:
+    """Creates the storage backend selected in config.py
+
+    Only the module of the selected backend is imported, so the SQLite backend
+    and the daemon client work without psycopg2 installed.
+
+    Args:
+        backend (str): 'postgresql', 'sqlite' or 'daemon'.
+        encrypted (bool): Wrap the backend in an EncryptedStorage, which starts locked.
+            The daemon serves the ciphertext its clients encrypted, so it passes False.
+        user (str): The user whose vault is opened. The daemon serves the vault of the
+            user it was started for, so the daemon backend ignores it.
+        synced (bool): Serve reads from a local replica of the vault, kept up to date
+            by sync(), so the vault keeps working while the backend is unreachable.
+    """
+
+    if backend == 'postgresql':
+        from db import PasswordManagerDatabase
+        storage = PasswordManagerDatabase(user=user)
+    elif backend == 'sqlite':
+        from sqlite_db import SQLitePasswordManagerDatabase
+        storage = SQLitePasswordManagerDatabase(user=user)
+    elif backend == 'daemon':
+        from daemon_client import DaemonStorage
+        storage = DaemonStorage()
+    else:
+        raise ValueError(f'Unknown storage backend: {backend}')
+
+    if synced:
+        from sync import LocalReplica, SyncedStorage, replica_path
+        storage = SyncedStorage(storage, LocalReplica(replica_path(backend, user)))
+
+    if encrypted:
+        from encryption import EncryptedStorage
+        storage = EncryptedStorage(storage)
+    return storage
@@ -0,0 +1,561 @@
+"""Offline-first storage: a local replica of the vault synchronized with the database
+
+Reads are answered from a SQLite replica on the local disk, so they take
+microseconds and keep working while the database is unreachable. Saves go to
+the replica and to an outbox; sync() pushes the outbox and then pulls the
+accounts changed since the watermark, the highest change sequence number seen.
+Both directions only move the changed accounts, however big the vault is.
+
+The replica holds what the database holds: ciphertext, fingerprints and the
+hash of the secret word, never a plaintext password.
+
+Conflicts are resolved by resolve_conflict() with the change sequence numbers
+the database assigns, never with the clocks of the clients: a local save wins
+if the account was not changed in the database since it was last pulled, and
+otherwise the database wins. A password a local save overwrites in the database
+is kept there as an old version in the password history, a local save that
+loses is dropped.
+"""
+
+import logging
+
+import os
+
+import sqlite3
+
+import threading
+
+import time
+
+from pathlib import Path
+
+from config import (SYNC_REPLICA_DIR, SYNC_BATCH_SIZE, EXPORT_ITERSIZE, SEARCH_LIMIT,
+                    BROWSER_PAGE_SIZE, IMPORT_BATCH_SIZE)
+
+from migrations import apply_replica_migrations
+
+from metrics import timed
+
+from storage import VaultStorage, batches, unique_accounts, with_fingerprints
+
+logger = logging.getLogger('password_manager.sync')
+
+
+def replica_path(backend, user, directory=SYNC_REPLICA_DIR) -> str:
+    """Returns the path of the replica of the user's vault on the backend"""
+
+    return str(Path(directory) / f'{backend}-{user}.sqlite3')
+
+
+def resolve_conflict(base_seq, remote_seq) -> bool:
+    """Decides if a local save overwrites the account in the database
+
+    Only the change sequence numbers assigned by the database are compared, so
+    the decision does not depend on the clocks of the clients. When the account
+    was changed on both sides the database wins, so every client resolves the
+    same conflict the same way.
+
+    Args:
+        base_seq (int): The change sequence number of the account when it was saved
+            locally, None if the account was not pulled yet.
+        remote_seq (int): The change sequence number in the database, None if the
+            account is not saved there.
+
+    Returns:
+        bool: True if the local save wins.
+    """
+
+    return remote_seq is None or (base_seq is not None and remote_seq <= base_seq)
+
+
+class LocalReplica:
+    """The SQLite file holding the local copy of one user's vault.
+
+    Attributes:
+    - path: the replica file
+    - connect_to_db: the sqlite3 connection, shared between threads under a lock
+
+    Methods:
+    - open(): opens the file and brings its schema up to date
+    - close(): closes the file
+    - query(query, params): returns the rows of a read-only query
+    - queue_writes(rows): saves accounts locally and queues them for the push
+    - pending(limit): returns the queued saves
+    - remove_pending(entries): forgets the pushed saves
+    - apply_changes(rows): saves the pulled accounts and moves the watermark
+    - watermark(): returns the highest change sequence number pulled
+    - save_secret(word, key_salt, encrypted, hint): caches the secret word hash and hint
+    - secret(): returns the cached secret word hash, key salt, encrypted flag and hint
+    """
+
+    def __init__(self, path) -> None:
+        """Prepares the replica, the file is opened lazily."""
+
+        self.path = path
+        self.connect_to_db = None
+        self._lock = threading.RLock()
+
+    def open(self) -> None:
+        """Opens the file, creating its directory readable by the current user only."""
+
+        with self._lock:
+            if self.connect_to_db is not None:
+                return
+            if self.path != ':memory:':
+                Path(self.path).parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            self.connect_to_db = sqlite3.connect(self.path, isolation_level=None,
+                                                 check_same_thread=False)
+            self.connect_to_db.execute('PRAGMA journal_mode=WAL')
+            self.connect_to_db.execute('PRAGMA synchronous=NORMAL')
+            if self.path != ':memory:':
+                os.chmod(self.path, 0o600)
+            self._run_in_transaction(apply_replica_migrations, begin='BEGIN IMMEDIATE')
+
+    def close(self) -> None:
+        """Closes the file."""
+
+        with self._lock:
+            if self.connect_to_db is not None:
+                self.connect_to_db.close()
+                self.connect_to_db = None
+
+    def _run_in_transaction(self, work, begin='BEGIN'):
+        """Runs work(cursor) in its own transaction and returns its result."""
+
+        with self._lock:
+            if self.connect_to_db is None:
+                self.open()
+            cursor = self.connect_to_db.cursor()
+            cursor.execute(begin)
+            try:
+                result = work(cursor)
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            finally:
+                cursor.close()
+            self.connect_to_db.execute('COMMIT')
+            return result
+
+    def _execute(self, query, params=(), fetch=False):
+        """Executes a single statement in its own transaction."""
+
+        def work(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall() if fetch else None
+
+        return self._run_in_transaction(work)
+
+    def query(self, query, params=()) -> list:
+        """Returns the rows of a read-only query of the replica"""
+
+        return self._execute(query, params, fetch=True)
+
+    def queue_writes(self, rows, queued_at=None) -> int:
+        """Saves the (account, password, fingerprint) rows locally and queues them
+
+        A second save of an account before the push replaces the queued one but
+        keeps its base change sequence number, so the push still detects a
+        change made in the database in the meantime.
+
+        Returns:
+            int: The number of rows saved.
+        """
+
+        queued_at = time.time() if queued_at is None else queued_at
+
+        def work(cursor):
+            count = 0
+            for account, password, fingerprint in rows:
+                cursor.execute('''INSERT INTO Outbox
+                                  (account, password, fingerprint, base_seq, queued_at)
+                                  VALUES (?, ?, ?, (SELECT change_seq FROM Accounts
+                                                    WHERE lower(account) = lower(?)), ?)
+                                  ON CONFLICT (lower(account))
+                                  DO UPDATE SET account = excluded.account,
+                                                password = excluded.password,
+                                                fingerprint = excluded.fingerprint,
+                                                queued_at = excluded.queued_at''',
+                               (account, password, fingerprint, account, queued_at))
+                cursor.execute('''INSERT INTO Accounts (account, password, fingerprint)
+                                  VALUES (?, ?, ?)
+                                  ON CONFLICT (lower(account))
+                                  DO UPDATE SET account = excluded.account,
+                                                password = excluded.password,
+                                                fingerprint = excluded.fingerprint''',
+                               (account, password, fingerprint))
+                count += 1
+            return count
+
+        return self._run_in_transaction(work)
+
+    def pending(self, limit=SYNC_BATCH_SIZE) -> list:
+        """Returns the oldest (id, account, password, fingerprint, base_seq, queued_at)
+        tuples waiting for the push"""
+
+        return self._execute('''SELECT id, account, password, fingerprint, base_seq, queued_at
+                                FROM Outbox ORDER BY id LIMIT ?''', (limit,), fetch=True)
+
+    def remove_pending(self, entries) -> None:
+        """Forgets the pushed entries unless they were saved again during the push"""
+
+        def work(cursor):
+            cursor.executemany('''DELETE FROM Outbox WHERE id = ? AND queued_at = ?''',
+                               [(entry[0], entry[5]) for entry in entries])
+
+        self._run_in_transaction(work)
+
+    def apply_changes(self, rows) -> None:
+        """Saves the pulled (change_seq, account, password, fingerprint, updated_at) rows
+
+        Accounts saved locally and not pushed yet keep the local password, and
+        the watermark moves to the highest change sequence number of the rows.
+        """
+
+        def work(cursor):
+            cursor.executemany('''INSERT INTO Accounts
+                                  (change_seq, account, password, fingerprint, updated_at)
+                                  VALUES (?, ?, ?, ?, ?)
+                                  ON CONFLICT (lower(account))
+                                  DO UPDATE SET account = excluded.account,
+                                                password = excluded.password,
+                                                fingerprint = excluded.fingerprint,
+                                                change_seq = excluded.change_seq,
+                                                updated_at = excluded.updated_at
+                                  WHERE NOT EXISTS (SELECT 1 FROM Outbox
+                                                    WHERE lower(Outbox.account)
+                                                          = lower(excluded.account))''',
+                               rows)
+            cursor.execute('''UPDATE SyncState SET watermark = max(watermark, ?)''',
+                           (max(row[0] for row in rows),))
+
+        if rows:
+            self._run_in_transaction(work)
+
+    def watermark(self) -> int:
+        """Returns the highest change sequence number pulled so far"""
+
+        return self._execute('''SELECT watermark FROM SyncState''', fetch=True)[0][0]
+
+    def save_secret(self, word, key_salt, encrypted, hint) -> None:
+        """Caches the hash of the secret word, the key salt, the encrypted flag and the hint"""
+
+        self._execute('''UPDATE SyncState
+                         SET word = ?, key_salt = ?, encrypted = ?, hint = ?, synced_at = ?''',
+                      (word, key_salt, bool(encrypted), hint, time.time()))
+
+    def secret(self) -> tuple:
+        """Returns the cached (word, key_salt, encrypted, hint), word is None if nothing
+        is cached"""
+
+        return self._execute('''SELECT word, key_salt, encrypted, hint FROM SyncState''',
+                             fetch=True)[0]
+
+
+class SyncedStorage(VaultStorage):
+    """A storage backend serving the reads from a local replica of the vault.
+
+    Saves are written to the replica and pushed by sync(), the calls that only
+    make sense on the database (the secret word changes, the history, the audit
+    log and the re-encryption) go straight to it and fail while it is offline.
+
+    Attributes:
+        remote (VaultStorage): The database backend.
+        replica (LocalReplica): The local copy of the vault.
+        online (bool): False while the database cannot be reached.
+    """
+
+    def __init__(self, remote, replica) -> None:
+        """Wraps the database backend, nothing is opened yet
+
+        Args:
+            remote (VaultStorage): The database backend.
+            replica (LocalReplica): The local copy of the vault.
+        """
+
+        self.remote = remote
+        self.replica = replica
+        self.online = False
+        self._sync_lock = threading.Lock()
+
+    def _connect_remote(self) -> None:
+        """Connects to the database and brings its schema up to date."""
+
+        self.remote.start_db_connection()
+        self.remote.migrate()
+        self.online = True
+
+    @timed('sync.start_db_connection')
+    def start_db_connection(self) -> None:
+        """Opens the replica and tries the database, being offline is not an error"""
+
+        self.replica.open()
+        try:
+            self._connect_remote()
+        except Exception as error:  # pylint: disable=broad-except
+            self.online = False
+            logger.warning('database unreachable, working offline: %s', type(error).__name__)
+
+    def close_db_connection(self) -> None:
+        """Pushes the queued saves if the database is reachable and closes both"""
+
+        try:
+            if self.online and self.replica.pending(1):
+                self.sync()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning('saves left for the next sync: %s', type(error).__name__)
+        finally:
+            self.remote.close_db_connection()
+            self.replica.close()
+
+    def migrate(self) -> list:
+        """The replica and the database were migrated when they were opened"""
+
+        return []
+
+    @timed('sync.sync')
+    def sync(self) -> tuple:
+        """Pushes the queued saves, then pulls the accounts changed since the watermark
+
+        Raises:
+            Exception: The error of the database backend if it cannot be reached,
+                the saves stay queued.
+
+        Returns:
+            tuple: (number of saves pushed, number of local saves that lost a
+                conflict, number of accounts pulled).
+        """
+
+        with self._sync_lock:
+            if not self.online:
+                self._connect_remote()
+            try:
+                pushed, lost = self._push()
+                pulled = self._pull()
+                self._refresh_secret()
+            except Exception:
+                self.online = False
+                raise
+        if pushed or lost or pulled:
+            logger.info('sync pushed %d saves, dropped %d conflicting ones, '
+                        'pulled %d accounts', pushed, lost, pulled)
+        return pushed, lost, pulled
+
+    def _push(self) -> tuple:
+        """Sends the outbox to the database batch by batch."""
+
+        pushed = lost = 0
+        while entries := self.replica.pending():
+            state = {account.lower(): change_seq
+                     for account, change_seq, _
+                     in self.remote.select_sync_state([entry[1] for entry in entries])}
+            winners = []
+            for _, account, password, fingerprint, base_seq, _ in entries:
+                if resolve_conflict(base_seq, state.get(account.lower())):
+                    winners.append((account, password, fingerprint))
+                else:
+                    logger.warning('another client changed an account saved locally, '
+                                   'the local save was dropped')
+            if winners:
+                self.remote.import_accounts(winners, len(winners))
+            self.replica.remove_pending(entries)
+            pushed += len(winners)
+            lost += len(entries) - len(winners)
+        return pushed, lost
+
+    def _pull(self) -> int:
+        """Copies the accounts changed since the watermark into the replica."""
+
+        pulled = 0
+        while rows := self.remote.select_changes(self.replica.watermark(), SYNC_BATCH_SIZE):
+            self.replica.apply_changes(rows)
+            pulled += len(rows)
+        return pulled
+
+    def _refresh_secret(self) -> None:
+        """Caches the hash of the secret word and the hint of the database."""
+
+        words = self.remote.select_secret_word_from_db()
+        hints = self.remote.select_hint_from_db()
+        if words:
+            word, key_salt, encrypted = words[0]
+            self.replica.save_secret(word, key_salt, encrypted, hints[0][0] if hints else None)
+
+    def _secret(self) -> tuple:
+        """Returns the cached secret word, fetching it once if nothing is cached yet."""
+
+        secret = self.replica.secret()
+        if secret[0] is None:
+            if not self.online:
+                self._connect_remote()
+            self._refresh_secret()
+            secret = self.replica.secret()
+        return secret
+
+    def insert_secret_word_and_hint(self, secret_word, user_hint) -> None:
+        """Saves the hash of the secret word and its hint in the database"""
+
+        self.remote.insert_secret_word_and_hint(secret_word, user_hint)
+        self._refresh_secret()
+
+    def update_secret_word(self, secret_word) -> None:
+        """Replaces the hash of the secret word in the database"""
+
+        self.remote.update_secret_word(secret_word)
+        self._refresh_secret()
+
+    def update_key_salt(self, key_salt) -> None:
+        """Saves the salt of the encryption key in the database unless one was saved already"""
+
+        self.remote.update_key_salt(key_salt)
+        self._refresh_secret()
+
+    def mark_vault_encrypted(self) -> None:
+        """Records in the database that no password of the vault is stored in plaintext"""
+
+        self.remote.mark_vault_encrypted()
+        self._refresh_secret()
+
+    @timed('sync.insert_account_and_password')
+    def insert_account_and_password(self, account, password, fingerprint=None) -> None:
+        """Saves the account in the replica and queues it for the push"""
+
+        self.replica.queue_writes([(account, password, fingerprint)])
+
+    @timed('sync.import_accounts')
+    def import_accounts(self, rows, batch_size=IMPORT_BATCH_SIZE) -> int:
+        """Saves the accounts in the replica batch by batch and queues them for the push"""
+
+        count = 0
+        for batch in batches(with_fingerprints(rows), batch_size):
+            count += self.replica.queue_writes(unique_accounts(batch))
+        return count
+
+    def replace_passwords(self, rows) -> int:
+        """Replaces passwords in the database, the replica gets them on the next pull"""
+
+        return self.remote.replace_passwords(rows)
+
+    @timed('sync.select_accounts_by_fingerprint')
+    def select_accounts_by_fingerprint(self, fingerprint) -> list:
+        """Returns the names of the accounts with the fingerprint"""
+
+        rows = self.replica.query('''SELECT account FROM Accounts
+                                     WHERE fingerprint = ? ORDER BY account''',
+                                  (fingerprint,))
+        return [row[0] for row in rows]
+
+    @timed('sync.select_reused_accounts')
+    def select_reused_accounts(self) -> list:
+        """Returns (fingerprint, account) tuples of shared fingerprints, ordered by fingerprint"""
+
+        return self.replica.query('''SELECT fingerprint, account FROM Accounts
+                                     WHERE fingerprint IN (SELECT fingerprint FROM Accounts
+                                                           WHERE fingerprint IS NOT NULL
+                                                           GROUP BY fingerprint
+                                                           HAVING count(*) > 1)
+                                     ORDER BY fingerprint, account''')
+
+    def insert_audit_events(self, events) -> None:
+        """Appends the events to the audit log of the database"""
+
+        self.remote.insert_audit_events(events)
+
+    def select_unfingerprinted_page(self, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Returns the database's (id, account, password) tuples without a fingerprint"""
+
+        return self.remote.select_unfingerprinted_page(after_id, limit)
+
+    @timed('sync.iter_accounts')
+    def iter_accounts(self, itersize=EXPORT_ITERSIZE):
+        """Yields every (account, password) tuple of the replica"""
+
+        after_id = 0
+        while rows := self.select_accounts_page(after_id, limit=itersize):
+            for _, account, password in rows:
+                yield account, password
+            after_id = rows[-1][0]
+
+    @timed('sync.search_accounts')
+    def search_accounts(self, fragment, limit=SEARCH_LIMIT) -> list:
+        """Returns the names of the accounts matching the fragment, prefix matches first"""
+
+        fragment = fragment.lower()
+        escaped = fragment.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        rows = self.replica.query('''SELECT account FROM Accounts
+                                     WHERE lower(account) LIKE ? ESCAPE '\\'
+                                     ORDER BY lower(account) LIKE ? ESCAPE '\\' DESC,
+                                              account
+                                     LIMIT ?''',
+                                  ('%' + escaped + '%', escaped + '%', limit))
+        return [row[0] for row in rows]
+
+    @timed('sync.select_accounts_page')
+    def select_accounts_page(self, after_id=0, before_id=None,
+                             limit=BROWSER_PAGE_SIZE) -> list:
+        """Returns one page of (id, account, password) tuples of the replica ordered by id"""
+
+        if before_id is not None:
+            rows = self.replica.query('''SELECT id, account, password FROM Accounts
+                                         WHERE id < ? ORDER BY id DESC LIMIT ?''',
+                                      (before_id, limit))
+            return rows[::-1]
+
+        return self.replica.query('''SELECT id, account, password FROM Accounts
+                                     WHERE id > ? ORDER BY id LIMIT ?''',
+                                  (after_id, limit))
+
+    @timed('sync.select_password_from_db')
+    def select_password_from_db(self, account) -> list:
+        """Returns the (account, password) tuples of the account from the replica"""
+
+        return self.replica.query('''SELECT account, password FROM Accounts
+                                     WHERE lower(account) = lower(?)''',
+                                  (account,))
+
+    def select_password_history(self, account) -> list:
+        """Returns the (version, password, replaced_at) tuples kept by the database"""
+
+        return self.remote.select_password_history(account)
+
+    def prune_password_history(self, keep, limit) -> int:
+        """Deletes at most limit versions past the retention limit in the database"""
+
+        return self.remote.prune_password_history(keep, limit)
+
+    def select_plaintext_history_page(self, prefix, after_id=0, limit=IMPORT_BATCH_SIZE) -> list:
+        """Returns the database's old versions saved before encryption"""
+
+        return self.remote.select_plaintext_history_page(prefix, after_id, limit)
+
+    def replace_history_passwords(self, rows) -> int:
+        """Replaces old versions in the database that were not changed since they were read"""
+
+        return self.remote.replace_history_passwords(rows)
+
+    def select_changes(self, after_seq, limit) -> list:
+        """Returns the accounts changed in the database after after_seq"""
+
+        return self.remote.select_changes(after_seq, limit)
+
+    def select_sync_state(self, accounts) -> list:
+        """Returns the (account, change_seq, updated_at) tuples of the database"""
+
+        return self.remote.select_sync_state(accounts)
+
+    def select_hint_from_db(self) -> list:
+        """Returns the cached (hint,) tuples"""
+
+        hint = self._secret()[3]
+        return [(hint,)] if hint is not None else []
+
+    def select_secret_word_from_db(self) -> list:
+        """Returns the cached (word, key_salt, encrypted) tuples"""
+
+        word, key_salt, encrypted, _ = self._secret()
+        return [(word, key_salt, encrypted)] if word is not None else []
+
+    def check_if_secret_word_exists(self) -> bool:
+        """Returns True if a secret word was saved, asking the database if none is cached"""
+
+        return self._secret()[0] is not None
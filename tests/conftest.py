@@ -0,0 +1,23 @@
+"""Shared fixtures of the tests, which run against SQLite without a database server"""
+
+import sys
+
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from sqlite_db import SQLitePasswordManagerDatabase
+
+
+@pytest.fixture
+def sqlite_vault(tmp_path):
+    """A migrated SQLite database holding the vault of the user 'alice'"""
+
+    data_base = SQLitePasswordManagerDatabase(str(tmp_path / 'vault.sqlite3'), user='alice')
+    data_base.migrate()
+    data_base.create_user('alice')
+    yield data_base
+    data_base.close_db_connection()
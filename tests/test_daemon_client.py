@@ -0,0 +1,99 @@
+"""Tests of the reconnection of the daemon client against a scripted daemon"""
+
+import json
+
+import socket
+
+import threading
+
+import pytest
+
+from daemon_client import DaemonClient
+
+
+class ScriptedDaemon:
+    """Answers every request with its op, and can drop connections on request.
+
+    Attributes:
+        received (list): The ops of the requests read, without the authentication.
+        drop_next (int): Number of requests read without an answer, closing the connection.
+        idle_closed (threading.Event): Set once a 'close_idle' request closed its connection.
+    """
+
+    def __init__(self, socket_path) -> None:
+        self.received = []
+        self.drop_next = 0
+        self.idle_closed = threading.Event()
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(socket_path)
+        self._server.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection) -> None:
+        with connection, connection.makefile('rwb') as stream:
+            while line := stream.readline():
+                request = json.loads(line)
+                if request['op'] != 'auth':
+                    self.received.append(request['op'])
+                    if self.drop_next:
+                        self.drop_next -= 1
+                        connection.shutdown(socket.SHUT_RDWR)
+                        return
+                stream.write(json.dumps({'id': request['id'], 'ok': True,
+                                         'result': request['op']}).encode() + b'\n')
+                stream.flush()
+                if request['op'] == 'close_idle':
+                    connection.shutdown(socket.SHUT_RDWR)
+                    self.idle_closed.set()
+                    return
+
+    def close(self) -> None:
+        self._server.close()
+
+
+@pytest.fixture
+def daemon_and_client(tmp_path):
+    token_path = tmp_path / 'token'
+    token_path.write_text('token', encoding='utf-8')
+    daemon = ScriptedDaemon(str(tmp_path / 'daemon.sock'))
+    client = DaemonClient(str(tmp_path / 'daemon.sock'), str(token_path), timeout=5)
+    yield daemon, client
+    client.close()
+    daemon.close()
+
+
+def test_a_write_goes_through_after_the_daemon_closed_the_idle_connection(daemon_and_client):
+    daemon, client = daemon_and_client
+    client.call('close_idle')
+    assert daemon.idle_closed.wait(5)
+
+    assert client.call('add') == 'add'
+    assert daemon.received == ['close_idle', 'add']
+
+
+def test_a_read_whose_response_was_lost_is_sent_again(daemon_and_client):
+    daemon, client = daemon_and_client
+    client.call('get')
+    daemon.drop_next = 1
+
+    assert client.call('get') == 'get'
+    assert daemon.received == ['get', 'get', 'get']
+
+
+def test_a_write_whose_response_was_lost_is_not_sent_again(daemon_and_client):
+    daemon, client = daemon_and_client
+    client.call('get')
+    daemon.drop_next = 1
+
+    with pytest.raises(OSError):
+        client.call('add')
+    assert daemon.received == ['get', 'add']
+    assert client.call('add') == 'add'
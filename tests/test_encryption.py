@@ -0,0 +1,117 @@
+"""Tests of the password encryption and of the encrypting storage wrapper"""
+
+import secrets
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from encryption import EncryptedStorage, VaultCipher, VaultLocked
+from security import hash_secret_word, unlock_vault
+
+
+@pytest.fixture
+def cipher():
+    return VaultCipher(secrets.token_bytes(32))
+
+
+@pytest.fixture
+def vault(sqlite_vault):
+    """An encrypted vault unlocked with the secret word 'word'"""
+
+    sqlite_vault.insert_secret_word_and_hint(hash_secret_word('word'), 'hint')
+    data_base = EncryptedStorage(sqlite_vault)
+    assert unlock_vault(data_base, 'word')
+    return data_base
+
+
+def test_cipher_round_trip(cipher):
+    value = cipher.encrypt('GitHub', 'p4ssw0rd!')
+
+    assert cipher.is_encrypted(value)
+    assert 'p4ssw0rd!' not in value
+    assert cipher.decrypt('GitHub', value) == 'p4ssw0rd!'
+    assert cipher.decrypt('github', value) == 'p4ssw0rd!'
+
+
+def test_cipher_uses_a_new_nonce_for_every_password(cipher):
+    assert cipher.encrypt('github', 'same') != cipher.encrypt('github', 'same')
+
+
+def test_ciphertext_moved_to_another_account_fails(cipher):
+    value = cipher.encrypt('github', 'p4ssw0rd!')
+
+    with pytest.raises(InvalidTag):
+        cipher.decrypt('gitlab', value)
+
+
+def test_ciphertext_of_another_key_fails(cipher):
+    value = VaultCipher(secrets.token_bytes(32)).encrypt('github', 'p4ssw0rd!')
+
+    with pytest.raises(InvalidTag):
+        cipher.decrypt('github', value)
+
+
+def test_plaintext_is_only_accepted_before_the_vault_is_encrypted(cipher):
+    assert cipher.decrypt('github', 'legacy') == 'legacy'
+
+    cipher.accept_plaintext = False
+    with pytest.raises(InvalidTag):
+        cipher.decrypt('github', 'legacy')
+
+
+def test_fingerprints_match_equal_passwords_under_one_key(cipher):
+    other = VaultCipher(secrets.token_bytes(32))
+
+    assert cipher.fingerprint('p4ssw0rd!') == cipher.fingerprint('p4ssw0rd!')
+    assert cipher.fingerprint('p4ssw0rd!') != cipher.fingerprint('p4ssw0rd?')
+    assert cipher.fingerprint('p4ssw0rd!') != other.fingerprint('p4ssw0rd!')
+
+
+def test_locked_storage_refuses_passwords(sqlite_vault):
+    data_base = EncryptedStorage(sqlite_vault)
+
+    with pytest.raises(VaultLocked):
+        data_base.insert_account_and_password('github', 'p4ssw0rd!')
+    with pytest.raises(VaultLocked):
+        data_base.select_password_from_db('github')
+
+
+def test_wrong_secret_word_does_not_unlock(sqlite_vault):
+    sqlite_vault.insert_secret_word_and_hint(hash_secret_word('word'), 'hint')
+    data_base = EncryptedStorage(sqlite_vault)
+
+    assert not unlock_vault(data_base, 'other')
+    assert data_base.cipher is None
+
+
+def test_storage_round_trip_keeps_only_ciphertext(vault, sqlite_vault):
+    vault.insert_account_and_password('GitHub', 'p4ssw0rd!')
+    vault.import_accounts([('gitlab', 'an0ther?'), ('example', 'th1rd!')], 10)
+
+    assert vault.select_password_from_db('github') == [('GitHub', 'p4ssw0rd!')]
+    assert sorted(vault.iter_accounts()) == [('GitHub', 'p4ssw0rd!'),
+                                             ('example', 'th1rd!'),
+                                             ('gitlab', 'an0ther?')]
+    stored = [password for _, password in sqlite_vault.iter_accounts()]
+    assert all(vault.cipher.is_encrypted(password) for password in stored)
+
+
+def test_storage_round_trip_of_the_history(vault, sqlite_vault):
+    for password in ('first', 'second', 'third'):
+        vault.insert_account_and_password('github', password)
+
+    versions = vault.select_password_history('GitHub')
+
+    assert [(version, password) for version, password, _ in versions] == [
+        (3, 'third'), (2, 'second'), (1, 'first')]
+    assert versions[0][2] is None
+    stored = sqlite_vault.select_password_history('github')
+    assert all(vault.cipher.is_encrypted(password) for _, password, _ in stored)
+
+
+def test_unlock_with_the_secret_word_reads_what_an_earlier_session_saved(vault, sqlite_vault):
+    vault.insert_account_and_password('github', 'p4ssw0rd!')
+
+    data_base = EncryptedStorage(sqlite_vault)
+    assert unlock_vault(data_base, 'word')
+    assert data_base.select_password_from_db('github') == [('github', 'p4ssw0rd!')]
@@ -0,0 +1,68 @@
+"""Tests of the password history and of the encryption of old versions"""
+
+from encryption import EncryptedStorage, encrypt_plaintext_rows
+from security import hash_secret_word, unlock_vault
+from storage import compact_history
+
+
+def unlocked(sqlite_vault) -> EncryptedStorage:
+    """Returns the vault unlocked with the secret word 'word'"""
+
+    data_base = EncryptedStorage(sqlite_vault)
+    assert unlock_vault(data_base, 'word')
+    return data_base
+
+
+def test_unchanged_saves_add_no_version(sqlite_vault):
+    sqlite_vault.insert_secret_word_and_hint(hash_secret_word('word'), 'hint')
+    vault = unlocked(sqlite_vault)
+
+    vault.insert_account_and_password('github', 'p4ssw0rd!')
+    vault.insert_account_and_password('GitHub', 'p4ssw0rd!')
+    vault.import_accounts([('github', 'p4ssw0rd!')], 10)
+
+    assert [version for version, _, _ in vault.select_password_history('github')] == [1]
+
+    vault.import_accounts([('github', 'changed')], 10)
+    assert [(version, password) for version, password, _
+            in vault.select_password_history('github')] == [(2, 'changed'), (1, 'p4ssw0rd!')]
+
+
+def test_encryption_pass_encrypts_old_versions_before_marking_the_vault(sqlite_vault):
+    sqlite_vault.insert_secret_word_and_hint(hash_secret_word('word'), 'hint')
+    sqlite_vault.insert_account_and_password('GitHub', 'saved before encryption')
+    vault = unlocked(sqlite_vault)
+    vault.insert_account_and_password('github', 'saved after encryption')
+
+    encrypt_plaintext_rows(vault)
+
+    assert sqlite_vault.select_secret_word_from_db()[0][2]
+    stored = sqlite_vault.select_password_history('github')
+    assert all(vault.cipher.is_encrypted(password) for _, password, _ in stored)
+    vault = unlocked(sqlite_vault)
+    assert not vault.cipher.accept_plaintext
+    assert [password for _, password, _ in vault.select_password_history('github')] == [
+        'saved after encryption', 'saved before encryption']
+
+
+def test_undecryptable_version_is_returned_without_its_password(sqlite_vault):
+    sqlite_vault.insert_secret_word_and_hint(hash_secret_word('word'), 'hint')
+    vault = unlocked(sqlite_vault)
+    vault.mark_vault_encrypted()
+    vault.insert_account_and_password('github', 'first')
+    vault.insert_account_and_password('github', 'second')
+    sqlite_vault._execute("UPDATE PasswordHistory SET password = 'tampered'")
+
+    versions = vault.select_password_history('github')
+
+    assert [(version, password) for version, password, _ in versions] == [
+        (2, 'second'), (1, None)]
+
+
+def test_compaction_keeps_the_newest_versions(sqlite_vault):
+    for number in range(6):
+        sqlite_vault.insert_account_and_password('github', f'password {number}')
+
+    assert compact_history(sqlite_vault, keep=2, batch_size=1) == 3
+    assert [version for version, _, _ in sqlite_vault.select_password_history('github')] == [
+        6, 5, 4]
@@ -0,0 +1,47 @@
+"""Tests of the schema migration runner on SQLite"""
+
+import sqlite3
+
+from migrations import (SCHEMA_VERSION_TABLE, SQLITE_MIGRATIONS, _run_pending,
+                        current_sqlite_version)
+from sqlite_db import SQLitePasswordManagerDatabase
+
+
+def test_migrate_applies_every_migration_in_order(tmp_path):
+    data_base = SQLitePasswordManagerDatabase(str(tmp_path / 'vault.sqlite3'))
+
+    applied = data_base.migrate()
+
+    assert applied == [version for version, _, _ in SQLITE_MIGRATIONS]
+    recorded = data_base._execute('SELECT version FROM schema_version ORDER BY version',
+                                  fetch=True)
+    assert [row[0] for row in recorded] == applied
+    data_base.close_db_connection()
+
+
+def test_migrate_twice_applies_nothing(tmp_path):
+    path = str(tmp_path / 'vault.sqlite3')
+    SQLitePasswordManagerDatabase(path).migrate()
+
+    data_base = SQLitePasswordManagerDatabase(path)
+    assert data_base.migrate() == []
+    data_base.close_db_connection()
+
+
+def test_migrate_upgrades_an_old_schema_and_keeps_its_rows(tmp_path):
+    path = str(tmp_path / 'vault.sqlite3')
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+    cursor.execute(SCHEMA_VERSION_TABLE)
+    _run_pending(cursor, SQLITE_MIGRATIONS[:3], 0, '?')
+    cursor.execute("INSERT INTO Passwords (account, password) VALUES ('github', 'secret')")
+    connection.commit()
+    assert current_sqlite_version(cursor) == 3
+    connection.close()
+
+    data_base = SQLitePasswordManagerDatabase(path)
+    applied = data_base.migrate()
+
+    assert applied == [version for version, _, _ in SQLITE_MIGRATIONS[3:]]
+    assert data_base.select_password_from_db('GitHub') == [('github', 'secret')]
+    data_base.close_db_connection()
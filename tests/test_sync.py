@@ -0,0 +1,76 @@
+"""Tests of the conflict resolution and of the sync of local replicas"""
+
+import time
+
+import pytest
+
+from sqlite_db import SQLitePasswordManagerDatabase
+from sync import LocalReplica, SyncedStorage, resolve_conflict
+
+
+@pytest.mark.parametrize('base_seq, remote_seq, local_wins', [
+    (None, None, True),    # a new account
+    (5, None, True),       # the account is not in the database anymore
+    (5, 5, True),          # nobody else changed it since the pull
+    (7, 5, True),          # nothing in the database is newer than the pull
+    (5, 6, False),         # another client changed it since the pull
+    (None, 1, False),      # another client created it before the first pull
+])
+def test_resolve_conflict(base_seq, remote_seq, local_wins):
+    assert resolve_conflict(base_seq, remote_seq) is local_wins
+
+
+@pytest.fixture
+def clients(sqlite_vault, tmp_path):
+    """Two clients with their own replica of the vault in sqlite_vault"""
+
+    synced = []
+    for name in ('laptop', 'phone'):
+        client = SyncedStorage(SQLitePasswordManagerDatabase(sqlite_vault.path, user='alice'),
+                               LocalReplica(str(tmp_path / f'{name}.sqlite3')))
+        client.start_db_connection()
+        synced.append(client)
+    yield synced
+    for client in synced:
+        client.close_db_connection()
+
+
+def test_saves_reach_the_other_client(clients):
+    laptop, phone = clients
+
+    laptop.insert_account_and_password('github', 'from the laptop')
+    assert laptop.sync() == (1, 0, 1)
+    phone.sync()
+
+    assert phone.select_password_from_db('github') == [('github', 'from the laptop')]
+
+
+def test_the_database_wins_a_conflict_whatever_the_clocks_say(clients, sqlite_vault):
+    laptop, phone = clients
+    laptop.insert_account_and_password('github', 'first')
+    laptop.sync()
+    phone.sync()
+
+    laptop.insert_account_and_password('github', 'laptop')
+    laptop.sync()
+    # The phone's clock is an hour ahead, its save still lost the race
+    phone.replica.queue_writes([('github', 'phone', None)], queued_at=time.time() + 3600)
+    pushed, lost, _ = phone.sync()
+
+    assert (pushed, lost) == (0, 1)
+    assert sqlite_vault.select_password_from_db('github') == [('github', 'laptop')]
+    assert phone.select_password_from_db('github') == [('github', 'laptop')]
+
+
+def test_a_save_after_the_pull_wins(clients, sqlite_vault):
+    laptop, phone = clients
+    laptop.insert_account_and_password('github', 'first')
+    laptop.sync()
+    phone.sync()
+
+    phone.insert_account_and_password('github', 'phone')
+
+    assert phone.sync()[:2] == (1, 0)
+    assert sqlite_vault.select_password_from_db('github') == [('github', 'phone')]
+    laptop.sync()
+    assert laptop.select_password_from_db('github') == [('github', 'phone')]
@@ -0,0 +1,62 @@
+"""Tests of the streaming readers and writers of vault files"""
+
+import io
+
+import json
+
+import pytest
+
+from vault_io import JsonStream, read_accounts, write_accounts
+
+RECORDS = [
+    {'account': 'github', 'password': 'p4ss, "quoted" [and] {braced}'},
+    {'name': 'Ünïcödé ✓', 'login': {'username': 'me', 'password': 'pässwörd ✓'}},
+    {'account': 'numbers', 'password': 'x', 'length': 1234567890, 'score': -12.5e-3},
+    {'account': 'escapes', 'password': 'back\\slash \\" tab\t newline\n'},
+]
+
+
+def records(text, chunk_size):
+    return list(JsonStream(io.StringIO(text), chunk_size).records())
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 1 << 16])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_records_of_a_list_across_every_chunk_boundary(chunk_size, indent):
+    assert records(json.dumps(RECORDS, indent=indent, ensure_ascii=False),
+                   chunk_size) == RECORDS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1 << 16])
+def test_records_under_items_skip_the_other_keys(chunk_size):
+    text = json.dumps({'version': 2, 'folders': [{'items': []}], 'items': RECORDS,
+                       'trailer': {'items': 'not a list'}})
+
+    assert records(text, chunk_size) == RECORDS
+
+
+@pytest.mark.parametrize('text', ['[]', ' [ ] ', '{}', '{"items": []}'])
+def test_empty_files(text):
+    assert records(text, 1) == []
+
+
+@pytest.mark.parametrize('text', ['[{"account": "a"}', '[{"account": "a"} {}]', '"text"'])
+def test_malformed_files_raise(text):
+    with pytest.raises(ValueError):
+        records(text, 2)
+
+
+@pytest.mark.parametrize('suffix', ['.csv', '.json', '.jsonl', '.json.gz'])
+def test_written_accounts_read_back(tmp_path, suffix):
+    rows = [('github', 'p4ss, "quoted"'), ('Ünïcödé', 'pässwörd ✓')]
+    path = str(tmp_path / f'vault{suffix}')
+
+    assert write_accounts(path, iter(rows)) == len(rows)
+    assert list(read_accounts(path)) == rows
+
+
+def test_import_counts_an_account_repeated_in_a_batch_once(sqlite_vault):
+    count = sqlite_vault.import_accounts([('github', 'first'), ('GitHub', 'second')], 10)
+
+    assert count == 1
+    assert sqlite_vault.select_password_from_db('github') == [('GitHub', 'second')]
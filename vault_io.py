@@ -0,0 +1,218 @@
+"""Reading and writing of vault files"""
+
+import csv
+
+import gzip
+
+import json
+
+from pathlib import Path
+
+ACCOUNT_FIELDS = ('account', 'name', 'title', 'url', 'username')
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def open_vault_file(path, mode='r'):
+    """Opens a vault file as text, files ending with .gz are (de)compressed on the fly
+
+    Args:
+        path (str): Path to the file.
+        mode (str): 'r' to read or 'w' to write.
+    """
+
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def vault_format(path) -> str:
+    """Returns the format of the vault file judging by its extension ('csv', 'json' or 'jsonl')"""
+
+    suffixes = [suffix for suffix in Path(path).suffixes if suffix != '.gz']
+    if not suffixes or suffixes[-1].lstrip('.') not in ('csv', 'json', 'jsonl'):
+        raise ValueError(f'Unsupported vault file: {path}')
+    return suffixes[-1].lstrip('.')
+
+
+def record_to_row(record):
+    """Converts a record of an export file to an (account, password) tuple
+
+    Args:
+        record (dict): A record as exported by this or another password manager.
+
+    Returns:
+        tuple: (account, password) or None if the record has no account or password.
+    """
+
+    login = record.get('login') if isinstance(record.get('login'), dict) else {}
+    account = next((record[field] for field in ACCOUNT_FIELDS if record.get(field)), None)
+    password = record.get('password') or login.get('password')
+    if not account or not password:
+        return None
+    return str(account), str(password)
+
+
+class JsonStream:
+    """Decodes the records of a JSON file piece by piece instead of loading it whole.
+
+    Only the records being decoded and one chunk of the file are held in memory.
+
+    Attributes:
+    - vault_file: the text file being read
+    - chunk_size: characters read at a time
+
+    Methods:
+    - records(): yields the records of a top-level list or of the list under 'items'
+    """
+
+    def __init__(self, vault_file, chunk_size=JSON_CHUNK_SIZE) -> None:
+        """Prepares the stream, nothing is read yet."""
+
+        self.vault_file = vault_file
+        self.chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _read_more(self) -> bool:
+        """Appends the next chunk to the buffer, returns False at the end of the file."""
+
+        if self._eof:
+            return False
+        if self._pos > self.chunk_size:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        chunk = self.vault_file.read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer += chunk
+        return True
+
+    def _next_char(self) -> str:
+        """Skips whitespace and returns the next character without consuming it."""
+
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more():
+                raise ValueError('Unexpected end of the JSON file')
+
+    def _expect(self, characters) -> str:
+        """Consumes the next character, which must be one of characters."""
+
+        character = self._next_char()
+        if character not in characters:
+            raise ValueError(f'Expected one of {characters!r} in the JSON file, got {character!r}')
+        self._pos += 1
+        return character
+
+    def _value(self):
+        """Decodes the next value, reading until it is complete."""
+
+        self._next_char()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            if end == len(self._buffer) and self._read_more():
+                continue
+            self._pos = end
+            return value
+
+    def _items(self):
+        """Yields the values of the list starting at the next character."""
+
+        self._expect('[')
+        if self._next_char() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def records(self):
+        """Yields the records of a top-level list or of the list under 'items'."""
+
+        if self._next_char() == '[':
+            yield from self._items()
+            return
+
+        self._expect('{')
+        if self._next_char() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == 'items' and self._next_char() == '[':
+                yield from self._items()
+            else:
+                self._value()
+            if self._expect(',}') == '}':
+                return
+
+
+def read_accounts(path):
+    """Yields (account, password) tuples from a CSV, JSON or JSON Lines file
+
+    Every format is streamed record by record. A JSON file holds a list of
+    records, or an object with such a list under 'items'.
+
+    Args:
+        path (str): Path to the file, optionally gzip compressed.
+    """
+
+    file_format = vault_format(path)
+    with open_vault_file(path) as vault_file:
+        if file_format == 'csv':
+            records = csv.DictReader(vault_file)
+        elif file_format == 'jsonl':
+            records = (json.loads(line) for line in vault_file if line.strip())
+        else:
+            records = JsonStream(vault_file).records()
+
+        for record in records:
+            row = record_to_row(record)
+            if row is not None:
+                yield row
+
+
+def write_accounts(path, rows) -> int:
+    """Writes (account, password) tuples to a CSV, JSON or JSON Lines file
+
+    Rows are written one by one as they are produced, so the rows iterable
+    can stream from the database.
+
+    Args:
+        path (str): Path to the file, compressed with gzip if it ends with .gz.
+        rows (iterable of tuple): The rows to write.
+
+    Returns:
+        int: The number of rows written.
+    """
+
+    file_format = vault_format(path)
+    count = 0
+    with open_vault_file(path, 'w') as vault_file:
+        if file_format == 'csv':
+            writer = csv.writer(vault_file)
+            writer.writerow(('account', 'password'))
+            for count, row in enumerate(rows, start=1):
+                writer.writerow(row)
+        else:
+            separator = '\n' if file_format == 'jsonl' else ',\n'
+            if file_format == 'json':
+                vault_file.write('[\n')
+            for count, (account, password) in enumerate(rows, start=1):
+                if count > 1:
+                    vault_file.write(separator)
+                vault_file.write(json.dumps({'account': account, 'password': password}))
+            vault_file.write('\n]\n' if file_format == 'json' else '\n')
+    return count
@@ -1,7 +1,41 @@
 """Classes for the main user interface"""
 
-from tkinter import Entry, Spinbox, Button, PhotoImage, Label
+from pathlib import Path
+
+from tkinter import Entry, Spinbox, Button, PhotoImage, Label, Listbox, END
+from tkinter import Toplevel, Checkbutton, BooleanVar
 from tkinter import messagebox
+from tkinter import ttk
+
+from config import BROWSER_PAGE_SIZE
+
+IMG_DIR = Path(__file__).resolve().parent / 'img'
+ICONS = ('logo.png', 'hint.png', 'search_button.png', 'generator.png', 'save.png')
+
+_images = {}
+
+
+def load_image(name) -> PhotoImage:
+    """Returns the image from the img directory, every file is read only once.
+
+    The cache also keeps a reference to every image, so Tk never drops one that a
+    widget still shows. Must be called after the Tk root window exists.
+
+    Args:
+        name (str): The file name inside the img directory.
+    """
+
+    image = _images.get(name)
+    if image is None:
+        image = _images[name] = PhotoImage(file=str(IMG_DIR / name))
+    return image
+
+
+def preload_images() -> None:
+    """Loads every icon into the image cache."""
+
+    for name in ICONS:
+        load_image(name)
 
 class MainWidgets:
     """A class that represents the main widgets used in a password manager application.
@@ -16,6 +50,8 @@ class MainWidgets:
         An Entry widget that allows the user to enter a password.
     spinner : tkinter.Spinbox
         A Spinbox widget that allows the user to select a password length.
+    suggestions : tkinter.Listbox
+        A Listbox widget with the accounts matching the typed account name.
 
     Methods:
     --------
@@ -23,6 +59,8 @@ class MainWidgets:
         A method that places widgets on a grid.
     create_spinner(root: tkinter.Tk):
         A method that creates a Spinbox widget and places it on a grid.
+    show_suggestions(accounts: list):
+        A method that lists the suggested accounts, or hides the list if there are none.
     """
 
     def __init__(self) -> None:
@@ -32,6 +70,7 @@ class MainWidgets:
         self.account_entry = Entry(width=21)
         self.password_entry = Entry(width=21)
         self.spinner = None
+        self.suggestions = Listbox(width=21, height=5, activestyle='none')
 
     def grid_items(self) -> None:
         """Arranges the GUI widgets in a grid format."""
@@ -52,6 +91,22 @@ class MainWidgets:
         self.spinner = Spinbox(root, from_=4, to=20, increment=1, width=2)
         self.spinner.grid(column=2, row=3, padx=5)
 
+    def show_suggestions(self, accounts) -> None:
+        """Lists the suggested accounts, or hides the list if there are none.
+
+        Args:
+            accounts (list of str): The accounts to suggest.
+        """
+
+        self.suggestions.delete(0, END)
+        if not accounts:
+            self.suggestions.grid_remove()
+            return
+
+        self.suggestions.insert(END, *accounts)
+        self.suggestions.config(height=min(len(accounts), 5))
+        self.suggestions.grid(column=1, row=5)
+
 
 class Buttons:
     """A class to represent the buttons in the password manager GUI.
@@ -72,6 +127,8 @@ class Buttons:
         The generate password button.
     add_button: tkinter.Button
         The button to save account and password.
+    browse_button: tkinter.Button
+        The button to open the vault browser.
 
     Methods:
     -----------
@@ -79,23 +136,27 @@ class Buttons:
         Creates the 'save account and password' button.
     grid_items():
         Places the buttons in the correct positions on the grid.
+    set_state(state):
+        Enables or disables the buttons that query the database.
     """
 
     def __init__(self):
         """Initializes Buttons with images and buttons."""
 
-        self.hint_button_image = PhotoImage(file='img/hint.png')
+        self.hint_button_image = load_image('hint.png')
         self.hint_button = Button(image=self.hint_button_image, width=32, highlightthickness=0)
 
-        self.search_button_image = PhotoImage(file='img/search_button.png')
+        self.search_button_image = load_image('search_button.png')
         self.search_button = Button(image=self.search_button_image, width=32, highlightthickness=0)
 
-        self.generate_button_image = PhotoImage(file='img/generator.png')
+        self.generate_button_image = load_image('generator.png')
         self.generate_password_button = Button(image=self.generate_button_image,
                                                highlightthickness=0)
 
         self.add_button = None
 
+        self.browse_button = Button(text='Browse vault', highlightthickness=0, width=21)
+
         self.create_add_button()
         self.grid_items()
 
@@ -112,6 +173,18 @@ class Buttons:
         self.hint_button.grid(column=2, row=1)
         self.search_button.grid(column=2, row=2)
         self.generate_password_button.grid(column=3, row=3, padx=5)
+        self.browse_button.grid(column=1, row=6, pady=(0, 10))
+
+    def set_state(self, state):
+        """Enables or disables the buttons that query the database.
+
+        Args:
+            state (str): 'normal' or 'disabled'.
+        """
+
+        for button in (self.hint_button, self.search_button, self.add_button,
+                       self.browse_button):
+            button.config(state=state)
 
 
 class SecretWordUi:
@@ -184,5 +257,128 @@ class SecretWordUi:
     def secret_word_buttons(self):
         """Creates and grids the save button widget."""
 
-        self.save_image = PhotoImage(file='img/save.png')
+        self.save_image = load_image('save.png')
         self.add_secret_word_button = Button(image=self.save_image, highlightthickness=0)
+
+
+class VaultBrowser:
+    """A window that lists the saved accounts one page at a time.
+
+    Only the rows of the current page are loaded and rendered. Pages are loaded
+    through load_page(after_id, before_id, on_loaded), which runs the query in the
+    background and passes the rows of (id, account, password) to on_loaded.
+
+    Attributes:
+    -----------
+    window: tkinter.Toplevel
+        The browser window.
+    tree: tkinter.ttk.Treeview
+        The table of accounts and passwords.
+    show_passwords: tkinter.BooleanVar
+        True if the passwords are shown instead of masked.
+    rows: list
+        The rows of the current page.
+
+    Methods:
+    -----------
+    first_page():
+        Loads the first page.
+    next_page():
+        Loads the page following the current one.
+    previous_page():
+        Loads the page preceding the current one.
+    show_page(rows):
+        Displays a loaded page.
+    render():
+        Fills the table with the rows of the current page.
+    """
+
+    def __init__(self, load_page, page_size=BROWSER_PAGE_SIZE) -> None:
+        """Creates the browser window and loads the first page.
+
+        Parameters:
+            load_page (callable): Loads a page in the background.
+            page_size (int): The number of accounts on a page.
+        """
+
+        self.load_page = load_page
+        self.page_size = page_size
+        self.rows = []
+        self.at_start = True
+
+        self.window = Toplevel()
+        self.window.title('Vault')
+
+        self.tree = ttk.Treeview(self.window, columns=('account', 'password'),
+                                 show='headings', height=page_size)
+        self.tree.heading('account', text='Account')
+        self.tree.heading('password', text='Password')
+        self.tree.grid(column=0, row=0, columnspan=3, padx=10, pady=10)
+
+        self.previous_button = Button(self.window, text='< Previous', command=self.previous_page)
+        self.previous_button.grid(column=0, row=1, pady=(0, 10))
+
+        self.show_passwords = BooleanVar(value=False)
+        Checkbutton(self.window, text='Show passwords', variable=self.show_passwords,
+                    command=self.render).grid(column=1, row=1, pady=(0, 10))
+
+        self.next_button = Button(self.window, text='Next >', command=self.next_page)
+        self.next_button.grid(column=2, row=1, pady=(0, 10))
+
+        self.first_page()
+
+    def first_page(self) -> None:
+        """Loads the first page."""
+
+        self.at_start = True
+        self.load_page(0, None, self.show_page)
+
+    def next_page(self) -> None:
+        """Loads the page following the current one."""
+
+        if self.rows:
+            self.at_start = False
+            self.load_page(self.rows[-1][0], None, self.show_page)
+
+    def previous_page(self) -> None:
+        """Loads the page preceding the current one, or the first page if it is short."""
+
+        if self.rows:
+            self.load_page(None, self.rows[0][0], self.show_previous_page)
+
+    def show_previous_page(self, rows) -> None:
+        """Displays a page loaded backwards."""
+
+        if rows is not None and len(rows) < self.page_size:
+            self.first_page()
+        else:
+            self.show_page(rows)
+
+    def show_page(self, rows) -> None:
+        """Displays a loaded page, the window closes if the vault got locked.
+
+        Parameters:
+            rows (list of tuple): (id, account, password) rows, None if the vault is locked.
+        """
+
+        if not self.window.winfo_exists():
+            return
+        if rows is None:
+            self.window.destroy()
+            return
+        if not rows and self.rows:
+            self.next_button.config(state='disabled')
+            return
+
+        self.rows = rows
+        self.render()
+        self.previous_button.config(state='disabled' if self.at_start else 'normal')
+        self.next_button.config(state='normal' if len(rows) == self.page_size else 'disabled')
+
+    def render(self) -> None:
+        """Fills the table with the rows of the current page."""
+
+        self.tree.delete(*self.tree.get_children())
+        for row_id, account, password in self.rows:
+            shown = password if self.show_passwords.get() else '\u2022' * 8
+            self.tree.insert('', END, iid=str(row_id), values=(account, shown))
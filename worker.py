@@ -0,0 +1,191 @@
+"""Background execution of blocking calls for the Tkinter user interface"""
+
+import queue
+
+import threading
+
+from config import WORKER_POLL_INTERVAL
+
+
+class Job:
+    """A call submitted to the BackgroundWorker.
+
+    Attributes:
+    -----------
+    function: callable
+        the blocking function to run on the worker thread.
+    args: tuple
+        positional arguments for the function.
+    on_success: callable
+        called in the Tk loop with the result of the function.
+    on_error: callable
+        called in the Tk loop with the exception raised by the function.
+    cancelled: bool
+        True if the result of the job must be discarded.
+    busy: bool
+        True if the window shows the busy state while the job is pending.
+    """
+
+    def __init__(self, function, args, on_success=None, on_error=None, busy=True) -> None:
+        """Initializes a job that has not been run yet."""
+
+        self.function = function
+        self.args = args
+        self.on_success = on_success
+        self.on_error = on_error
+        self.cancelled = False
+        self.busy = busy
+
+    def cancel(self) -> None:
+        """Skips the job if it has not started yet and discards its result otherwise."""
+
+        self.cancelled = True
+
+
+class BackgroundWorker:
+    """Runs blocking calls on a worker thread and hands the results back to the Tk loop.
+
+    Jobs run one after another in the order they were submitted. The Tk loop polls
+    the results queue with after() only while jobs are pending, so Tk widgets are
+    only ever touched from the main thread.
+
+    Attributes:
+    -----------
+    root: tkinter.Tk
+        the window whose event loop receives the results.
+    on_busy_change: callable
+        called with True when the first job is submitted and False when all are done.
+    pending: list of Job
+        jobs submitted and not delivered yet.
+    busy: bool
+        True while a busy job that was not cancelled is pending.
+
+    Methods:
+    -----------
+    submit(function, *args, on_success, on_error, busy) -> Job:
+        Queues the function call and returns a handle to cancel it.
+    cancel_busy():
+        Cancels the pending jobs showing the busy state, background jobs keep running.
+    cancel_all():
+        Cancels every pending job.
+    stop():
+        Cancels the pending jobs and stops the worker thread.
+    """
+
+    def __init__(self, root, on_busy_change=None, poll_interval=WORKER_POLL_INTERVAL) -> None:
+        """Starts the worker thread.
+
+        Args:
+            root (tkinter.Tk): The window whose event loop receives the results.
+            on_busy_change (callable): Receives True/False when the busy state changes.
+            poll_interval (int): Milliseconds between polls of the results queue.
+        """
+
+        self.root = root
+        self.on_busy_change = on_busy_change
+        self.poll_interval = poll_interval
+        self.pending = []
+        self.busy = False
+
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._poll_id = None
+
+        self._thread = threading.Thread(target=self._run, name='background-worker', daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args, on_success=None, on_error=None, busy=True) -> Job:
+        """Queues function(*args) to run on the worker thread.
+
+        Args:
+            function (callable): The blocking call.
+            on_success (callable): Receives the result in the Tk loop.
+            on_error (callable): Receives the raised exception in the Tk loop.
+            busy (bool): Show the busy state while the job is pending.
+
+        Returns:
+            Job: The handle of the submitted call.
+        """
+
+        job = Job(function, args, on_success, on_error, busy)
+        self.pending.append(job)
+        self._update_busy()
+
+        self._jobs.put(job)
+        if self._poll_id is None:
+            self._poll_id = self.root.after(self.poll_interval, self._poll)
+        return job
+
+    def cancel_busy(self) -> None:
+        """Cancels the pending jobs showing the busy state, background jobs keep running.
+
+        Background jobs reschedule themselves from their callbacks, which are not
+        called for a cancelled job, so cancelling them would stop them for good.
+        """
+
+        for job in self.pending:
+            if job.busy:
+                job.cancel()
+        self._update_busy()
+
+    def cancel_all(self) -> None:
+        """Cancels every pending job."""
+
+        for job in self.pending:
+            job.cancel()
+        self._update_busy()
+
+    def stop(self) -> None:
+        """Cancels the pending jobs and stops the worker thread."""
+
+        self.cancel_all()
+        self._jobs.put(None)
+        if self._poll_id is not None:
+            self.root.after_cancel(self._poll_id)
+            self._poll_id = None
+
+    def _update_busy(self) -> None:
+        """Notifies on_busy_change when the busy state changes."""
+
+        busy = any(job.busy and not job.cancelled for job in self.pending)
+        if busy != self.busy:
+            self.busy = busy
+            if self.on_busy_change is not None:
+                self.on_busy_change(busy)
+
+    def _run(self) -> None:
+        """Runs the queued jobs on the worker thread."""
+
+        while (job := self._jobs.get()) is not None:
+            result = error = None
+            if not job.cancelled:
+                try:
+                    result = job.function(*job.args)
+                except Exception as exc:  # pylint: disable=broad-except
+                    error = exc
+            self._results.put((job, result, error))
+
+    def _poll(self) -> None:
+        """Delivers the finished jobs in the Tk loop."""
+
+        self._poll_id = None
+        try:
+            while True:
+                try:
+                    job, result, error = self._results.get_nowait()
+                except queue.Empty:
+                    break
+
+                self.pending.remove(job)
+                if job.cancelled:
+                    continue
+                if error is not None:
+                    if job.on_error is None:
+                        raise error
+                    job.on_error(error)
+                elif job.on_success is not None:
+                    job.on_success(result)
+        finally:
+            if self.pending:
+                self._poll_id = self.root.after(self.poll_interval, self._poll)
+            self._update_busy()